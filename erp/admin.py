@@ -13,3 +13,8 @@ admin.site.register(erp_models.GenericBook)
 admin.site.register(erp_models.Book)
 admin.site.register(erp_models.Rental)
 admin.site.register(erp_models.Booking)
+admin.site.register(erp_models.CirculationSummary)
+
+# Operations
+admin.site.register(erp_models.JobRun)
+admin.site.register(erp_models.RequestProfile)
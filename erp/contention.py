@@ -0,0 +1,174 @@
+"""
+Desk contention around hot titles (see the `contention_benchmark` command): concurrent clients, one
+thread and one DB connection each, rent copies of the same few titles, reserve them and return
+them, through RentBook.post, ReserveGenericBook.post and ReturnBook.post called in-process (no
+HTTP, what's measured is the views' transactions and locks).
+
+A failed operation is classified by the SQLSTATE postgres gave: deadlock (40P01), serialization
+failure (40001), constraint (23xxx: the DB refused a write the view let through, e.g. the
+erp_rental_no_overlap exclusion constraint on two rentals of one copy) or error (anything else).
+After the run, check_invariants() looks for what should never be in the tables.
+"""
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from erp import models as erp_models
+from erp import views
+from erp.memo import memo_scope
+
+
+OPERATIONS = ('rent', 'reserve', 'return')
+
+
+def classify(exception):
+    """'deadlock', 'serialization_failure', 'constraint' or 'error'"""
+    pgcode = getattr(exception.__cause__, 'pgcode', None) or getattr(exception, 'pgcode', None)
+    if pgcode == '40P01':
+        return 'deadlock'
+    if pgcode == '40001':
+        return 'serialization_failure'
+    if pgcode and pgcode.startswith('23'):
+        return 'constraint'
+    return 'error'
+
+
+def check_invariants(book_ids=None, user_ids=None):
+    """
+    {invariant: [ids breaking it]} for the copies and users given (default all), empty lists
+    when all is well.
+    - copies_rented_twice: copies with more than one open rental
+    - status_mismatch: copies RENT without an open rental, or with an open rental but
+      another status
+    - copies_booked_twice: BOOKED copies held by more than one booking
+    - over_rent_quota / over_booking_quota: users over MAX_RENT_BOOKS open rentals /
+      MAX_BOOKING_BOOKS waiting bookings
+    - summary_drift: subscribers whose CirculationSummary disagrees with their rentals and bookings
+    """
+    books = erp_models.Book.objects.all()
+    open_rentals = erp_models.Rental.objects.filter(returned_on__isnull=True)
+    bookings = erp_models.Booking.objects.filter(was_cancelled=False)
+    subscribers = erp_models.Subscriber.objects.all()
+    if book_ids is not None:
+        books = books.filter(pk__in=book_ids)
+    if user_ids is not None:
+        subscribers = subscribers.filter(user_id__in=user_ids)
+
+    # the copies' side
+    open_per_book = Counter(open_rentals.filter(book__in=books).values_list('book_id', flat=True))
+    statuses = dict(books.values_list('id', 'status'))
+    holders = Counter(
+        bookings.filter(book__in=books.filter(status='BOOKED')).values_list('book_id', flat=True)
+    )
+    # the users' side
+    users = subscribers.values('user_id')
+    open_per_user = Counter(
+        open_rentals.filter(user_id__in=users).values_list('user_id', flat=True)
+    )
+    waiting_per_user = Counter(
+        bookings.filter(book__isnull=True, user_id__in=users).values_list('user_id', flat=True)
+    )
+
+    expected = erp_models.CirculationSummary.compute()
+    drift = []
+    fields = ('open_rentals_count', 'open_bookings_count', 'next_due_for', 'late_rentals_count')
+    summaries = erp_models.CirculationSummary.objects.filter(subscriber__in=subscribers)
+    for summary in summaries.select_related('subscriber'):
+        values = expected[summary.subscriber.user_id]
+        if any(getattr(summary, field) != values[field] for field in fields):
+            drift.append(summary.subscriber_id)
+
+    return {
+        'copies_rented_twice': sorted(book_id for book_id, nb in open_per_book.items() if nb > 1),
+        'status_mismatch': sorted(
+            book_id for book_id, status in statuses.items()
+            if (status == 'RENT') != (book_id in open_per_book)
+        ),
+        'copies_booked_twice': sorted(book_id for book_id, nb in holders.items() if nb > 1),
+        'over_rent_quota': sorted(
+            user_id for user_id, nb in open_per_user.items() if nb > settings.MAX_RENT_BOOKS
+        ),
+        'over_booking_quota': sorted(
+            user_id for user_id, nb in waiting_per_user.items() if nb > settings.MAX_BOOKING_BOOKS
+        ),
+        'summary_drift': sorted(drift),
+    }
+
+
+class DeskClient(threading.Thread):
+    """
+    A librarian at the desk, doing operations until `deadline` (time.monotonic()) or
+    `operations` of them.
+    weights: {'rent': w, 'reserve': w, 'return': w}
+    subscriber_ids: the subscribers the operations are made for
+    """
+    endpoints = {
+        'rent': views.RentBook.as_view(),
+        'reserve': views.ReserveGenericBook.as_view(),
+        'return': views.ReturnBook.as_view(),
+    }
+
+    def __init__(self, librarian, subscriber_ids, generic_book_ids, book_ids, weights, deadline,
+                 operations, seed):
+        super().__init__(daemon=True)
+        self.librarian = librarian
+        self.subscriber_ids = subscriber_ids
+        self.generic_book_ids = generic_book_ids
+        self.book_ids = book_ids
+        self.weights = weights
+        self.deadline = deadline
+        self.operations = operations
+        self.random = random.Random(seed)
+        self.factory = APIRequestFactory()
+        self.outcomes = defaultdict(Counter)  # {operation: {'ok'|'rejected'|...: count}}
+        self.latencies = defaultdict(list)  # {operation: [ms of the successful ones]}
+
+    def run(self):
+        try:
+            done = 0
+            while done < self.operations and time.monotonic() < self.deadline:
+                self.operate(
+                    self.random.choices(OPERATIONS, [self.weights[op] for op in OPERATIONS])[0]
+                )
+                done += 1
+        finally:
+            if threading.current_thread() is self:  # not when run() is called directly
+                connection.close()  # the thread's own connection
+
+    def operate(self, operation):
+        if operation == 'return':
+            # a copy out, returned for whoever has it
+            rental = erp_models.Rental.objects.filter(
+                book_id__in=self.book_ids, returned_on__isnull=True
+            ).values_list('book_id', 'user__subscriber').order_by('?').first()
+            if rental is None:
+                self.outcomes[operation]['nothing_to_do'] += 1
+                return
+            book_id, sub_pk = rental
+            data = {'book_id': book_id}
+        else:
+            sub_pk = self.random.choice(self.subscriber_ids)
+            if operation == 'rent':
+                data = {'book_id': self.random.choice(self.book_ids)}
+            else:
+                data = {'genericbook_id': self.random.choice(self.generic_book_ids)}
+
+        request = self.factory.post('/api/{}/{}/'.format(operation, sub_pk), data, format='json')
+        force_authenticate(request, user=self.librarian)
+        start = time.perf_counter()
+        try:
+            with memo_scope():  # as MemoScopeMiddleware does for each request
+                response = self.endpoints[operation](request, sub_pk=sub_pk)
+        except Exception as exception:
+            self.outcomes[operation][classify(exception)] += 1
+            return
+        if 200 <= response.status_code < 300:
+            self.outcomes[operation]['ok'] += 1
+            self.latencies[operation].append((time.perf_counter() - start) * 1000)
+        else:
+            self.outcomes[operation]['rejected'] += 1
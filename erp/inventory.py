@@ -0,0 +1,60 @@
+"""
+Rentals as periods of time: "which copies were out on 2018-10-01", "which rentals overlap October".
+
+On postgres, a rental is the range daterange(rent_on, returned_on, '[)'): returned_on excluded,
+open upwards while the copy is out. Migration 0034 forbids two overlapping rentals of the same copy
+with an exclusion constraint, whose GiST index the queries below use: they are written on the same
+expression so that the planner matches it. Other backends get the equivalent date comparisons.
+"""
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import F, Func, OuterRef, Q, Subquery
+
+from erp import models as erp_models
+
+
+class RentalPeriod(Func):
+    """daterange(rent_on, returned_on, '[)'), the expression of erp_rental_no_overlap's index"""
+    function = 'daterange'
+    template = "%(function)s(%(expressions)s, '[)')"
+
+    def __init__(self):
+        # needs psycopg2, so postgres only
+        from django.contrib.postgres.fields import DateRangeField
+        super().__init__(F('rent_on'), F('returned_on'), output_field=DateRangeField())
+
+
+def rentals_overlapping(start, end=None, rentals=None):
+    """The rentals going on at some point of [start, end], or on the day `start` without `end`"""
+    rentals = erp_models.Rental.objects.all() if rentals is None else rentals
+    end = end or start
+    if connection.vendor == 'postgresql':
+        from psycopg2.extras import DateRange
+        return rentals.annotate(period=RentalPeriod()).filter(
+            period__overlap=DateRange(start, end + timedelta(days=1), '[)')
+        )
+    return rentals.filter(
+        Q(returned_on__isnull=True) | Q(returned_on__gt=start), rent_on__lte=end,
+    )
+
+
+def inventory_as_of(day):
+    """
+    The copies the library had on `day`, with .rental_id and .rented_by_id (a User id)
+    of the rental they were out for, None if they were in the library.
+    """
+    covering = rentals_overlapping(
+        day, rentals=erp_models.Rental.objects.filter(book=OuterRef('pk'))
+    ).order_by()
+    return (
+        erp_models.Book.objects
+        .filter(joined_library_on__lte=day)
+        .exclude(left_library_on__lte=day)
+        .select_related('generic_book')
+        .annotate(
+            rental_id=Subquery(covering.values('id')[:1]),
+            rented_by_id=Subquery(covering.values('user_id')[:1]),
+        )
+        .order_by('id')
+    )
@@ -0,0 +1,230 @@
+"""
+Synthetic traffic against a running server (see the `loadgen` command): virtual users, each in its
+own thread, play librarian or subscriber sessions through the HTTP API, with think times between
+the requests, and record the latency and status of each of them.
+
+Sessions:
+- librarian, at the desk: login, browse the catalogue, check a subscriber can rent (GET rent/),
+  rent them a copy (POST rent/), look up the copy, take it back (POST return/), logout.
+  The copy is returned in the same session, so the library's state doesn't drift run after run.
+- subscriber, from home: login, browse the catalogue, a title and its similar ones, reserve
+  one, logout.
+
+Only the standard library is used (urllib, threads): the numbers measure the server, not a
+client framework.
+"""
+import bisect
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+# upper bounds of the latency buckets, in ms (and a last, unbounded one)
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyStats:
+    """
+    Latencies and statuses of the requests, per step. One per virtual user, merged at the
+    end: no lock.
+    """
+
+    def __init__(self):
+        self.latencies = {}  # {step: [ms, ...]}
+        self.statuses = {}  # {step: {status: count}}, status 0 is a connection error
+
+    def add(self, step, status, latency_ms):
+        self.latencies.setdefault(step, []).append(latency_ms)
+        self.add_count(step, status, 1)
+
+    def merge(self, other):
+        for step, latencies in other.latencies.items():
+            self.latencies.setdefault(step, []).extend(latencies)
+        for step, statuses in other.statuses.items():
+            for status, count in statuses.items():
+                self.add_count(step, status, count)
+
+    def add_count(self, step, status, count):
+        step_statuses = self.statuses.setdefault(step, {})
+        step_statuses[status] = step_statuses.get(status, 0) + count
+
+    @property
+    def requests(self):
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+    def errors(self, step=None):
+        """Requests that failed: connection errors and 5xx. 4xx, the API saying no, are apart."""
+        steps = [step] if step else self.statuses
+        return sum(
+            count for s in steps for status, count in self.statuses.get(s, {}).items()
+            if status == 0 or status >= 500
+        )
+
+    def rejections(self, step=None):
+        steps = [step] if step else self.statuses
+        return sum(
+            count for s in steps for status, count in self.statuses.get(s, {}).items()
+            if 400 <= status < 500
+        )
+
+    def all_latencies(self):
+        return [latency for latencies in self.latencies.values() for latency in latencies]
+
+    @staticmethod
+    def percentile(latencies, fraction):
+        if not latencies:
+            return None
+        latencies = sorted(latencies)
+        return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)]
+
+    @staticmethod
+    def histogram(latencies):
+        """[(upper bound in ms or None, count)], one per bucket of BUCKETS_MS"""
+        counts = [0] * (len(BUCKETS_MS) + 1)
+        for latency in latencies:
+            counts[bisect.bisect_left(BUCKETS_MS, latency)] += 1
+        return list(zip(BUCKETS_MS + (None,), counts))
+
+    def summary(self, latencies):
+        return {
+            'requests': len(latencies),
+            'p50_ms': self.percentile(latencies, 0.5),
+            'p95_ms': self.percentile(latencies, 0.95),
+            'p99_ms': self.percentile(latencies, 0.99),
+            'max_ms': max(latencies) if latencies else None,
+        }
+
+
+class Client:
+    """A JSON client of the API, holding the knox token of its session"""
+
+    def __init__(self, base_url, stats, timeout):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.stats = stats
+        self.timeout = timeout
+        self.token = None
+
+    def request(self, step, method, path, data=None):
+        """
+        (status, decoded JSON body or None). Never raises on HTTP or connection errors,
+        they're counted.
+        """
+        body = json.dumps(data).encode() if data is not None else None
+        url = path if path.startswith('http') else self.base_url + path  # next links are absolute
+        request = urllib.request.Request(url, data=body, method=method)
+        request.add_header('Accept', 'application/json')
+        if body is not None:
+            request.add_header('Content-Type', 'application/json')
+        if self.token:
+            request.add_header('Authorization', 'Token ' + self.token)
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as error:
+            status, content = error.code, error.read()
+        except (urllib.error.URLError, OSError):
+            status, content = 0, b''
+        self.stats.add(step, status, (time.perf_counter() - start) * 1000)
+
+        try:
+            return status, json.loads(content.decode()) if content else None
+        except ValueError:
+            return status, None
+
+
+class VirtualUser(threading.Thread):
+    """
+    Plays sessions until `deadline` (time.monotonic()) or `sessions` sessions, whichever
+    comes first.
+    targets: what the sessions act on, read from the DB before the threads start
+        {'subscriber_ids': [...], 'generic_book_ids': [...],
+         'book_ids': [copies this user may rent]}
+    """
+
+    def __init__(self, base_url, role, credentials, targets, think_time, deadline, sessions, seed,
+                 timeout):
+        super().__init__(daemon=True)
+        self.role = role
+        self.username, self.password, self.subscriber_id = credentials
+        self.targets = targets
+        self.think_time = think_time
+        self.deadline = deadline
+        self.sessions = sessions
+        self.random = random.Random(seed)
+        self.stats = LatencyStats()
+        self.client = Client(base_url, self.stats, timeout)
+        self.sessions_done = 0
+
+    def run(self):
+        while self.sessions_done < self.sessions and time.monotonic() < self.deadline:
+            if self.login():
+                if self.role == 'librarian':
+                    self.librarian_session()
+                else:
+                    self.subscriber_session()
+                self.client.request('logout', 'POST', 'logout/')
+                self.client.token = None
+            self.sessions_done += 1
+
+    def think(self):
+        """Exponential pauses: a user reads the page, mean think_time seconds"""
+        if self.think_time:
+            time.sleep(self.random.expovariate(1 / self.think_time))
+
+    def login(self):
+        status, body = self.client.request(
+            'login', 'POST', 'login/', {'username': self.username, 'password': self.password}
+        )
+        if status != 200 or not body:
+            self.think()
+            return False
+        self.client.token = body['token']
+        self.think()
+        return True
+
+    def browse(self):
+        """A few pages of the catalogue, following the paginator's next links"""
+        page = 'generic_books/'
+        for _ in range(self.random.randint(1, 3)):
+            status, body = self.client.request('browse', 'GET', page)
+            self.think()
+            if status != 200 or not isinstance(body, dict) or not body.get('next'):
+                break
+            page = body['next']
+
+    def librarian_session(self):
+        self.browse()
+        sub_id = self.random.choice(self.targets['subscriber_ids'])
+        status, _ = self.client.request('rent_check', 'GET', 'rent/{}/'.format(sub_id))
+        self.think()
+        if status != 200 or not self.targets['book_ids']:
+            return
+        book_id = self.random.choice(self.targets['book_ids'])
+        status, _ = self.client.request(
+            'rent', 'POST', 'rent/{}/'.format(sub_id), {'book_id': book_id}
+        )
+        self.think()
+        if status != 200:
+            return
+        self.client.request('book_detail', 'GET', 'books/{}/'.format(book_id))
+        self.think()
+        self.client.request('return', 'POST', 'return/{}/'.format(sub_id), {'book_id': book_id})
+        self.think()
+
+    def subscriber_session(self):
+        self.browse()
+        generic_book_id = self.random.choice(self.targets['generic_book_ids'])
+        self.client.request('title', 'GET', 'generic_books/{}/'.format(generic_book_id))
+        self.think()
+        self.client.request('similar', 'GET', 'generic_books/{}/similar/'.format(generic_book_id))
+        self.think()
+        self.client.request(
+            'reserve', 'POST', 'reserve/{}/'.format(self.subscriber_id),
+            {'genericbook_id': generic_book_id},
+        )
+        self.think()
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from erp import models as erp_models
+from erp.recommendations import cooccurrence_neighbours
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the "readers also borrowed" table (RelatedGenericBook) from the rental history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Neighbours kept per GenericBook')
+        parser.add_argument('--min-common', type=int, default=2,
+                            help='Readers in common needed to relate two GenericBooks')
+
+    def handle(self, *args, **options):
+        """
+        One pass on the (subscriber, GenericBook) pairs, deduplicated by the DB, then all the
+        similarities at once as a sparse matrix product. The table is replaced in one transaction:
+        readers of the endpoint see either the previous night's neighbours or the new ones.
+        """
+        pairs = list(
+            erp_models.Rental.objects
+            .values_list('user_id', 'book__generic_book_id')
+            .order_by()
+            .distinct()
+        )
+        self.rows_processed = len(pairs)  # (subscriber, GenericBook) pairs, read by the scheduler
+        neighbours = cooccurrence_neighbours(pairs, options['top'], options['min_common'])
+
+        rows = [
+            erp_models.RelatedGenericBook(
+                generic_book_id=generic_book_id,
+                related_generic_book_id=related_id,
+                rank=rank,
+                score=score,
+                common_readers=common_readers,
+            )
+            for generic_book_id, related in neighbours.items()
+            for rank, (related_id, score, common_readers) in enumerate(related, 1)
+        ]
+        with transaction.atomic():
+            erp_models.RelatedGenericBook.objects.all().delete()
+            erp_models.RelatedGenericBook.objects.bulk_create(rows, batch_size=1000)
+
+        self.stdout.write('{} GenericBooks related, {} pairs'.format(len(neighbours), len(rows)))
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from erp import models as erp_models
+from erp.recommendations import content_neighbours
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the similar titles table (SimilarGenericBook) from the GenericBook attributes'
+
+    def handle(self, *args, **options):
+        """
+        `refresh_similar_generic_books` keeps the table up to date, this full rebuild fills it the
+        first time and, run nightly, completes the lists shortened by deleted GenericBooks.
+        """
+        generic_books = list(erp_models.GenericBook.objects.order_by().values_list(
+            'id', 'title', 'author_id', 'genre_id', 'publication_year'
+        ))
+        self.rows_processed = len(generic_books)  # read by the scheduler
+        neighbours = content_neighbours(generic_books, settings.SIMILAR_GENERIC_BOOKS_TOP)
+        erp_models.SimilarGenericBook.replace(neighbours)
+
+        self.stdout.write('{} GenericBooks with similar titles'.format(len(neighbours)))
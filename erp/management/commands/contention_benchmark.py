@@ -0,0 +1,190 @@
+import json
+import time
+from collections import Counter, defaultdict
+
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from erp import models as erp_models
+from erp.contention import OPERATIONS, DeskClient, check_invariants
+from erp.loadgen import LatencyStats
+
+
+class Command(BaseCommand):
+    help = ('Concurrent rents, reservations and returns of a few hot titles: throughput, '
+            'deadlocks, invariants')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16,
+                            help='Concurrent desk clients, one connection each')
+        parser.add_argument('--duration', type=int, default=30, help='Seconds')
+        parser.add_argument('--operations', type=int,
+                            help='Stop each client after that many operations')
+        parser.add_argument('--titles', type=int, default=1, help='Hot titles everybody asks for')
+        parser.add_argument('--copies', type=int, default=5, help='Copies of each hot title')
+        parser.add_argument('--subscribers', type=int, default=50)
+        parser.add_argument('--mix', default='rent=6,reserve=3,return=3',
+                            help='Weights of the operations')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the rows of the run instead of deleting them')
+        parser.add_argument('--json', help='Also write the report as JSON to this file')
+
+    def handle(self, *args, **options):
+        """
+        The run creates its own hot titles, copies, subscribers and librarian (named
+        contention<timestamp>...) and deletes them at the end, it can be pointed at a copy of
+        production. It needs PostgreSQL for more than one client: SQLite serializes the writers,
+        there's no contention to measure. The command fails when an invariant is broken, after the
+        report: usable in a script.
+        """
+        if options['clients'] > 1 and connection.vendor != 'postgresql':
+            raise CommandError(
+                'Concurrent clients need PostgreSQL, this is {}'.format(connection.vendor)
+            )
+        weights = self.parse_mix(options['mix'])
+
+        scenario = self.create_scenario(options)
+        try:
+            deadline = time.monotonic() + options['duration']
+            clients = [
+                DeskClient(
+                    scenario['librarian'], scenario['subscriber_ids'],
+                    scenario['generic_book_ids'], scenario['book_ids'], weights, deadline,
+                    options['operations'] or float('inf'), options['seed'] + i,
+                )
+                for i in range(options['clients'])
+            ]
+            start = time.monotonic()
+            if len(clients) == 1:
+                clients[0].run()  # in this thread, on this connection
+            else:
+                for client in clients:
+                    client.start()
+                for client in clients:
+                    client.join()
+            elapsed = time.monotonic() - start
+
+            invariants = check_invariants(scenario['book_ids'], scenario['user_ids'])
+            report = self.report(clients, elapsed, invariants)
+        finally:
+            if not options['keep']:
+                self.delete_scenario(scenario)
+
+        self.write(report)
+        if options['json']:
+            with open(options['json'], 'w') as out:
+                json.dump(report, out, indent=2)
+        broken = [name for name, ids in invariants.items() if ids]
+        if broken:
+            raise CommandError('Invariants broken: {}'.format(', '.join(broken)))
+
+    def parse_mix(self, mix):
+        try:
+            weights = {op: 0 for op in OPERATIONS}
+            for part in mix.split(','):
+                operation, weight = part.split('=')
+                if operation.strip() not in weights:
+                    raise ValueError
+                weights[operation.strip()] = int(weight)
+        except ValueError:
+            raise CommandError('--mix is like rent=6,reserve=3,return=3')
+        if not any(weights.values()):
+            raise CommandError('--mix has nothing to do')
+        return weights
+
+    def create_scenario(self, options):
+        """Through the models' save(), as the desk would: the summaries and trending rows exist"""
+        tag = 'contention{}'.format(int(time.time()))
+        librarian = User.objects.create(username=tag + '.librarian')
+        librarian.groups.add(Group.objects.get_or_create(name='Librarians')[0])
+        erp_models.Librarian.objects.create(user=librarian, is_manager=False)
+
+        author = erp_models.Author.objects.create(name=tag)
+        genre = erp_models.Genre.objects.create(name=tag[:20])
+        generic_books = [
+            erp_models.GenericBook.objects.create(
+                title='{} hot title {}'.format(tag, i), author=author, genre=genre,
+                publication_year=2018,
+            )
+            for i in range(options['titles'])
+        ]
+        books = [
+            erp_models.Book.objects.create(generic_book=generic_book, status='AVAILABLE')
+            for generic_book in generic_books for _ in range(options['copies'])
+        ]
+        subscribers = []
+        for i in range(options['subscribers']):
+            user = User.objects.create(username='{}.reader{}'.format(tag, i), first_name='Reader')
+            subscribers.append(erp_models.Subscriber.objects.create(
+                user=user, address_number_and_street='1 rue', address_zipcode='75001', iban='FR76',
+            ))
+        return {
+            'tag': tag,
+            'librarian': librarian,
+            'author': author,
+            'genre': genre,
+            'generic_book_ids': [generic_book.pk for generic_book in generic_books],
+            'book_ids': [book.pk for book in books],
+            'subscriber_ids': [subscriber.pk for subscriber in subscribers],
+            'user_ids': [subscriber.user_id for subscriber in subscribers],
+        }
+
+    def delete_scenario(self, scenario):
+        users = User.objects.filter(username__startswith=scenario['tag'] + '.')
+        erp_models.Booking.objects.filter(user__in=users).delete()
+        erp_models.Rental.objects.filter(user__in=users).delete()
+        erp_models.Book.objects.filter(pk__in=scenario['book_ids']).delete()
+        erp_models.GenericBook.objects.filter(pk__in=scenario['generic_book_ids']).delete()
+        scenario['author'].delete()
+        scenario['genre'].delete()
+        users.delete()
+
+    def report(self, clients, elapsed, invariants):
+        outcomes, latencies = defaultdict(Counter), defaultdict(list)
+        for client in clients:
+            for operation, counts in client.outcomes.items():
+                outcomes[operation].update(counts)
+            for operation, values in client.latencies.items():
+                latencies[operation].extend(values)
+
+        def total(outcome):
+            return sum(counts.get(outcome, 0) for counts in outcomes.values())
+
+        return {
+            'clients': len(clients),
+            'duration_s': round(elapsed, 2),
+            'operations': sum(sum(counts.values()) for counts in outcomes.values()),
+            'successful_tps': round(total('ok') / elapsed, 2) if elapsed else None,
+            'deadlocks': total('deadlock'),
+            'serialization_failures': total('serialization_failure'),
+            'constraint_violations': total('constraint'),
+            'errors': total('error'),
+            'per_operation': {
+                operation: dict(
+                    outcomes[operation],
+                    p50_ms=LatencyStats.percentile(latencies[operation], 0.5),
+                    p95_ms=LatencyStats.percentile(latencies[operation], 0.95),
+                )
+                for operation in sorted(outcomes)
+            },
+            'invariants': invariants,
+        }
+
+    def write(self, report):
+        self.stdout.write(
+            '{clients} clients, {duration_s}s: {operations} operations, '
+            '{successful_tps} successful/s, {deadlocks} deadlocks, '
+            '{serialization_failures} serialization failures, '
+            '{constraint_violations} refused by a constraint, {errors} errors'.format(**report)
+        )
+        for operation, row in report['per_operation'].items():
+            self.stdout.write('  {}: {}'.format(operation, ', '.join(
+                '{} {}'.format(key, '-' if value is None else
+                               round(value, 1) if isinstance(value, float) else value)
+                for key, value in sorted(row.items())
+            )))
+        for name, ids in report['invariants'].items():
+            self.stdout.write('  {:<22} {}'.format(
+                name, 'ok' if not ids else 'BROKEN {}'.format(ids)
+            ))
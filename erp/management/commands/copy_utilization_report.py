@@ -0,0 +1,89 @@
+import csv
+import json
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from django.utils.dateparse import parse_date
+from erp import models as erp_models
+from erp.inventory import rentals_overlapping
+from erp.utilization import UtilizationReport
+
+
+class Command(BaseCommand):
+    help = ('Utilization of the copies (rented days / days in the library) over a period, for '
+            'weeding and acquisition')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start',
+                            help='First day of the period (YYYY-MM-DD), default 365 days ago')
+        parser.add_argument('--end', help='Last day of the period (YYYY-MM-DD), default yesterday')
+        parser.add_argument('--by', choices=['title', 'copy'], default='title')
+        parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+        parser.add_argument('--output', help='File to write the report to, default stdout')
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help='Rentals read from the DB and processed at a time')
+
+    def handle(self, *args, **options):
+        """
+        The rentals are streamed (values_list + iterator, a server-side cursor on postgres)
+        and processed by chunks of numpy arrays: memory doesn't grow with the Rental history.
+        """
+        end = self.parse_day(options['end'], date.today() - timedelta(days=1))
+        start = self.parse_day(options['start'], end - timedelta(days=364))
+        if start > end:
+            raise CommandError('--start must be before --end')
+
+        copies = erp_models.Book.objects.filter(
+            Q(left_library_on__isnull=True) | Q(left_library_on__gte=start),
+            joined_library_on__lte=end,
+        ).values_list('id', 'generic_book_id', 'joined_library_on', 'left_library_on')
+        report = UtilizationReport(copies, start, end)
+
+        rentals = rentals_overlapping(start, end).values_list(
+            'book_id', 'rent_on', 'returned_on'
+        ).iterator(chunk_size=options['chunk_size'])
+        chunk = []
+        for rental in rentals:
+            chunk.append(rental)
+            if len(chunk) == options['chunk_size']:
+                report.add_rentals(chunk)
+                chunk = []
+        report.add_rentals(chunk)
+
+        if options['by'] == 'copy':
+            rows = report.per_copy()
+        else:
+            rows = report.per_title(self.queue_lengths())
+        self.write(rows, options['format'], options['output'])
+
+    def parse_day(self, value, default):
+        if not value:
+            return default
+        try:
+            day = parse_date(value)
+        except ValueError:  # well formatted but invalid, e.g. 2018-02-30
+            day = None
+        if day is None:
+            raise CommandError('{} is not a YYYY-MM-DD date'.format(value))
+        return day
+
+    def queue_lengths(self):
+        """{generic_book_id: nb of bookings waiting for a copy}, today"""
+        waiting = erp_models.Booking.objects.filter(book__isnull=True, was_cancelled=False)
+        grouped = waiting.values('generic_book_id').order_by().annotate(nb=Count('id'))
+        return {row['generic_book_id']: row['nb'] for row in grouped}
+
+    def write(self, rows, output_format, path):
+        out = open(path, 'w', newline='') if path else self.stdout
+        try:
+            if output_format == 'json':
+                # in one write, stdout's OutputWrapper ends each write with a newline
+                out.write(json.dumps(rows, indent=2) + '\n')
+            elif rows:
+                writer = csv.DictWriter(out, fieldnames=list(rows[0]), lineterminator='\n')
+                writer.writeheader()
+                writer.writerows(rows)
+        finally:
+            if path:
+                out.close()
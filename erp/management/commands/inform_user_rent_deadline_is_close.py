@@ -1,4 +1,6 @@
 from datetime import date, timedelta
+from itertools import groupby
+
 from django.core.management.base import BaseCommand
 from erp import models as erp_models
 
@@ -13,15 +15,19 @@ class Command(BaseCommand):
         """
         today = date.today()
         four_days_ahead = today + timedelta(days=4)
+        self.rows_processed = 0  # rentals close to their deadline, read by the scheduler
 
-        rent_subs = erp_models.Subscriber.objects.filter(user__rent_books=True)
-        for rent_sub in rent_subs:
-            tight_books = rent_sub.user.rent_books.filter(due_for=four_days_ahead)
-            if tight_books: # if tight_books returns an empty Queryset, it evaluates to False
-                pass
-                # send email using the information of the list
-
-
+        # start from the open rentals (erp_rental_open_due_for_idx), not from every subscriber
+        tight_rentals = (
+            erp_models.Rental.objects
+            .filter(returned_on__isnull=True, due_for=four_days_ahead)
+            .select_related('user', 'book__generic_book')
+            .order_by('user_id')
+        )
+        for user, rentals in groupby(tight_rentals, key=lambda rental: rental.user):
+            tight_books = list(rentals)
+            self.rows_processed += len(tight_books)
+            # send email using the information of the list
 
         # self.stdout.write(self.style.SUCCESS('Successfully updated rents'))
         # replace with logging later
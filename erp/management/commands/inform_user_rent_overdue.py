@@ -1,4 +1,6 @@
-from datetime import date, timedelta
+from datetime import date
+from itertools import groupby
+
 from django.core.management.base import BaseCommand
 from erp import models as erp_models
 
@@ -8,37 +10,35 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         """
-        look for rentals that are overdue (due_for > today):
+        look for rentals that are overdue (due_for < today):
             - email to inform
             - subscriber.has_issue = True
             - rental.late = True
         """
         today = date.today()
-
-        late_subs = (
-            erp_models.Subscriber.objects
-            .exclude(user__rent_books__isnull=True) # can't use model properties in a querysets
-            .filter(user__rent_books__returned_on__isnull=True)
-            .filter(user__rent_books__due_for__gte=today)
+        self.rows_processed = 0  # rentals marked late, read by the scheduler
+
+        # start from the open rentals (erp_rental_open_due_for_idx), not from every subscriber
+        late_rentals = (
+            erp_models.Rental.objects
+            .filter(returned_on__isnull=True, due_for__lt=today)
+            .select_related('user__subscriber', 'book__generic_book')
+            .order_by('user_id')
         )
 
-        for late_sub in late_subs:
+        for user, rentals in groupby(late_rentals, key=lambda rental: rental.user):
             # adjust the subscriber status
-            if not late_sub.has_issue:
-                late_sub.has_issue = True
-                late_sub.save()
+            # (rentals are made through the User model, make sure it's a subscriber's)
+            if hasattr(user, 'subscriber') and not user.subscriber.has_issue:
+                user.subscriber.has_issue = True
+                user.subscriber.save()
 
             # adjust the rental(s) status(es)
-            late_books = (
-                late_sub.user.rent_books
-                .filter(user__rent_books__returned_on__isnull=True)
-                .filter(user__rent_books__due_for__gte=today)
-            )
-
-            for late_book in late_books:
+            for late_book in rentals:
                 if not late_book.late:
                     late_book.late = True
                     late_book.save()
+                    self.rows_processed += 1
 
             # prepare and send email to subscriber
 
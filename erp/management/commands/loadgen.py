@@ -0,0 +1,194 @@
+import json
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from erp import models as erp_models
+from erp.loadgen import LatencyStats, VirtualUser
+
+
+class Command(BaseCommand):
+    help = ('Replay a mix of librarian and subscriber sessions against a running server, report '
+            'throughput and latency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/api/',
+                            help='Root of the erp API')
+        parser.add_argument('--librarian', action='append', default=[],
+                            metavar='USERNAME:PASSWORD',
+                            help='Account the librarian sessions log in with, repeat for several')
+        parser.add_argument('--subscriber', action='append', default=[],
+                            metavar='USERNAME:PASSWORD',
+                            help='Account the subscriber sessions log in with, repeat for several')
+        parser.add_argument('--mix', default='librarian=1,subscriber=4',
+                            help='Share of the virtual users playing each role')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Virtual users, one thread each')
+        parser.add_argument('--duration', type=int, default=60, help='Seconds')
+        parser.add_argument('--sessions', type=int,
+                            help='Stop each virtual user after that many sessions')
+        parser.add_argument('--think-time', type=float, default=2.0,
+                            help='Mean pause between two requests of a user, in seconds (0: none)')
+        parser.add_argument('--timeout', type=float, default=30.0,
+                            help='Seconds before a request is an error')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', help='Also write the report as JSON to this file')
+
+    def handle(self, *args, **options):
+        """
+        The targets (subscribers, copies, titles) are read from the DB before starting: run it with
+        the settings of the server under test. Each librarian virtual user gets its own share of
+        the available copies, two of them never try to rent the same one.
+
+        Errors are the connection errors and 5xx, the 4xx (a subscriber over their booking
+        limit...) are counted apart as rejections: they're the API working.
+        """
+        roles = self.parse_mix(options['mix'], options['concurrency'])
+        accounts = {
+            'librarian': [self.parse_account(account) for account in options['librarian']],
+            'subscriber': [self.parse_account(account) for account in options['subscriber']],
+        }
+        for role in set(roles):
+            if not accounts[role]:
+                raise CommandError(
+                    'The mix has {0} sessions, give at least one --{0} account'.format(role)
+                )
+        targets = self.targets()
+
+        deadline = time.monotonic() + options['duration']
+        sessions = options['sessions'] or float('inf')
+        nb_librarians = roles.count('librarian')
+        users = []
+        for i, role in enumerate(roles):
+            username, password = accounts[role][i % len(accounts[role])]
+            subscriber_id = None
+            if role == 'subscriber':
+                subscriber_id = self.subscriber_id(username)
+            user_targets = dict(targets)
+            if role == 'librarian':
+                rank = roles[:i].count('librarian')
+                user_targets['book_ids'] = targets['book_ids'][rank::nb_librarians]
+            users.append(VirtualUser(
+                options['url'], role, (username, password, subscriber_id), user_targets,
+                options['think_time'], deadline, sessions, options['seed'] + i, options['timeout'],
+            ))
+
+        self.stdout.write('{} virtual users ({}) against {}'.format(
+            len(users),
+            ', '.join('{} {}'.format(roles.count(role), role) for role in sorted(set(roles))),
+            options['url'],
+        ))
+        start = time.monotonic()
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.monotonic() - start
+
+        stats = LatencyStats()
+        for user in users:
+            stats.merge(user.stats)
+        report = self.report(stats, elapsed, sum(user.sessions_done for user in users))
+        self.write(report)
+        if options['json']:
+            with open(options['json'], 'w') as out:
+                json.dump(report, out, indent=2)
+
+    def parse_mix(self, mix, concurrency):
+        """'librarian=1,subscriber=4' -> the role of each virtual user, interleaved"""
+        weights = []
+        try:
+            for part in mix.split(','):
+                role, weight = part.split('=')
+                if role.strip() not in ('librarian', 'subscriber'):
+                    raise ValueError
+                weights.append((role.strip(), int(weight)))
+        except ValueError:
+            raise CommandError('--mix is like librarian=1,subscriber=4')
+        cycle = [role for role, weight in weights for _ in range(weight)]
+        if not cycle or concurrency < 1:
+            raise CommandError('Nobody to play the sessions')
+        return [cycle[i % len(cycle)] for i in range(concurrency)]
+
+    def parse_account(self, account):
+        if ':' not in account:
+            raise CommandError('Accounts are given as USERNAME:PASSWORD')
+        return tuple(account.split(':', 1))
+
+    def subscriber_id(self, username):
+        subscriber = erp_models.Subscriber.objects.filter(user__username=username).first()
+        if not subscriber:
+            raise CommandError('{} is not a subscriber'.format(username))
+        return subscriber.pk
+
+    def targets(self):
+        valid_since = date.today() - timedelta(days=settings.SUBSCRIPTION_DAYS_LENGTH)
+        targets = {
+            'subscriber_ids': list(
+                erp_models.Subscriber.objects
+                .filter(has_issue=False, subscription_date__gt=valid_since)
+                .order_by('?').values_list('pk', flat=True)[:500]
+            ),
+            'generic_book_ids': list(
+                erp_models.GenericBook.objects.order_by('?').values_list('pk', flat=True)[:1000]
+            ),
+            'book_ids': list(
+                erp_models.Book.objects.filter(status='AVAILABLE')
+                .order_by('?').values_list('pk', flat=True)[:1000]
+            ),
+        }
+        if not targets['subscriber_ids'] or not targets['generic_book_ids']:
+            raise CommandError('Load some data first: no active subscriber or no title in the DB')
+        return targets
+
+    def report(self, stats, elapsed, sessions):
+        latencies = stats.all_latencies()
+        return {
+            'duration_s': round(elapsed, 2),
+            'sessions': sessions,
+            'throughput_rps': round(stats.requests / elapsed, 2) if elapsed else None,
+            'errors': stats.errors(),
+            'rejections': stats.rejections(),
+            'error_rate': round(stats.errors() / stats.requests, 4) if stats.requests else None,
+            'total': stats.summary(latencies),
+            'steps': {
+                step: dict(
+                    stats.summary(step_latencies),
+                    errors=stats.errors(step),
+                    rejections=stats.rejections(step),
+                    statuses={
+                        str(status): count
+                        for status, count in sorted(stats.statuses[step].items())
+                    },
+                )
+                for step, step_latencies in sorted(stats.latencies.items())
+            },
+            'histogram': [
+                {'le_ms': bound, 'requests': count} for bound, count in stats.histogram(latencies)
+            ],
+        }
+
+    def write(self, report):
+        def ms(value):
+            return '-' if value is None else '{:.1f}'.format(value)
+
+        self.stdout.write('{requests} requests in {duration}s ({rps} req/s), {sessions} sessions, '
+                          '{errors} errors ({rate:.2%}), {rejections} rejections (4xx)'.format(
+                              requests=report['total']['requests'], duration=report['duration_s'],
+                              rps=report['throughput_rps'], sessions=report['sessions'],
+                              errors=report['errors'], rate=report['error_rate'] or 0,
+                              rejections=report['rejections']))
+        self.stdout.write('{:<12} {:>8} {:>7} {:>7} {:>9} {:>9} {:>9}'.format(
+            'step', 'requests', 'errors', '4xx', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for step, row in report['steps'].items():
+            self.stdout.write('{:<12} {:>8} {:>7} {:>7} {:>9} {:>9} {:>9}'.format(
+                step, row['requests'], row['errors'], row['rejections'],
+                ms(row['p50_ms']), ms(row['p95_ms']), ms(row['p99_ms'])))
+
+        most = max([bucket['requests'] for bucket in report['histogram']] + [1])
+        for bucket in report['histogram']:
+            label = '<= {} ms'.format(bucket['le_ms']) if bucket['le_ms'] else '>  {} ms'.format(
+                report['histogram'][-2]['le_ms'])
+            bar = '#' * (50 * bucket['requests'] // most)
+            self.stdout.write('{:>12} {:>8} {}'.format(label, bucket['requests'], bar))
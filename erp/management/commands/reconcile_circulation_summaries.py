@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from erp import models as erp_models
+
+
+class Command(BaseCommand):
+    help = 'Check the CirculationSummary rows against the rentals and bookings, --fix fixes them'
+
+    fields = ('open_rentals_count', 'open_bookings_count', 'next_due_for', 'late_rentals_count')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rewrite the summaries found wrong')
+
+    def handle(self, *args, **options):
+        """
+        One pass for the whole table: the expected values come from two grouped queries,
+        not from one computation per subscriber.
+        """
+        expected = erp_models.CirculationSummary.compute()
+        summaries = {
+            summary.subscriber_id: summary
+            for summary in erp_models.CirculationSummary.objects.all()
+        }
+        self.rows_processed = 0  # drifting summaries, read by the scheduler
+
+        for subscriber_id, user_id in erp_models.Subscriber.objects.values_list('id', 'user_id'):
+            summary = summaries.get(subscriber_id)
+            values = expected[user_id]
+            if summary and all(getattr(summary, field) == values[field] for field in self.fields):
+                continue
+
+            self.rows_processed += 1
+            self.stdout.write('Subscriber {}: summary {}, expected {}'.format(
+                subscriber_id,
+                {field: getattr(summary, field) for field in self.fields} if summary else None,
+                values,
+            ))
+            if options['fix']:
+                erp_models.CirculationSummary.refresh_for_user(user_id)
+
+        self.stdout.write('{} summaries {}'.format(
+            self.rows_processed, 'fixed' if options['fix'] else 'drifting'
+        ))
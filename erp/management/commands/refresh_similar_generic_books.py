@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from erp import models as erp_models
+
+
+class Command(BaseCommand):
+    help = 'Refresh the similar titles (SimilarGenericBook) of the GenericBooks changed lately'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--overlap', type=int, default=300,
+            help='Seconds before the previous run also looked at, for the late commits',
+        )
+
+    def handle(self, *args, **options):
+        """
+        Saving a GenericBook doesn't refresh its neighbours, that would read the whole catalogue
+        at each write. This job, run every few minutes, does it once for all the titles changed
+        since its previous run (updated_at index). Refreshing a title twice is harmless, hence the
+        overlap rather than a lag: a transaction committed after the run with an older updated_at
+        is caught by the next one.
+        """
+        started_at = timezone.now()
+        mark, _ = erp_models.HighWaterMark.objects.get_or_create(
+            name='refresh_similar_generic_books'
+        )
+        changed = erp_models.GenericBook.objects.all()
+        if mark.last_at:
+            since = mark.last_at - timedelta(seconds=options['overlap'])
+            changed = changed.filter(updated_at__gt=since)
+        changed = list(changed.values_list('id', flat=True))
+
+        with transaction.atomic():
+            if changed:
+                erp_models.SimilarGenericBook.refresh_for(changed)
+            mark.last_at = started_at
+            mark.save()
+
+        self.rows_processed = len(changed)  # GenericBooks refreshed, read by the scheduler
+        self.stdout.write('{} GenericBooks refreshed'.format(len(changed)))
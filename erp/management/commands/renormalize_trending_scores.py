@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from erp import models as erp_models
+
+
+class Command(BaseCommand):
+    help = 'Move the landmark of the TrendingScores to now and rescale the stored scores to it'
+
+    def handle(self, *args, **options):
+        """
+        The forward-decay weights double every TRENDING_HALF_LIFE_DAYS from the landmark, run daily
+        this keeps them close to 1 instead of overflowing the floats a few years on.
+        """
+        rescaled = erp_models.TrendingScore.renormalize()
+        self.rows_processed = rescaled  # TrendingScores rescaled, read by the scheduler
+        self.stdout.write('{} TrendingScores rescaled'.format(rescaled))
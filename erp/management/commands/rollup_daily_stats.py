@@ -0,0 +1,92 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from erp import models as erp_models
+
+
+# DailyCirculationStat field -> (model, date column of the event, extra filter)
+COUNTS = {
+    'rentals_count': (erp_models.Rental, 'rent_on', {}),
+    'returns_count': (erp_models.Rental, 'returned_on', {}),
+    'late_returns_count': (erp_models.Rental, 'returned_on', {'late': True}),
+    'bookings_count': (erp_models.Booking, 'request_made_on', {}),
+    'resolutions_count': (erp_models.Booking, 'book_booked_on', {}),
+    'cancellations_count': (erp_models.Booking, 'cancelled_on', {}),
+}
+# Dates set when the row is updated rather than created. They have no index of their own (it
+# would be written at each rental and booking), the rows are narrowed first on the updated_at
+# index: save() bumps updated_at when it sets them. Writes bypassing save() (queryset.update())
+# aren't seen.
+SET_ON_UPDATE = ('returned_on', 'book_booked_on', 'cancelled_on')
+
+
+class Command(BaseCommand):
+    help = 'Fill the DailyCirculationStat table up to yesterday, after the last day it holds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Recompute from this day (YYYY-MM-DD) instead')
+
+    def handle(self, *args, **options):
+        """
+        Incremental: only the days not bucketed yet are read, through the indexes on the creation
+        dates and on updated_at, so a run costs the circulation of the last day(s), not the whole
+        history.
+        Today isn't complete, it'll be in the next run.
+        """
+        yesterday = date.today() - timedelta(days=1)
+        since = self.first_day(options['since'])
+        self.rows_processed = 0  # days bucketed, read by the scheduler
+        if since is None or since > yesterday:
+            self.stdout.write('Nothing to bucket')
+            return
+
+        # a day of margin, updated_at is a UTC datetime
+        updated_since = timezone.make_aware(datetime.combine(since - timedelta(days=1), time.min))
+        days = defaultdict(dict)
+        for field, (model, date_field, filters) in COUNTS.items():
+            rows = model.objects.filter(**{date_field + '__range': (since, yesterday)}, **filters)
+            if date_field in SET_ON_UPDATE:
+                rows = rows.filter(updated_at__gte=updated_since)
+            rows = rows.values(date_field).order_by().annotate(nb=Count('id'))
+            for row in rows:
+                days[row[date_field]][field] = row['nb']
+
+        # one row per day, even without circulation, so that charts don't have holes
+        nb_days = (yesterday - since).days + 1
+        stats = [
+            erp_models.DailyCirculationStat(day=day, **days[day])
+            for day in (since + timedelta(days=i) for i in range(nb_days))
+        ]
+        with transaction.atomic():
+            erp_models.DailyCirculationStat.objects.filter(day__range=(since, yesterday)).delete()
+            erp_models.DailyCirculationStat.objects.bulk_create(stats)
+
+        self.rows_processed = len(stats)
+        self.stdout.write('{} days bucketed, from {} to {}'.format(len(stats), since, yesterday))
+
+    def first_day(self, since):
+        if since:
+            try:
+                day = parse_date(since)
+            except ValueError:  # well formatted but invalid, e.g. 2018-02-30
+                day = None
+            if day is None:
+                raise CommandError('--since expects a YYYY-MM-DD date')
+            return day
+
+        last_day = erp_models.DailyCirculationStat.objects.aggregate(last=Max('day'))['last']
+        if last_day:
+            return last_day + timedelta(days=1)
+
+        # first run: start with the history
+        firsts = [
+            erp_models.Rental.objects.aggregate(first=Min('rent_on'))['first'],
+            erp_models.Booking.objects.aggregate(first=Min('request_made_on'))['first'],
+        ]
+        firsts = [day for day in firsts if day]
+        return min(firsts) if firsts else None
@@ -0,0 +1,42 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from erp import scheduler
+
+
+class Command(BaseCommand):
+    help = 'Run the scheduled jobs of settings.SCHEDULED_JOBS from one long-lived process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tick', type=int, default=30,
+                            help='Seconds between two looks at the schedule')
+        parser.add_argument('--once', action='store_true',
+                            help='Run the jobs due now, then exit')
+
+    def handle(self, *args, **options):
+        jobs = scheduler.jobs_from_settings(settings.SCHEDULED_JOBS)
+        served = {}
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+
+        self.stdout.write('Scheduler started with {}'.format(', '.join(job.name for job in jobs)))
+        while not self.stopping:
+            # like Django does between two requests, don't keep a broken or expired connection
+            close_old_connections()
+            for run in scheduler.run_pending(jobs, served=served):
+                self.stdout.write(str(run))
+            if options['once']:
+                break
+            try:
+                time.sleep(options['tick'])
+            except KeyboardInterrupt:
+                break
+        self.stdout.write('Scheduler stopped')
+
+    def stop(self, signum, frame):
+        # finish the job in progress, if any, then leave
+        self.stopping = True
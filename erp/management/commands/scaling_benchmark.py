@@ -0,0 +1,170 @@
+import json
+import os
+import time
+
+from django.core.management import call_command, load_command_class
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from erp import models as erp_models
+from erp import scaling
+from erp.memo import memo_scope
+
+
+NIGHTLY_COMMANDS = ('try_book_gbook', 'inform_user_rent_overdue',
+                    'inform_user_rent_deadline_is_close')
+MEASURES = ('seconds', 'queries', 'peak_rss_mb')
+
+
+class Command(BaseCommand):
+    help = ('Run the nightly commands on libraries of growing sizes, fit how their time, queries '
+            'and memory grow')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='0.01,0.03,0.1,0.3',
+                            help='synth_data scales, comma separated')
+        parser.add_argument('--seed', type=int, default=0, help='synth_data seed')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='synth_data rows per INSERT')
+        parser.add_argument('--commands', default=','.join(NIGHTLY_COMMANDS),
+                            help='Comma separated')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Runs of each command per scale, the best one is kept')
+        parser.add_argument('--max-exponent', type=float, default=1.2,
+                            help='Growth exponent of the time or queries above which a command '
+                                 'is flagged')
+        parser.add_argument('--project-scale', type=float, default=1.0,
+                            help='Scale the fitted curves are projected to (1 is the town library '
+                                 'of synth_data)')
+        parser.add_argument('--check', action='store_true', help='Fail when a command is flagged')
+        parser.add_argument('--current-db', action='store_true',
+                            help='Seed the configured DB (it must be empty) instead of a '
+                                 'throwaway one')
+        parser.add_argument('--json', help='Also write the report as JSON to this file')
+
+    def handle(self, *args, **options):
+        """
+        Each scale is seeded by synth_data in a transaction rolled back once measured, and each run
+        of a command in a savepoint rolled back after it: every run sees the same library.
+        The commands run as the scheduler runs them (in a memo scope).
+        Wall time is the best of --repeat runs, the noise of the machine only ever adds time.
+        Peak RSS is reset before each run where the OS allows it (Linux), it is a process-wide
+        figure though.
+        """
+        try:
+            scales = sorted(float(scale) for scale in options['scales'].split(','))
+        except ValueError:
+            raise CommandError('--scales is like 0.01,0.03,0.1')
+        commands = [name.strip() for name in options['commands'].split(',') if name.strip()]
+
+        if options['current_db']:
+            runs = self.measure(scales, commands, options)
+        else:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                runs = self.measure(scales, commands, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = self.report(runs, commands, options)
+        self.write(report)
+        if options['json']:
+            with open(options['json'], 'w') as out:
+                json.dump(report, out, indent=2)
+        flagged = [name for name, fits in report['fits'].items() if fits['flagged']]
+        if flagged and options['check']:
+            raise CommandError('Growing faster than scale ** {}: {}'.format(
+                options['max_exponent'], ', '.join(flagged)
+            ))
+
+    def measure(self, scales, commands, options):
+        """
+        [{'command', 'scale', 'rentals', 'seconds', 'queries', 'peak_rss_mb', 'rows_processed'}]
+        """
+        runs = []
+        for scale in scales:
+            with transaction.atomic():
+                call_command(
+                    'synth_data', '--scale', str(scale), '--seed', str(options['seed']),
+                    '--batch-size', str(options['batch_size']), stdout=open(os.devnull, 'w'),
+                )
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE')
+                rentals = erp_models.Rental.objects.count()
+                for name in commands:
+                    run = {'command': name, 'scale': scale, 'rentals': rentals}
+                    run.update(self.measure_command(name, options['repeat']))
+                    runs.append(run)
+                    self.stderr.write(
+                        '{command} at scale {scale}: {seconds}s, {queries} queries'.format(**run)
+                    )
+                transaction.set_rollback(True)
+        return runs
+
+    def measure_command(self, name, repeat):
+        best = {'seconds': None, 'queries': None, 'peak_rss_mb': None, 'rows_processed': None}
+        for _ in range(repeat):
+            command = load_command_class('erp', name)
+            scaling.reset_peak_rss()
+            reset_queries()
+            with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                with memo_scope():
+                    call_command(command, stdout=open(os.devnull, 'w'))
+                seconds = time.perf_counter() - start
+                transaction.set_rollback(True)
+            if best['seconds'] is None or seconds < best['seconds']:
+                best['seconds'] = round(seconds, 4)
+            best['queries'] = len(queries.captured_queries)
+            best['peak_rss_mb'] = max(best['peak_rss_mb'] or 0, round(scaling.peak_rss_mb(), 1))
+            best['rows_processed'] = getattr(command, 'rows_processed', None)
+        return best
+
+    def report(self, runs, commands, options):
+        fits = {}
+        for name in commands:
+            measured = [run for run in runs if run['command'] == name]
+            fits[name] = {'flagged': []}
+            for measure in MEASURES:
+                fit = scaling.fit_power_law(
+                    [run['scale'] for run in measured], [run[measure] for run in measured]
+                )
+                if fit is None:
+                    fits[name][measure] = None
+                    continue
+                exponent, coefficient, r2 = fit
+                fits[name][measure] = {
+                    'exponent': round(exponent, 2),
+                    'r2': round(r2, 3),
+                    'projected': round(coefficient * options['project_scale'] ** exponent, 2),
+                }
+                if measure != 'peak_rss_mb' and exponent > options['max_exponent']:
+                    fits[name]['flagged'].append(measure)
+        return {'project_scale': options['project_scale'], 'max_exponent': options['max_exponent'],
+                'runs': runs, 'fits': fits}
+
+    def write(self, report):
+        self.stdout.write('{:<36} {:>7} {:>8} {:>10} {:>8} {:>9}'.format(
+            'command', 'scale', 'rentals', 'seconds', 'queries', 'rss (MB)'
+        ))
+        for run in report['runs']:
+            self.stdout.write(
+                '{command:<36} {scale:>7} {rentals:>8} {seconds:>10} {queries:>8} {peak_rss_mb:>9}'
+                .format(**run)
+            )
+        self.stdout.write(
+            'growth as scale ** k, projected to scale {}:'.format(report['project_scale'])
+        )
+        for name, fits in report['fits'].items():
+            parts = [
+                '{} k={exponent} (r2 {r2}, {projected})'.format(measure, **fits[measure])
+                for measure in MEASURES if fits.get(measure)
+            ]
+            flag = ''
+            if fits['flagged']:
+                flag = '  SUPER-LINEAR: {}'.format(', '.join(fits['flagged']))
+            self.stdout.write('  {}: {}{}'.format(
+                name, ', '.join(parts) or 'not enough runs', flag
+            ))
@@ -0,0 +1,111 @@
+import json
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from erp.loadgen import LatencyStats
+from erp.slowlog import read_records
+
+
+class Command(BaseCommand):
+    help = ('Top offenders of the slow query log (see erp/slowlog.py): statements or endpoints '
+            'costing the most time')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.SLOW_QUERY_LOG_PATH,
+                            help='The log, its rotated files are read too '
+                                 '(default SLOW_QUERY_LOG_PATH)')
+        parser.add_argument('--since', type=float, help='Only the last N hours')
+        parser.add_argument('--by', choices=['statement', 'source'], default='statement',
+                            help='Group by normalized statement, or by url name / command')
+        parser.add_argument('--order', choices=['slow_total_ms', 'estimated_total_ms', 'slow'],
+                            default='slow_total_ms')
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--json', help='Also write the report as JSON to this file')
+
+    def handle(self, *args, **options):
+        """
+        slow_total_ms is the time spent in the statements over the threshold.
+        estimated_total_ms adds the sampled ones, scaled by 1 / SLOW_QUERY_SAMPLE_RATE: what the
+        group costs overall, fast statements run very often included.
+        """
+        if not options['path']:
+            raise CommandError('No log: set SLOW_QUERY_LOG_PATH or give --path')
+        since = timezone.now() - timedelta(hours=options['since']) if options['since'] else None
+
+        groups = defaultdict(lambda: {
+            'slow': 0, 'sampled': 0, 'slow_durations': [], 'sampled_ms': 0.0,
+            'sources': Counter(), 'roles': Counter(), 'statements': Counter(), 'slowest': None,
+        })
+        nb_records = 0
+        for record in read_records(options['path']):
+            if since and parse_datetime(record['at']) < since:
+                continue
+            nb_records += 1
+            key = record['fingerprint'] if options['by'] == 'statement' else record['source']
+            group = groups[key]
+            group['sources'][record['source']] += 1
+            group['roles'][record['role']] += 1
+            group['statements'][record['fingerprint']] += 1
+            if record['kind'] == 'slow':
+                group['slow'] += 1
+                group['slow_durations'].append(record['duration_ms'])
+                slowest = group['slowest']
+                if slowest is None or record['duration_ms'] > slowest['duration_ms']:
+                    group['slowest'] = record
+            else:
+                group['sampled'] += 1
+                group['sampled_ms'] += record['duration_ms']
+                if group['slowest'] is None:
+                    group['slowest'] = record  # an example at least
+
+        rows = [self.summarize(key, group, options['by']) for key, group in groups.items()]
+        rows.sort(key=lambda row: row[options['order']], reverse=True)
+        rows = rows[:options['top']]
+
+        self.write(rows, nb_records, options['by'])
+        if options['json']:
+            with open(options['json'], 'w') as out:
+                json.dump(rows, out, indent=2)
+
+    def summarize(self, key, group, by):
+        slow_total = sum(group['slow_durations'])
+        sample_rate = settings.SLOW_QUERY_SAMPLE_RATE
+        example = group['slowest']
+        row = {
+            'key': key,
+            'slow': group['slow'],
+            'sampled': group['sampled'],
+            'slow_total_ms': round(slow_total, 1),
+            'estimated_total_ms': round(
+                slow_total + (group['sampled_ms'] / sample_rate if sample_rate else 0), 1
+            ),
+            'slow_p95_ms': LatencyStats.percentile(group['slow_durations'], 0.95),
+            'slow_max_ms': max(group['slow_durations'], default=None),
+            'sources': dict(group['sources'].most_common(3)),
+            'roles': dict(group['roles']),
+            'sql': example['sql'],
+            'rows': example['rows'],
+            'frames': example['frames'],
+        }
+        if by == 'source':
+            row['statements'] = len(group['statements'])
+        return row
+
+    def write(self, rows, nb_records, by):
+        self.stdout.write('{} records, top {} by {}'.format(nb_records, len(rows), by))
+        for row in rows:
+            self.stdout.write(
+                '{key}: {slow} slow ({slow_total_ms} ms, p95 {slow_p95_ms}, max {slow_max_ms}), '
+                '{sampled} sampled, ~{estimated_total_ms} ms in all'.format(**row)
+            )
+            self.stdout.write('    from {}, as {}'.format(
+                ', '.join('{} ({})'.format(source, nb) for source, nb in row['sources'].items()),
+                ', '.join('{} ({})'.format(role, nb) for role, nb in sorted(row['roles'].items())),
+            ))
+            self.stdout.write('    {}'.format(row['sql'][:300]))
+            for frame in row['frames']:
+                self.stdout.write('      {}'.format(frame))
@@ -0,0 +1,194 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+from erp import models as erp_models
+from erp import query_plans
+from erp.memo import memo_scope
+
+
+SNAPSHOTS_PATH = os.path.join(settings.BASE_DIR, 'erp', 'tests', 'query_plans.json')
+COMMANDS = ('try_book_gbook', 'inform_user_rent_overdue', 'inform_user_rent_deadline_is_close')
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN the queries of the views and the scheduled jobs on a seeded library, '
+            'diffed against snapshots')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snapshots', default=SNAPSHOTS_PATH, help='The committed plans')
+        parser.add_argument('--update', action='store_true',
+                            help='Write the new plans to --snapshots')
+        parser.add_argument('--check', action='store_true',
+                            help='Fail on new sequential scans and cost jumps')
+        parser.add_argument('--cost-ratio', type=float, default=2.0,
+                            help='A cost growing more than that is a jump')
+        parser.add_argument('--min-cost', type=float, default=10.0,
+                            help='Costs below that are never a jump')
+        parser.add_argument('--scale', type=float, default=0.1,
+                            help='synth_data scale of the seeded library')
+        parser.add_argument('--seed', type=int, default=0, help='synth_data seed')
+        parser.add_argument('--current-db', action='store_true',
+                            help='Run on the configured DB as it is, instead of a fresh one '
+                                 'seeded by synth_data')
+
+    def handle(self, *args, **options):
+        """
+        By default the plans come from a throwaway database (the test database of the project),
+        seeded by synth_data with --scale/--seed: same seed, same statistics, same plans. The
+        committed snapshots are made that way, test_query_plans checks them on the test DB
+        seeded alike.
+        The DB is analyzed first, --current-db too: the rows written and rolled back since the
+        last ANALYZE would move the estimates between two runs on the same library.
+        Every request and job runs in a transaction rolled back afterwards, the library doesn't
+        move from one workload to the next.
+        """
+        if connection.vendor != 'postgresql':
+            raise CommandError(
+                'EXPLAIN (FORMAT JSON) is postgres specific, this is {}'.format(connection.vendor)
+            )
+
+        if options['current_db']:
+            plans = self.capture()
+        else:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                call_command(
+                    'synth_data', '--scale', str(options['scale']), '--seed', str(options['seed']),
+                    stdout=open(os.devnull, 'w'),
+                )
+                plans = self.capture()
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['update']:
+            with open(options['snapshots'], 'w') as out:
+                json.dump(plans, out, indent=2, sort_keys=True)
+                out.write('\n')
+            self.stdout.write('{} plans written to {}'.format(len(plans), options['snapshots']))
+            return
+
+        snapshots = {}
+        if os.path.exists(options['snapshots']):
+            with open(options['snapshots']) as snapshots_file:
+                snapshots = json.load(snapshots_file)
+        failures, notes = query_plans.compare(
+            snapshots, plans, options['cost_ratio'], options['min_cost']
+        )
+        for key in sorted(set(failures) | set(notes)):
+            sql = (plans.get(key) or snapshots[key])['sql']
+            self.stdout.write('{}\n    {}'.format(key, sql[:200]))
+            for message in failures.get(key, []):
+                self.stdout.write('    FLAGGED {}'.format(message))
+            for message in notes.get(key, []):
+                self.stdout.write('    {}'.format(message))
+        self.stdout.write(
+            '{} queries, {} flagged, {} with notes'.format(len(plans), len(failures), len(notes))
+        )
+        if failures and options['check']:
+            raise CommandError(
+                '{} queries got a worse plan, see above (--update once it is intended)'.format(
+                    len(failures)
+                )
+            )
+
+    def workloads(self):
+        """(source, callable): the requests of the views, as a manager, then the scheduled jobs"""
+        manager = erp_models.Librarian.objects.filter(
+            is_manager=True,
+        ).select_related('user').first()
+        rental = erp_models.Rental.objects.filter(
+            returned_on__isnull=True, user__subscriber__isnull=False,
+        ).select_related('user__subscriber').first()
+        available_book = erp_models.Book.objects.filter(status='AVAILABLE').first()
+        if not (manager and rental and available_book):
+            raise CommandError(
+                'The library needs a manager, an open rental and an available copy '
+                '(see synth_data)'
+            )
+        subscriber, gbook = rental.user.subscriber, available_book.generic_book
+        sub_pk = {'sub_pk': subscriber.pk}
+
+        requests = [
+            ('GET', 'librarian-list', {}, None),
+            ('GET', 'librarian-detail', {'pk': manager.pk}, None),
+            ('GET', 'subscriber-list', {}, None),
+            ('GET', 'subscriber-detail', {'pk': subscriber.pk}, None),
+            ('GET', 'author-list', {}, None),
+            ('GET', 'author-detail', {'pk': gbook.author_id}, None),
+            ('GET', 'genre-list', {}, None),
+            ('GET', 'genre-detail', {'pk': gbook.genre_id}, None),
+            ('GET', 'generic-book-list', {}, None),
+            ('GET', 'generic-book-detail', {'pk': gbook.pk}, None),
+            ('GET', 'generic-book-related', {'pk': gbook.pk}, None),
+            ('GET', 'generic-book-similar', {'pk': gbook.pk}, None),
+            ('GET', 'book-list', {}, None),
+            ('GET', 'book-detail', {'pk': available_book.pk}, None),
+            ('GET', 'rent', sub_pk, None),
+            ('POST', 'rent', sub_pk, {'book_id': available_book.pk}),
+            ('POST', 'return', sub_pk, {'book_id': rental.book_id}),
+            ('POST', 'reserve', sub_pk, {'genericbook_id': gbook.pk}),
+            ('GET', 'subscriber-bookings', sub_pk, None),
+            ('GET', 'analytics-popular', {}, None),
+            ('GET', 'analytics-timeseries', {}, None),
+            ('GET', 'analytics-acquisitions', {}, None),
+            ('GET', 'analytics-trending', {}, None),
+            ('GET', 'analytics-inventory', {}, None),
+        ]
+        factory = APIRequestFactory()
+
+        def view_request(method, name, kwargs, data):
+            path = reverse(name, kwargs=kwargs)
+            request = getattr(factory, method.lower())(path, data, format='json')
+            force_authenticate(request, user=manager.user)
+            match = resolve(path)
+            # the factory's host, only the test runner allows it (paginated views build URLs
+            # with it)
+            with memo_scope(), override_settings(ALLOWED_HOSTS=['testserver']):
+                match.func(request, *match.args, **match.kwargs)
+
+        for method, name, kwargs, data in requests:
+            yield '{} {}'.format(method, name), (
+                lambda args=(method, name, kwargs, data): view_request(*args)
+            )
+        for command in COMMANDS:
+            yield 'command {}'.format(command), lambda command=command: call_command(
+                command, stdout=open(os.devnull, 'w')
+            )
+
+    def capture(self):
+        """{'<source> <fingerprint>': {'source', 'sql', 'cost', 'tree'}}, the workloads' SELECTs"""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        plans = {}
+        for source, run in self.workloads():
+            with transaction.atomic():
+                reset_queries()
+                with CaptureQueriesContext(connection) as queries:
+                    run()
+                # explained before the rollback, on the rows the workload saw
+                with connection.cursor() as cursor:
+                    for query in queries.captured_queries:
+                        sql = query['sql']
+                        if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                            continue
+                        key = '{} {}'.format(source, query_plans.fingerprint(sql))
+                        if key in plans:
+                            continue
+                        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+                        explain = cursor.fetchone()[0]
+                        if isinstance(explain, str):
+                            explain = json.loads(explain)
+                        plans[key] = dict(
+                            query_plans.normalize_plan(explain), source=source,
+                            sql=query_plans.normalize_sql(sql),
+                        )
+                transaction.set_rollback(True)
+        return plans
@@ -0,0 +1,385 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from erp import models as erp_models
+from erp import synth
+
+
+FIRST_NAMES = ['Anna', 'Louis', 'Marie', 'Paul', 'Jeanne', 'Victor', 'Claire', 'Jules', 'Alice',
+               'Henri', 'Lin', 'Omar', 'Sofia', 'Ivan', 'Maya', 'Hugo', 'Nora', 'Emile', 'Rosa',
+               'Karl']
+LAST_NAMES = ['Martin', 'Bernard', 'Dubois', 'Liu', 'Garcia', 'Novak', 'Smith', 'Rossi',
+              'Kowalski', 'Sato', 'Dupont', 'Moreau', 'Silva', 'Weber', 'Nguyen', 'Haddad',
+              'Olsen', 'Lambert', 'Costa', 'Fontaine']
+ADJECTIVES = ['Silent', 'Lost', 'Red', 'Last', 'Hidden', 'Broken', 'Golden', 'Quiet', 'Northern',
+              'Wild', 'Little', 'Long', 'Secret', 'Distant', 'Burning', 'Empty', 'Winter', 'Open',
+              'Strange', 'Old']
+NOUNS = ['River', 'House', 'Garden', 'War', 'Letters', 'Sea', 'City', 'Road', 'Night', 'Island',
+         'Mountain', 'Orchard', 'Station', 'Kingdom', 'Harbour', 'Forest', 'Summer', 'Map',
+         'Tower', 'Voyage']
+GENRES = ['Fiction', 'Crime', 'Science fiction', 'Fantasy', 'Romance', 'History', 'Biography',
+          'Poetry', 'Travel', 'Science', 'Philosophy', 'Comics', 'Children', 'Cooking', 'Art',
+          'Essays']
+
+CAUSES = [cause for cause, _ in erp_models.Book.CAUSES_BOOK_RETIREMENT]
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """
+    Turn auto_now_add off on these fields for the duration: bulk_create would otherwise overwrite
+    the dates of a whole history (rent_on, request_made_on) with today.
+    """
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = ('Fill an empty library with synthetic titles, copies, subscribers, rentals and '
+            'bookings, for benchmarks')
+
+    # rows at --scale 1, roughly a town library
+    VOLUMES = {
+        'authors': 2000,
+        'titles': 10000,
+        'copies': 25000,
+        'subscribers': 5000,
+        'librarians': 10,
+        'rentals': 100000,
+        'bookings': 10000,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='Multiplies every volume, e.g. 10 or 100')
+        parser.add_argument('--seed', type=int, default=0, help='Same seed, same library')
+        parser.add_argument('--days', type=int, default=730,
+                            help='Days of rental and booking history')
+        parser.add_argument('--popularity-exponent', type=float, default=1.0,
+                            help='Zipf exponent of the titles\' popularity')
+        parser.add_argument('--late-rate', type=float, default=0.08,
+                            help='Share of rentals returned late')
+        parser.add_argument('--password', default='synthpwd',
+                            help='Password of every account created')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per INSERT')
+
+    def handle(self, *args, **options):
+        """
+        Everything goes through bulk_create, by batches, in one transaction: no save(), no signal,
+        no per-row query. So what save() maintains is computed here from the generated rows
+        (CirculationSummary, TrendingScore, Book.status). The other derived tables are left to the
+        nightly jobs: run them (or `run_scheduler`) afterwards.
+
+        Accounts are synth.librarianN@example.org (the first one is a manager) and
+        synth.readerN@example.org.
+        """
+        if (erp_models.GenericBook.objects.exists()
+                or User.objects.filter(username__startswith='synth.').exists()):
+            raise CommandError(
+                'synth_data fills an empty library, this DB already has titles or synth accounts'
+            )
+
+        self.rng = np.random.RandomState(options['seed'])
+        self.today = date.today()
+        self.options = options
+        self.volumes = {
+            name: max(int(volume * options['scale']), 1) for name, volume in self.VOLUMES.items()
+        }
+        self.rows_inserted = 0
+
+        with transaction.atomic():
+            # the scores below are relative to the landmark, moved to now as the nightly job does
+            erp_models.TrendingScore.renormalize()
+            landmark = erp_models.TrendingScore.landmark()
+            self.landmark_day = landmark.toordinal() + (
+                landmark.hour * 3600 + landmark.minute * 60 + landmark.second
+            ) / 86400
+            title_ids, popularity = self.create_titles()
+            copies = self.create_copies(title_ids, popularity)
+            user_ids = self.create_accounts()
+            trending = defaultdict(lambda: [0.0, 0.0])  # {generic_book_id: [rentals, bookings]}
+            with explicit_dates(erp_models.Rental._meta.get_field('rent_on'),
+                                erp_models.Booking._meta.get_field('request_made_on')):
+                self.create_rentals(copies, popularity, title_ids, user_ids, trending)
+                self.create_bookings(copies, popularity, title_ids, user_ids, trending)
+            self.create_summaries(trending)
+
+        self.stdout.write((
+            '{} rows inserted: {} titles, {} copies, {} subscribers, {} rentals, {} bookings'
+        ).format(
+            self.rows_inserted,
+            erp_models.GenericBook.objects.count(),
+            erp_models.Book.objects.count(),
+            erp_models.Subscriber.objects.count(),
+            erp_models.Rental.objects.count(),
+            erp_models.Booking.objects.count(),
+        ))
+
+    def insert(self, model, rows):
+        """bulk_create by batches; returns nothing, pks are read back in id order by the callers"""
+        rows = list(rows)
+        batch_size = self.options['batch_size']
+        for start in range(0, len(rows), batch_size):
+            model.objects.bulk_create(rows[start:start + batch_size])
+        self.rows_inserted += len(rows)
+
+    def pick(self, names, size):
+        return [names[i] for i in self.rng.randint(0, len(names), size=size)]
+
+    def create_titles(self):
+        """The GenericBook ids, by rank of popularity, and their popularity"""
+        nb_authors = self.volumes['authors']
+        names = zip(self.pick(FIRST_NAMES, nb_authors), self.pick(LAST_NAMES, nb_authors))
+        self.insert(erp_models.Author, (
+            erp_models.Author(name='{} {} {}'.format(first, last, i))
+            for i, (first, last) in enumerate(names)
+        ))
+        # the library is empty of titles, not necessarily of authors
+        author_ids = erp_models.Author.objects.order_by('-id').values_list('id', flat=True)
+        author_ids = list(author_ids[:nb_authors])[::-1]
+
+        genre_ids = [erp_models.Genre.objects.get_or_create(name=name)[0].id for name in GENRES]
+        nb_titles = self.volumes['titles']
+        # prolific authors and a few big genres, Zipf again but flatter
+        authors = synth.draw_indexes(
+            np.cumsum(synth.zipf_weights(len(author_ids), 0.8)), nb_titles, self.rng
+        )
+        genres = synth.draw_indexes(
+            np.cumsum(synth.zipf_weights(len(genre_ids), 0.7)), nb_titles, self.rng
+        )
+        years = np.clip(2018 - self.rng.exponential(25, size=nb_titles).astype(int), 1600, 2018)
+        words = zip(self.pick(ADJECTIVES, nb_titles), self.pick(NOUNS, nb_titles))
+        self.insert(erp_models.GenericBook, (
+            erp_models.GenericBook(
+                title='The {} {} {}'.format(adjective, noun, i),
+                author_id=author_ids[authors[i]],
+                genre_id=genre_ids[genres[i]],
+                publication_year=int(years[i]),
+            )
+            for i, (adjective, noun) in enumerate(words)
+        ))
+        title_ids = list(
+            erp_models.GenericBook.objects.order_by('id').values_list('id', flat=True)
+        )
+        return title_ids, synth.zipf_weights(nb_titles, self.options['popularity_exponent'])
+
+    def create_copies(self, title_ids, popularity):
+        """[(book id, title rank, joined_library_on, left_library_on)] in id order"""
+        copies_per_title = synth.spread(self.volumes['copies'], np.sqrt(popularity), self.rng)
+        ranks = np.repeat(np.arange(len(title_ids)), copies_per_title)
+        joined = self.today.toordinal() - self.rng.randint(0, 5 * 365, size=len(ranks))
+        retired = self.rng.random_sample(len(ranks)) < 0.03
+        left = joined + self.rng.randint(1, 5 * 365, size=len(ranks))
+        retired &= left < self.today.toordinal()
+
+        self.insert(erp_models.Book, (
+            erp_models.Book(
+                generic_book_id=title_ids[rank],
+                joined_library_on=date.fromordinal(int(joined[i])),
+                left_library_on=date.fromordinal(int(left[i])) if retired[i] else None,
+                left_library_cause=CAUSES[i % len(CAUSES)] if retired[i] else None,
+                # RENT for the ones out, set once the rentals are in
+                status='RETIRED' if retired[i] else 'AVAILABLE',
+            )
+            for i, rank in enumerate(ranks)
+        ))
+        book_ids = erp_models.Book.objects.order_by('id').values_list('id', flat=True)
+        return [
+            (book_id, int(ranks[i]), int(joined[i]), int(left[i]) if retired[i] else None)
+            for i, book_id in enumerate(book_ids)
+        ]
+
+    def create_accounts(self):
+        """The subscribers' user ids; librarians are created too, the first one a manager"""
+        password = make_password(self.options['password'])  # slow on purpose, hashed once for all
+        nb_librarians, nb_subscribers = self.volumes['librarians'], self.volumes['subscribers']
+        users = [
+            User(username='synth.librarian{}@example.org'.format(i),
+                 email='synth.librarian{}@example.org'.format(i),
+                 first_name=first, last_name=last, password=password)
+            for i, (first, last) in enumerate(zip(self.pick(FIRST_NAMES, nb_librarians),
+                                                  self.pick(LAST_NAMES, nb_librarians)))
+        ] + [
+            User(username='synth.reader{}@example.org'.format(i),
+                 email='synth.reader{}@example.org'.format(i),
+                 first_name=first, last_name=last, password=password)
+            for i, (first, last) in enumerate(zip(self.pick(FIRST_NAMES, nb_subscribers),
+                                                  self.pick(LAST_NAMES, nb_subscribers)))
+        ]
+        self.insert(User, users)
+        ids = list(
+            User.objects.filter(username__startswith='synth.').order_by('id')
+            .values_list('id', flat=True)
+        )
+        librarian_ids, user_ids = ids[:nb_librarians], ids[nb_librarians:]
+
+        groups = {
+            name: Group.objects.get_or_create(name=name)[0].id
+            for name in ('Managers', 'Librarians', 'Subscribers')
+        }
+        Membership = User.groups.through
+        self.insert(Membership, (
+            [Membership(user_id=librarian_ids[0], group_id=groups['Managers'])]
+            + [Membership(user_id=user_id, group_id=groups['Librarians'])
+               for user_id in librarian_ids[1:]]
+            + [Membership(user_id=user_id, group_id=groups['Subscribers']) for user_id in user_ids]
+        ))
+        self.insert(erp_models.Librarian, (
+            erp_models.Librarian(user_id=user_id, is_manager=i == 0)
+            for i, user_id in enumerate(librarian_ids)
+        ))
+        # a quarter of the subscriptions are over
+        subscribed = self.today.toordinal() - self.rng.randint(0, 500, size=nb_subscribers)
+        self.insert(erp_models.Subscriber, (
+            erp_models.Subscriber(
+                user_id=user_id,
+                address_number_and_street='{} rue des {}'.format(
+                    i % 200 + 1, NOUNS[i % len(NOUNS)]
+                ),
+                address_zipcode='{:05d}'.format(75001 + i % 20),
+                iban='FR76{:023d}'.format(i),
+                subscription_date=date.fromordinal(int(subscribed[i])),
+            )
+            for i, user_id in enumerate(user_ids)
+        ))
+        return user_ids
+
+    def trending_weight(self, day):
+        """TrendingScore.weight() of an event at midnight UTC of `day` (an ordinal), no datetime"""
+        return 2.0 ** ((int(day) - self.landmark_day) / settings.TRENDING_HALF_LIFE_DAYS)
+
+    def readers_cdf(self, nb_users):
+        """Some subscribers read a lot, most a little: Zipf over the subscribers, shuffled"""
+        weights = synth.zipf_weights(nb_users, 0.6)
+        return np.cumsum(weights[self.rng.permutation(nb_users)])
+
+    def create_rentals(self, copies, popularity, title_ids, user_ids, trending):
+        """
+        The rentals of each title follow its popularity, split evenly among its copies, then laid
+        on each copy's timeline. A rental not back today stays open (the copy is RENT), at most
+        MAX_RENT_BOOKS of them per subscriber.
+        """
+        today = self.today.toordinal()
+        loan_days = settings.MAX_RENT_DAYS
+        rentals_per_title = self.rng.multinomial(self.volumes['rentals'], popularity)
+        copies_by_rank = defaultdict(list)
+        for copy in copies:
+            copies_by_rank[copy[1]].append(copy)
+        readers = self.readers_cdf(len(user_ids))
+        open_rentals = defaultdict(int)
+        out_book_ids = []
+
+        batch = []
+        for rank, title_copies in copies_by_rank.items():
+            per_copy = self.rng.multinomial(
+                rentals_per_title[rank], [1 / len(title_copies)] * len(title_copies)
+            )
+            for (book_id, _, joined, left), nb_rentals in zip(title_copies, per_copy):
+                first_day = max(joined, today - self.options['days'])
+                # copies in circulation can be out today, their timeline goes past it
+                last_day = left if left else today + loan_days + 1
+                timeline = [
+                    (rent_on, returned_on) for rent_on, returned_on in synth.copy_timeline(
+                        first_day, last_day, nb_rentals, loan_days, self.options['late_rate'],
+                        self.rng,
+                    ) if rent_on <= today
+                ]
+                users = synth.draw_indexes(readers, len(timeline), self.rng)
+                for (rent_on, returned_on), user in zip(timeline, users):
+                    user_id = user_ids[user]
+                    is_open = returned_on > today
+                    if is_open:
+                        if open_rentals[user_id] >= settings.MAX_RENT_BOOKS:
+                            continue
+                        open_rentals[user_id] += 1
+                        out_book_ids.append(book_id)
+                    due_for = rent_on + loan_days
+                    batch.append(erp_models.Rental(
+                        user_id=user_id,
+                        book_id=book_id,
+                        rent_on=date.fromordinal(rent_on),
+                        due_for=date.fromordinal(due_for),
+                        returned_on=None if is_open else date.fromordinal(returned_on),
+                        late=(today if is_open else returned_on) > due_for,
+                    ))
+                    trending[title_ids[rank]][0] += self.trending_weight(rent_on)
+                if len(batch) >= self.options['batch_size']:
+                    self.insert(erp_models.Rental, batch)
+                    batch = []
+        self.insert(erp_models.Rental, batch)
+
+        for start in range(0, len(out_book_ids), self.options['batch_size']):
+            erp_models.Book.objects.filter(
+                pk__in=out_book_ids[start:start + self.options['batch_size']]
+            ).update(status='RENT')
+
+    def create_bookings(self, copies, popularity, title_ids, user_ids, trending):
+        """
+        Bookings of the past were resolved with a copy (a few days' wait) or cancelled;
+        half of those of the last two weeks still wait for a copy, at most MAX_BOOKING_BOOKS
+        per subscriber.
+        """
+        today = self.today.toordinal()
+        nb_bookings = self.volumes['bookings']
+        book_ids_by_rank = defaultdict(list)
+        for book_id, rank, _, _ in copies:
+            book_ids_by_rank[rank].append(book_id)
+        ranks = synth.draw_indexes(np.cumsum(popularity), nb_bookings, self.rng)
+        users = synth.draw_indexes(self.readers_cdf(len(user_ids)), nb_bookings, self.rng)
+        requested = today - self.rng.randint(0, self.options['days'] + 1, size=nb_bookings)
+        outcomes = self.rng.random_sample(nb_bookings)
+        delays = self.rng.geometric(1 / 3, size=nb_bookings)
+        waiting = defaultdict(int)
+
+        bookings = []
+        draws = zip(ranks, users, requested, outcomes, delays)
+        for rank, user, request_made_on, outcome, delay in draws:
+            user_id = user_ids[user]
+            booking = erp_models.Booking(
+                user_id=user_id, generic_book_id=title_ids[rank],
+                request_made_on=date.fromordinal(int(request_made_on)),
+            )
+            if (today - request_made_on < 14 and outcome < 0.5
+                    and waiting[user_id] < settings.MAX_BOOKING_BOOKS):
+                waiting[user_id] += 1
+            elif outcome > 0.9:
+                booking.was_cancelled = True
+                booking.cancelled_on = date.fromordinal(int(min(request_made_on + delay, today)))
+            else:
+                book_ids = book_ids_by_rank[rank]
+                booking.book_id = book_ids[int(delay) % len(book_ids)]
+                booking.book_booked_on = date.fromordinal(
+                    int(min(request_made_on + delay - 1, today))
+                )
+            bookings.append(booking)
+            trending[title_ids[rank]][1] += self.trending_weight(request_made_on)
+        self.insert(erp_models.Booking, bookings)
+
+    def create_summaries(self, trending):
+        """What Rental.save() and Booking.save() would have maintained"""
+        expected = erp_models.CirculationSummary.compute()
+        self.insert(erp_models.CirculationSummary, (
+            erp_models.CirculationSummary(subscriber_id=subscriber_id, **expected[user_id])
+            for subscriber_id, user_id in erp_models.Subscriber.objects.filter(
+                user__username__startswith='synth.'
+            ).values_list('id', 'user_id')
+        ))
+        self.insert(erp_models.TrendingScore, (
+            erp_models.TrendingScore(
+                generic_book_id=generic_book_id, rentals_score=rentals_score,
+                bookings_score=bookings_score, score=rentals_score + bookings_score,
+            )
+            for generic_book_id, (rentals_score, bookings_score) in trending.items()
+        ))
@@ -8,6 +8,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **kwargs):
         # log the beginning of the job
+        self.rows_processed = 0  # resolved bookings, read by the scheduler
 
         subs_with_non_resolved_bookings = erp_models.Subscriber.objects.filter(
             user__bookings__book__isnull=True,
@@ -41,6 +42,7 @@ class Command(BaseCommand):
                     book.save()
 
                     resolved_bookings.append(booking)
+                    self.rows_processed += 1
 
             # format and send an email to the subscriber for his resolved bookings
 
@@ -0,0 +1,105 @@
+"""
+Memoization of model properties, scoped to a request or a unit of work.
+
+Properties like Subscriber.current_rentals or Book.current_rental hit the DB at each access,
+and a view easily reads them several times. Within a memo scope (opened by MemoScopeMiddleware
+for each request, by the scheduler for each job, or by hand with `with memo_scope():`),
+the first access computes the value and the next ones reuse it, whatever the model instance:
+values are keyed by what they describe (e.g. ('user', 3)), not by the python object.
+So only properties computed from the DB can be memoized, not the ones reading fields of the
+instance (Subscriber.can_rent reads has_issue, possibly edited and not saved yet).
+Unsaved instances (no key yet) aren't memoized.
+
+Outside a scope, the properties behave as before, nothing is cached.
+
+Writes going through the models' own methods (save(), delete(), didnt_follow_rules()...)
+call `invalidate()` for what they change. Writes that bypass them (queryset.update())
+leave the current scope stale, don't mix them with memoized reads in the same request.
+"""
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db import connection
+from django.db.models.query import QuerySet
+
+
+INSTRUMENTATION = True  # not a call site, see slowlog.code_frames()
+_local = threading.local()
+
+
+class MemoScope:
+    def __init__(self):
+        self.values = {}  # {(namespace, key): {property name: (value, nb of queries it took)}}
+        self.hits = 0
+        self.misses = 0
+        self.saved_queries = 0
+
+
+def current_scope():
+    return getattr(_local, 'scope', None)
+
+
+@contextmanager
+def memo_scope():
+    """Open a scope, unless one is already open (a job calling a view...): then reuse it"""
+    scope = current_scope()
+    if scope is not None:
+        yield scope
+        return
+
+    _local.scope = scope = MemoScope()
+    try:
+        yield scope
+    finally:
+        _local.scope = None
+
+
+def invalidate(namespace, key):
+    scope = current_scope()
+    if scope is not None:
+        scope.values.pop((namespace, key), None)
+
+
+def memoized_property(namespace, key_attr):
+    """
+    Like @property, memoized in the current scope under (namespace, getattr(instance, key_attr)).
+
+    QuerySets are evaluated right away, so that .count(), bool() or a loop on the
+    memoized value use the fetched rows instead of querying again.
+    """
+    def decorator(func):
+        @wraps(func)
+        def getter(instance):
+            scope = current_scope()
+            key = getattr(instance, key_attr)
+            if scope is None or key is None:
+                return func(instance)
+
+            memo = scope.values.setdefault((namespace, key), {})
+            if func.__name__ in memo:
+                value, nb_queries = memo[func.__name__]
+                scope.hits += 1
+                scope.saved_queries += nb_queries
+                return value
+
+            scope.misses += 1
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                value = func(instance)
+                if isinstance(value, QuerySet):
+                    len(value)
+            memo[func.__name__] = (value, counter.count)
+            return value
+
+        return property(getter)
+    return decorator
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
@@ -0,0 +1,264 @@
+"""
+In-process metrics, exported in the Prometheus text format by /api/metrics/ (see views.Metrics).
+
+Counters and histograms live in the memory of the process, each behind its own lock: an increment
+is a dict update under a lock, cheap and safe with a multi-threaded WSGI server. With several
+worker processes, each one has its own numbers, a scrape reads the worker that serves it
+(Prometheus sums the series of its targets, run one target per worker or a single-process server).
+
+Filled by MetricsMiddleware for each request:
+- library_http_requests_total{method, url_name, status}
+- library_http_request_duration_seconds{method, url_name}
+- library_db_queries_per_request / library_db_seconds_per_request{method, url_name}
+- library_memo_hits_total / library_memo_misses_total, the memoized properties (see erp/memo.py)
+- library_auth_failures_total{reason}: unauthenticated (401), forbidden (403), bad_credentials
+  (login refused)
+The scheduled jobs run in another process (run_scheduler), their figures are read from JobRun at
+scrape time.
+
+url_name is the name of the url in erp/urls.py, never the path: the ids in the paths would make one
+series per row.
+"""
+import threading
+import time
+
+from django.db import connection
+from django.db.models import Count, Max, Q
+
+from erp import models as erp_models
+from erp.memo import memo_scope
+
+
+INSTRUMENTATION = True  # not a call site, see slowlog.code_frames()
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}  # {label values: value}
+
+    def label_values(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def format_labels(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(
+            label, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        ) for label, value in pairs) + '}'
+
+    def expose(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help_text),
+            '# TYPE {} {}'.format(self.name, self.kind),
+        ]
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            lines.extend(self.sample_lines(label_values, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def sample_lines(self, label_values, value):
+        return ['{}{} {}'.format(self.name, self.format_labels(label_values), value)]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # per bucket (not cumulated, that's done on exposition), then +Inf, then the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def sample_lines(self, label_values, counts):
+        lines, cumulated = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulated += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name, self.format_labels(label_values, [('le', str(bound))]), cumulated
+            ))
+        labels = self.format_labels(label_values)
+        lines.append('{}_sum{} {}'.format(self.name, labels, round(counts[-1], 6)))
+        lines.append('{}_count{} {}'.format(self.name, labels, cumulated))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs):
+        self.metrics.append(Counter(*args, **kwargs))
+        return self.metrics[-1]
+
+    def histogram(self, *args, **kwargs):
+        self.metrics.append(Histogram(*args, **kwargs))
+        return self.metrics[-1]
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return lines
+
+
+registry = Registry()
+requests_total = registry.counter(
+    'library_http_requests_total', 'HTTP requests served', ('method', 'url_name', 'status'),
+)
+request_duration = registry.histogram(
+    'library_http_request_duration_seconds', 'Time to serve a request', ('method', 'url_name'),
+)
+db_queries = registry.histogram(
+    'library_db_queries_per_request', 'SQL queries run by a request', ('method', 'url_name'),
+    QUERY_BUCKETS,
+)
+db_seconds = registry.histogram(
+    'library_db_seconds_per_request', 'Time a request spent in SQL queries',
+    ('method', 'url_name'),
+)
+memo_hits = registry.counter(
+    'library_memo_hits_total', 'Memoized properties read from the memo scope',
+)
+memo_misses = registry.counter('library_memo_misses_total', 'Memoized properties computed')
+memo_saved_queries = registry.counter(
+    'library_memo_saved_queries_total', 'SQL queries saved by the memo scopes',
+)
+auth_failures = registry.counter('library_auth_failures_total', 'Refused requests', ('reason',))
+
+
+class QueryTimer:
+    """execute_wrapper adding up the number and the duration of the queries"""
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+def auth_failure_reason(request, response):
+    if response.status_code == 401:
+        return 'unauthenticated'
+    if response.status_code == 403:
+        return 'forbidden'
+    match = getattr(request, 'resolver_match', None)
+    if response.status_code == 400 and match is not None and match.url_name == 'login':
+        return 'bad_credentials'
+    return None
+
+
+class MetricsMiddleware:
+    """
+    Before MemoScopeMiddleware: the memo scope is opened here, the one of MemoScopeMiddleware
+    reuses it, its hits are still readable once the response is back.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with memo_scope() as scope, connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        labels = {
+            'method': request.method,
+            'url_name': (match.url_name or 'unnamed') if match is not None else 'unmatched',
+        }
+        requests_total.inc(status=response.status_code, **labels)
+        request_duration.observe(elapsed, **labels)
+        db_queries.observe(timer.count, **labels)
+        db_seconds.observe(timer.seconds, **labels)
+        memo_hits.inc(scope.hits)
+        memo_misses.inc(scope.misses)
+        memo_saved_queries.inc(scope.saved_queries)
+        reason = auth_failure_reason(request, response)
+        if reason:
+            auth_failures.inc(reason=reason)
+        return response
+
+
+def job_lines():
+    """The scheduled jobs' figures from JobRun: runs and failures, then the last run of each job"""
+    lines = [
+        '# HELP library_job_runs_total Runs of the scheduled jobs recorded in JobRun',
+        '# TYPE library_job_runs_total counter',
+    ]
+    per_job = list(erp_models.JobRun.objects.values('job_name').annotate(
+        runs=Count('id'), failures=Count('id', filter=Q(has_failed=True)),
+        last_started_at=Max('started_at'),
+    ).order_by('job_name'))
+    for job in per_job:
+        lines.append('library_job_runs_total{{job="{}"}} {}'.format(job['job_name'], job['runs']))
+    lines += [
+        '# HELP library_job_failures_total Failed runs of the scheduled jobs',
+        '# TYPE library_job_failures_total counter',
+    ]
+    for job in per_job:
+        lines.append(
+            'library_job_failures_total{{job="{}"}} {}'.format(job['job_name'], job['failures'])
+        )
+
+    last_started = {job['job_name']: job['last_started_at'] for job in per_job}
+    last = {}
+    for job_name, started_at, duration, rows_processed in erp_models.JobRun.objects.filter(
+        started_at__in=last_started.values(),
+    ).values_list('job_name', 'started_at', 'duration', 'rows_processed'):
+        if last_started[job_name] == started_at:
+            last[job_name] = (duration, rows_processed)
+    for name, help_text, index in (
+        ('library_job_last_duration_seconds', 'Duration of the last run of the job', 0),
+        ('library_job_last_rows_processed', 'Rows processed by the last run of the job', 1),
+    ):
+        lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} gauge'.format(name)]
+        for job_name, values in sorted(last.items()):
+            value = values[index]
+            if value is None:
+                continue
+            if index == 0:
+                value = round(value.total_seconds(), 3)
+            lines.append('{}{{job="{}"}} {}'.format(name, job_name, value))
+    return lines
+
+
+def exposition():
+    return '\n'.join(registry.expose() + job_lines()) + '\n'
@@ -0,0 +1,28 @@
+import logging
+
+from django.conf import settings
+
+from erp.memo import memo_scope
+
+
+INSTRUMENTATION = True  # not a call site, see slowlog.code_frames()
+logger = logging.getLogger(__name__)
+
+
+class MemoScopeMiddleware:
+    """
+    One memo scope per request (see erp/memo.py).
+    With DEBUG, the X-Memo-Saved-Queries header tells how many queries the memoization saved.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with memo_scope() as scope:
+            response = self.get_response(request)
+
+        if settings.DEBUG:
+            response['X-Memo-Saved-Queries'] = scope.saved_queries
+            logger.debug("%s %s: %s memo hits, %s queries saved",
+                         request.method, request.path, scope.hits, scope.saved_queries)
+        return response
@@ -0,0 +1,34 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:13
+
+from django.db import migrations, models
+
+
+# Django 2.1's Index has no `condition`, the partial indexes are written by hand.
+# See design_considerations.txt for the query each of them serves.
+PARTIAL_INDEXES = [
+    ('erp_rental_open_book_idx', 'erp_rental (book_id)', 'returned_on IS NULL'),
+    ('erp_rental_open_user_idx', 'erp_rental (user_id)', 'returned_on IS NULL'),
+    ('erp_rental_open_due_for_idx', 'erp_rental (due_for)', 'returned_on IS NULL'),
+    ('erp_booking_queue_idx', 'erp_booking (generic_book_id, request_made_on)',
+     'book_id IS NULL AND NOT was_cancelled'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0025_auto_20261019_1012'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['generic_book', 'status'], name='erp_book_gbook_status_idx'),
+        ),
+    ] + [
+        migrations.RunSQL(
+            sql=['CREATE INDEX {} ON {} WHERE {}'.format(name, table_and_columns, condition)],
+            reverse_sql=['DROP INDEX {}'.format(name)],
+        )
+        for name, table_and_columns, condition in PARTIAL_INDEXES
+    ]
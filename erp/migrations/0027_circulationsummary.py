@@ -0,0 +1,58 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:15
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Q
+import django.db.models.deletion
+
+
+def create_summaries(apps, schema_editor):
+    """Model methods aren't available in migrations, same computation as CirculationSummary.compute()"""
+    Subscriber = apps.get_model('erp', 'Subscriber')
+    Rental = apps.get_model('erp', 'Rental')
+    Booking = apps.get_model('erp', 'Booking')
+    CirculationSummary = apps.get_model('erp', 'CirculationSummary')
+
+    rentals = {
+        row['user_id']: row
+        for row in Rental.objects.filter(returned_on__isnull=True).values('user_id').order_by().annotate(
+            nb_open=Count('id'), nb_late=Count('id', filter=Q(late=True)), next_due_for=Min('due_for'),
+        )
+    }
+    bookings = {
+        row['user_id']: row['nb_open']
+        for row in Booking.objects.filter(book__isnull=True, was_cancelled=False)
+        .values('user_id').order_by().annotate(nb_open=Count('id'))
+    }
+
+    summaries = []
+    for subscriber_id, user_id in Subscriber.objects.values_list('id', 'user_id'):
+        rental = rentals.get(user_id, {})
+        summaries.append(CirculationSummary(
+            subscriber_id=subscriber_id,
+            open_rentals_count=rental.get('nb_open', 0),
+            open_bookings_count=bookings.get(user_id, 0),
+            next_due_for=rental.get('next_due_for'),
+            late_rentals_count=rental.get('nb_late', 0),
+        ))
+    CirculationSummary.objects.bulk_create(summaries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0026_circulation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CirculationSummary',
+            fields=[
+                ('subscriber', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='circulation', serialize=False, to='erp.Subscriber')),
+                ('open_rentals_count', models.PositiveIntegerField(default=0)),
+                ('open_bookings_count', models.PositiveIntegerField(default=0)),
+                ('next_due_for', models.DateField(blank=True, null=True)),
+                ('late_rentals_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_summaries, migrations.RunPython.noop),
+    ]
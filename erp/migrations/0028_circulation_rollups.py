@@ -0,0 +1,76 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0027_circulationsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorDailyCirculation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('rentals_count', models.PositiveIntegerField(default=0)),
+                ('bookings_count', models.PositiveIntegerField(default=0)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_circulation', to='erp.Author')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GenericBookDailyCirculation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('rentals_count', models.PositiveIntegerField(default=0)),
+                ('bookings_count', models.PositiveIntegerField(default=0)),
+                ('generic_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_circulation', to='erp.GenericBook')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GenreDailyCirculation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('rentals_count', models.PositiveIntegerField(default=0)),
+                ('bookings_count', models.PositiveIntegerField(default=0)),
+                ('genre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_circulation', to='erp.Genre')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HighWaterMark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='genredailycirculation',
+            index=models.Index(fields=['day'], name='erp_genreda_day_731b6d_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='genredailycirculation',
+            unique_together={('genre', 'day')},
+        ),
+        migrations.AddIndex(
+            model_name='genericbookdailycirculation',
+            index=models.Index(fields=['day'], name='erp_generic_day_e5af5c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='genericbookdailycirculation',
+            unique_together={('generic_book', 'day')},
+        ),
+        migrations.AddIndex(
+            model_name='authordailycirculation',
+            index=models.Index(fields=['day'], name='erp_authord_day_5d3a2b_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='authordailycirculation',
+            unique_together={('author', 'day')},
+        ),
+    ]
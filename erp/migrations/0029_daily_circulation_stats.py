@@ -0,0 +1,54 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0028_circulation_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCirculationStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('rentals_count', models.PositiveIntegerField(default=0)),
+                ('returns_count', models.PositiveIntegerField(default=0)),
+                ('late_returns_count', models.PositiveIntegerField(default=0)),
+                ('bookings_count', models.PositiveIntegerField(default=0)),
+                ('resolutions_count', models.PositiveIntegerField(default=0)),
+                ('cancellations_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['day'],
+            },
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='cancelled_on',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='book_booked_on',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='request_made_on',
+            field=models.DateField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='rental',
+            name='rent_on',
+            field=models.DateField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='rental',
+            name='returned_on',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+    ]
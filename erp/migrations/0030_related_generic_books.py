@@ -0,0 +1,32 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0029_daily_circulation_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedGenericBook',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('common_readers', models.PositiveIntegerField()),
+                ('generic_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related', to='erp.GenericBook')),
+                ('related_generic_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='erp.GenericBook')),
+            ],
+            options={
+                'ordering': ['generic_book_id', 'rank'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='relatedgenericbook',
+            unique_together={('generic_book', 'rank')},
+        ),
+    ]
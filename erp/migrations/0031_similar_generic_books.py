@@ -0,0 +1,31 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0030_related_generic_books'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarGenericBook',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('generic_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar', to='erp.GenericBook')),
+                ('similar_generic_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='erp.GenericBook')),
+            ],
+            options={
+                'ordering': ['generic_book_id', 'rank'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='similargenericbook',
+            unique_together={('generic_book', 'rank')},
+        ),
+    ]
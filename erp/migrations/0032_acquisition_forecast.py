@@ -0,0 +1,31 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0031_similar_generic_books'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AcquisitionForecast',
+            fields=[
+                ('generic_book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='acquisition_forecast', serialize=False, to='erp.GenericBook')),
+                ('computed_on', models.DateField()),
+                ('queue_length', models.PositiveIntegerField()),
+                ('average_wait_days', models.FloatField(blank=True, null=True)),
+                ('copies_in_circulation', models.PositiveIntegerField()),
+                ('rentals_per_day', models.FloatField()),
+                ('average_rental_days', models.FloatField()),
+                ('copies_needed', models.PositiveIntegerField()),
+                ('extra_copies_needed', models.PositiveIntegerField()),
+            ],
+            options={
+                'ordering': ['-extra_copies_needed', '-queue_length'],
+            },
+        ),
+    ]
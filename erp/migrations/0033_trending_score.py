@@ -0,0 +1,26 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0032_acquisition_forecast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('generic_book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='erp.GenericBook')),
+                ('rentals_score', models.FloatField(default=0)),
+                ('bookings_score', models.FloatField(default=0)),
+                ('score', models.FloatField(db_index=True, default=0)),
+            ],
+            options={
+                'ordering': ['-score'],
+            },
+        ),
+    ]
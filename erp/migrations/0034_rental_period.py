@@ -0,0 +1,73 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:41
+
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.core.management.base import CommandError
+from django.db import migrations
+
+
+# Same expression as erp.inventory.RentalPeriod, the planner only uses the index for it
+RENTAL_PERIOD = "daterange(rent_on, returned_on, '[)')"
+
+
+def check_rentals(schema_editor, sql, problem):
+    """Stop the migration on the rows the constraints below would reject, naming them"""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+    if rows:
+        raise CommandError('Rentals {}, fix them before migrating: {}'.format(
+            problem, ', '.join(' & '.join(str(value) for value in row) for row in rows[:50])
+        ))
+
+
+def add_period_index_and_constraint(apps, schema_editor):
+    # range types, GiST and exclusion constraints are postgres only
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # daterange(rent_on, returned_on) raises on such rows, name the actual problem instead
+    check_rentals(
+        schema_editor,
+        'SELECT id FROM erp_rental WHERE returned_on < rent_on ORDER BY id',
+        'returned before they were rented',
+    )
+    schema_editor.execute(
+        'ALTER TABLE erp_rental ADD CONSTRAINT erp_rental_returned_after_rent '
+        'CHECK (returned_on >= rent_on)'
+    )
+    check_rentals(
+        schema_editor,
+        "SELECT a.id, b.id FROM erp_rental a JOIN erp_rental b "
+        "ON a.book_id = b.book_id AND a.id < b.id "
+        "AND daterange(a.rent_on, a.returned_on, '[)') "
+        "&& daterange(b.rent_on, b.returned_on, '[)') "
+        "ORDER BY a.id, b.id",
+        'overlapping another rental of the same copy',
+    )
+    schema_editor.execute(
+        'CREATE INDEX erp_rental_period_idx ON erp_rental USING gist ({})'.format(RENTAL_PERIOD)
+    )
+    # btree_gist gives GiST the `=` on book_id
+    schema_editor.execute(
+        'ALTER TABLE erp_rental ADD CONSTRAINT erp_rental_no_overlap '
+        'EXCLUDE USING gist (book_id WITH =, {} WITH &&)'.format(RENTAL_PERIOD)
+    )
+
+
+def remove_period_index_and_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('ALTER TABLE erp_rental DROP CONSTRAINT erp_rental_no_overlap')
+    schema_editor.execute('DROP INDEX erp_rental_period_idx')
+    schema_editor.execute('ALTER TABLE erp_rental DROP CONSTRAINT erp_rental_returned_after_rent')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0033_trending_score'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.RunPython(add_period_index_and_constraint, remove_period_index_and_constraint),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('erp', '0035_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('url_name', models.CharField(blank=True, max_length=100)),
+                ('status_code', models.IntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('queries_count', models.IntegerField()),
+                ('sql_ms', models.FloatField()),
+                ('stats', models.BinaryField()),
+                ('summary', models.TextField()),
+                ('sql_timeline', models.TextField()),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+    ]
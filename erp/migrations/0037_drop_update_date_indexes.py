@@ -0,0 +1,28 @@
+# Generated by Django 2.1.2 on 2026-10-19 11:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0036_request_profile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='book_booked_on',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='cancelled_on',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='rental',
+            name='returned_on',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
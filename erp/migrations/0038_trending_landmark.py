@@ -0,0 +1,29 @@
+# Generated by Django 2.1.2 on 2026-10-19 12:05
+
+from datetime import datetime
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def create_landmark(apps, schema_editor):
+    """
+    The landmark the existing scores are relative to, TrendingScore.LANDMARK. Created here rather
+    than by the first renormalization, so that recording an event always has a row to share-lock.
+    """
+    HighWaterMark = apps.get_model('erp', 'HighWaterMark')
+    HighWaterMark.objects.get_or_create(
+        name='renormalize_trending_scores',
+        defaults={'last_at': datetime(2018, 1, 1, tzinfo=timezone.utc)},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0037_drop_update_date_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_landmark, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.1.2 on 2026-10-19 12:40
+
+from django.db import migrations
+
+
+def drop_period_index(apps, schema_editor):
+    # postgres only, like 0034
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # erp_rental_no_overlap's GiST index leads with book_id but serves the period alone too
+    schema_editor.execute('DROP INDEX erp_rental_period_idx')
+
+
+def restore_period_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX erp_rental_period_idx ON erp_rental "
+        "USING gist (daterange(rent_on, returned_on, '[)'))"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0038_trending_landmark'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_period_index, restore_period_index),
+    ]
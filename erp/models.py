@@ -1,9 +1,17 @@
-from datetime import date, timedelta
+import math
+import zlib
+from collections import defaultdict
+from datetime import date, datetime, timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from erp import recommendations
+from erp.memo import invalidate, memoized_property
 
 
 # Auth
@@ -18,6 +26,8 @@ class Librarian(models.Model):
     """
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     is_manager = models.BooleanField()
+    # every table copied to the warehouse has one, see the extract_changes command
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['user__first_name']
@@ -47,6 +57,7 @@ class Subscriber(models.Model):
     subscription_date = models.DateField(default=date.today)
     has_issue = models.BooleanField(default=False)
     has_received_warning = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['user__first_name']
@@ -54,20 +65,40 @@ class Subscriber(models.Model):
     def __str__(self):
         return self.user.first_name
 
-    @property
+    def save(self, **kwargs):
+        is_new = self._state.adding
+        with transaction.atomic():
+            super().save(**kwargs)
+            if is_new:
+                CirculationSummary.refresh_for_user(self.user_id)
+        invalidate('user', self.user_id)
+
+    @memoized_property('user', 'user_id')
+    def circulation_summary(self):
+        """
+        Not cached on the instance (unlike `self.circulation`), each access is a primary-key read.
+        Subscribers created without save() (bulk_create, fixtures) get their summary on
+        first access.
+        """
+        summary = CirculationSummary.objects.filter(pk=self.pk).first()
+        return summary or CirculationSummary.refresh_for_user(self.user_id)
+
+    @memoized_property('user', 'user_id')
     def current_rentals(self): # get nb with .count(), better that len(current_rentals)
-        return self.user.rent_books.exclude(returned_on__isnull=False)
+        return self.user.rent_books.filter(
+            returned_on__isnull=True
+        ).select_related('book__generic_book')
 
-    @property
-    def current_bookings(self):
-        return self.user.bookings.filter(book=True)
+    @memoized_property('user', 'user_id')
+    def current_bookings(self):  # the bookings still waiting for a copy
+        return self.user.bookings.filter(book__isnull=True, was_cancelled=False)
 
     @property
     def can_rent(self):
         return (
             not self.has_issue
             and self.valid_subscription
-            and self.current_rentals.count() < settings.MAX_RENT_BOOKS
+            and self.circulation_summary.open_rentals_count < settings.MAX_RENT_BOOKS
         )
 
     @property
@@ -75,7 +106,7 @@ class Subscriber(models.Model):
         return (
             not self.has_issue
             and self.valid_subscription
-            and self.current_bookings.count() < settings.MAX_BOOKING_BOOKS
+            and self.circulation_summary.open_bookings_count < settings.MAX_BOOKING_BOOKS
         )
 
     @property
@@ -94,6 +125,7 @@ class Subscriber(models.Model):
 
 class Author(models.Model):
     name = models.CharField(max_length=50, unique=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['name']
@@ -104,6 +136,7 @@ class Author(models.Model):
 
 class Genre(models.Model):
     name = models.CharField(max_length=20, unique=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['name']
@@ -117,6 +150,7 @@ class GenericBook(models.Model):
     author = models.ForeignKey(Author, related_name='generic_books', on_delete=models.PROTECT)
     genre = models.ForeignKey(Genre, related_name='generic_books', on_delete=models.PROTECT)
     publication_year = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['title', 'author']
@@ -148,9 +182,14 @@ class Book(models.Model):
 
     # Variable information (changing each time the status of the book evolves)
     status = models.CharField(choices=BOOK_STATUS, max_length=20, default='MAINTENANCE')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['generic_book', 'id']
+        indexes = [
+            # copies of a title in a given status, see design_considerations.txt
+            models.Index(fields=['generic_book', 'status'], name='erp_book_gbook_status_idx'),
+        ]
 
     def __str__(self):
         return f'{self.generic_book} - {self.pk}'
@@ -173,11 +212,17 @@ class Book(models.Model):
     def save(self, **kwargs):
         self.clean() # to force clean to be used also outside forms and serializers
         super().save(**kwargs)
+        invalidate('book', self.pk)
 
     @property
     def current_rental(self): # no more than one at the time, otherwise the system is broken somewhere (make a test for this)
         if self.status != 'RENT':
             return None
+        return self.open_rental
+
+    @memoized_property('book', 'pk')
+    def open_rental(self):
+        # status is read from the instance, it stays out of the memoized part
         return self.rentals.filter(returned_on__isnull=True).first()
 
 def set_due_for():
@@ -192,16 +237,18 @@ class Rental(models.Model):
     # fields filled at the creation of the rental
     user = models.ForeignKey(to=User, on_delete=models.PROTECT, related_name='rent_books')
     book = models.ForeignKey(to=Book, on_delete=models.PROTECT, related_name='rentals')
-    rent_on = models.DateField(auto_now_add=True)
+    rent_on = models.DateField(auto_now_add=True, db_index=True)
     # set_due_for callable can't be a static method in Rental,
     # because DateField couldn't access it (not with `self` as self refers to Rental not DateField,
     # nor with `Rental` as Rental isn't defined yet)
     due_for = models.DateField(default=set_due_for)
 
     # fields filled at the end of the rental
-    # opti: enforce a constraint so that only one record with a given book may have returned_on to NULL
+    # opti: enforce a constraint so that only one record with a given book may have returned_on
+    # to NULL
     returned_on = models.DateField(blank=True, null=True)
     late = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return "({}) {} rent by {}".format(
@@ -210,6 +257,33 @@ class Rental(models.Model):
             self.user.username
         )
 
+    def forget_memoized(self):
+        invalidate('user', self.user_id)
+        invalidate('book', self.book_id)
+
+    def clean(self):
+        # also enforced by the erp_rental_returned_after_rent constraint on postgres
+        rent_on = self.rent_on or date.today()  # auto_now_add, not set yet on a new rental
+        if self.returned_on and self.returned_on < rent_on:
+            raise ValidationError("A rental can't be returned before it was rented")
+
+    def save(self, **kwargs):
+        self.clean()
+        is_new = self._state.adding
+        with transaction.atomic():
+            super().save(**kwargs)
+            CirculationSummary.refresh_for_user(self.user_id)
+            if is_new:
+                TrendingScore.record(self.book.generic_book_id, 'rentals_score')
+        self.forget_memoized()
+
+    def delete(self, **kwargs):
+        with transaction.atomic():
+            deleted = super().delete(**kwargs)
+            CirculationSummary.refresh_for_user(self.user_id)
+        self.forget_memoized()
+        return deleted
+
 
 class Booking(models.Model):
     """
@@ -223,11 +297,13 @@ class Booking(models.Model):
     book_booked_on stores the date at which the booking of a generic_book has been resolved into a book, starting from
         this date the subscriber has a certain period to withdraw the book (refer to the settings)
     was_cancelled depends on whether the subscriber played fair with the booking he made, or not.
+    cancelled_on is filled by save() when was_cancelled becomes True, so that cancellations can be
+    counted per day.
     """
     # set at creation of the booking
     user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='bookings')
     generic_book = models.ForeignKey(to=GenericBook, on_delete=models.CASCADE, related_name='bookings')
-    request_made_on = models.DateField(auto_now_add=True)
+    request_made_on = models.DateField(auto_now_add=True, db_index=True)
 
     # set at resolution of the booking
     book = models.ForeignKey(to=Book, on_delete=models.CASCADE, related_name='bookings', blank=True, null=True)
@@ -236,6 +312,8 @@ class Booking(models.Model):
     # set at completion of the booking, either cancelled or rent
     # was_rent = models.BooleanField(default=False) #TODO
     was_cancelled = models.BooleanField(default=False)
+    cancelled_on = models.DateField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __self__(self):
         return "{} booked by {} on {} (resolved: {})".format(
@@ -244,4 +322,519 @@ class Booking(models.Model):
 
     @property
     def is_over(self): # it's > not >= because we are kind
-        return self.book_booked_on + timedelta(days=settings.MAX_BOOKING_DAYS) > date.today()
+        # MAX_BOOKING_DAYS to fetch the copy, a booking still waiting for one isn't over
+        if self.book_booked_on is None:
+            return False
+        return date.today() > self.book_booked_on + timedelta(days=settings.MAX_BOOKING_DAYS)
+
+    def forget_memoized(self):
+        invalidate('user', self.user_id)
+
+    def save(self, **kwargs):
+        if self.was_cancelled and not self.cancelled_on:
+            self.cancelled_on = date.today()
+        is_new = self._state.adding
+        with transaction.atomic():
+            super().save(**kwargs)
+            CirculationSummary.refresh_for_user(self.user_id)
+            if is_new:
+                TrendingScore.record(self.generic_book_id, 'bookings_score')
+        self.forget_memoized()
+
+    def delete(self, **kwargs):
+        with transaction.atomic():
+            deleted = super().delete(**kwargs)
+            CirculationSummary.refresh_for_user(self.user_id)
+        self.forget_memoized()
+        return deleted
+
+
+class CirculationSummary(models.Model):
+    """
+    What the desk needs to know about a subscriber's circulation, in one row:
+    RentBook and ReserveGenericBook check the eligibility with a primary-key read instead
+    of counting.
+
+    Kept up to date by Rental.save() / Booking.save() (and delete()), in the same transaction.
+    The row is locked first, then recomputed from the subscriber's open rentals and bookings
+    (a handful of rows, through the partial indexes). Locking first is what makes it right under
+    concurrency: a second transaction waits for the first one to commit, and then sees its rows.
+    Bulk writes (queryset.update(), bulk_create()) skip this,
+    the `reconcile_circulation_summaries` command catches them.
+
+    open_bookings_count counts the bookings still waiting for a copy (see
+    Subscriber.current_bookings).
+    late_rentals_count counts the open rentals flagged late.
+    """
+    subscriber = models.OneToOneField(
+        to=Subscriber, on_delete=models.CASCADE, primary_key=True, related_name='circulation'
+    )
+    open_rentals_count = models.PositiveIntegerField(default=0)
+    open_bookings_count = models.PositiveIntegerField(default=0)
+    next_due_for = models.DateField(blank=True, null=True)
+    late_rentals_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "{}: {} rent, {} booked".format(
+            self.subscriber, self.open_rentals_count, self.open_bookings_count
+        )
+
+    @staticmethod
+    def compute(user_ids=None):
+        """
+        {user_id: {field: value}} computed from the Rental and Booking tables,
+        for the given users or, by default, for everyone with open rentals or bookings.
+        """
+        open_rentals = Rental.objects.filter(returned_on__isnull=True)
+        open_bookings = Booking.objects.filter(book__isnull=True, was_cancelled=False)
+        if user_ids is not None:
+            open_rentals = open_rentals.filter(user_id__in=user_ids)
+            open_bookings = open_bookings.filter(user_id__in=user_ids)
+
+        summaries = defaultdict(lambda: {
+            'open_rentals_count': 0,
+            'open_bookings_count': 0,
+            'next_due_for': None,
+            'late_rentals_count': 0,
+        })
+        rental_rows = open_rentals.values('user_id').order_by().annotate(
+            nb_open=Count('id'),
+            nb_late=Count('id', filter=Q(late=True)),
+            next_due_for=Min('due_for'),
+        )
+        for row in rental_rows:
+            summaries[row['user_id']].update({
+                'open_rentals_count': row['nb_open'],
+                'next_due_for': row['next_due_for'],
+                'late_rentals_count': row['nb_late'],
+            })
+        booking_rows = open_bookings.values('user_id').order_by().annotate(nb_open=Count('id'))
+        for row in booking_rows:
+            summaries[row['user_id']]['open_bookings_count'] = row['nb_open']
+        return summaries
+
+    @classmethod
+    def refresh_for_user(cls, user_id):
+        """Returns the up to date summary, or None if the user isn't a subscriber (librarians)"""
+        subscriber_id = (
+            Subscriber.objects.filter(user_id=user_id).values_list('id', flat=True).first()
+        )
+        if subscriber_id is None:
+            return None
+
+        with transaction.atomic():
+            summary, _ = cls.objects.select_for_update().get_or_create(subscriber_id=subscriber_id)
+            for field, value in cls.compute([user_id])[user_id].items():
+                setattr(summary, field, value)
+            summary.save()
+        return summary
+
+
+# Analytics
+
+class HighWaterMark(models.Model):
+    """
+    Where an incremental job stopped: the last id it processed in a table,
+    or the last updated_at for the jobs following changes rather than new rows.
+    name is the job's choice, like 'rollup_circulation.rental'.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    last_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return "{}: {}".format(self.name, self.last_id)
+
+
+class DailyCirculation(models.Model):
+    """
+    Rentals and bookings made on a day, for one GenericBook, Author or Genre (see subclasses).
+    Filled by the `rollup_circulation` command, read by the analytics endpoints:
+    popularity questions then read a few rows per day and per item instead of the whole history.
+    """
+    day = models.DateField()
+    rentals_count = models.PositiveIntegerField(default=0)
+    bookings_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class GenericBookDailyCirculation(DailyCirculation):
+    generic_book = models.ForeignKey(
+        to=GenericBook, on_delete=models.CASCADE, related_name='daily_circulation'
+    )
+
+    class Meta:
+        unique_together = ('generic_book', 'day')
+        indexes = [models.Index(fields=['day'])]
+
+
+class AuthorDailyCirculation(DailyCirculation):
+    author = models.ForeignKey(
+        to=Author, on_delete=models.CASCADE, related_name='daily_circulation'
+    )
+
+    class Meta:
+        unique_together = ('author', 'day')
+        indexes = [models.Index(fields=['day'])]
+
+
+class GenreDailyCirculation(DailyCirculation):
+    genre = models.ForeignKey(to=Genre, on_delete=models.CASCADE, related_name='daily_circulation')
+
+    class Meta:
+        unique_together = ('genre', 'day')
+        indexes = [models.Index(fields=['day'])]
+
+
+class DailyCirculationStat(models.Model):
+    """
+    The circulation of the whole library on one day, filled by the `rollup_daily_stats` command,
+    read by /api/analytics/timeseries/ (which regroups the days into weeks or months).
+    Each count comes from the date column of the event: rent_on, returned_on (and late for
+    late_returns), request_made_on, book_booked_on (resolutions) and cancelled_on.
+    """
+    day = models.DateField(unique=True)
+    rentals_count = models.PositiveIntegerField(default=0)
+    returns_count = models.PositiveIntegerField(default=0)
+    late_returns_count = models.PositiveIntegerField(default=0)
+    bookings_count = models.PositiveIntegerField(default=0)
+    resolutions_count = models.PositiveIntegerField(default=0)
+    cancellations_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day']
+
+    def __str__(self):
+        return str(self.day)
+
+
+class AcquisitionForecast(models.Model):
+    """
+    Unmet demand of a GenericBook and the copies to add to bring the wait under
+    settings.ACQUISITION_TARGET_WAIT_DAYS, filled by the `forecast_acquisitions` command,
+    read by /api/analytics/acquisitions/. Rates and averages are over the last days of the run
+    (rentals_per_day over rentals started, average_rental_days over returned rentals,
+    average_wait_days over bookings resolved).
+    """
+    generic_book = models.OneToOneField(
+        to=GenericBook, on_delete=models.CASCADE, primary_key=True,
+        related_name='acquisition_forecast',
+    )
+    computed_on = models.DateField()
+    queue_length = models.PositiveIntegerField()
+    average_wait_days = models.FloatField(blank=True, null=True)  # None: no booking resolved
+    copies_in_circulation = models.PositiveIntegerField()
+    rentals_per_day = models.FloatField()
+    average_rental_days = models.FloatField()
+    copies_needed = models.PositiveIntegerField()
+    extra_copies_needed = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['-extra_copies_needed', '-queue_length']
+
+    def __str__(self):
+        return '{}: +{}'.format(self.generic_book_id, self.extra_copies_needed)
+
+    @staticmethod
+    def copies_for(queue_length, rentals_per_day, average_rental_days, target_wait_days):
+        """
+        Little's law, L = lambda * W: the copies out on average are the rentals per day times
+        the days a rental lasts. That's the steady demand we already serve. On top of it, the
+        queue must be served within the target wait: each copy serves
+        target_wait_days / average_rental_days bookings in that time.
+        """
+        busy = rentals_per_day * average_rental_days
+        backlog = queue_length * average_rental_days / target_wait_days
+        return math.ceil(round(busy + backlog, 6))  # round: 2.0000000001 is 2 copies, not 3
+
+
+class TrendingScore(models.Model):
+    """
+    What's hot now: rentals and bookings of a GenericBook, each one counting less and less as
+    time goes (halved every settings.TRENDING_HALF_LIFE_DAYS), read by /api/analytics/trending/.
+
+    Forward decay: instead of decaying every score at each tick, an event at time t adds
+    2 ** ((t - landmark) / half-life) to the stored scores, and a score is brought back to today's
+    scale on read by multiplying by 2 ** (-(now - landmark) / half-life). Recording an event is a
+    one-row F() update, and since all the scores share the same factor, the stored `score` orders
+    the titles as the decayed ones do (its index serves the top-N).
+    The weights double every half-life and would overflow the floats after 1024 of them, so the
+    landmark moves forward each night (renormalize(), run by `renormalize_trending_scores`).
+    """
+    LANDMARK = datetime(2018, 1, 1, tzinfo=timezone.utc)  # until renormalize() first moves it
+    MARK = 'renormalize_trending_scores'  # the HighWaterMark whose last_at is the landmark
+
+    generic_book = models.OneToOneField(
+        to=GenericBook, on_delete=models.CASCADE, primary_key=True, related_name='trending'
+    )
+    rentals_score = models.FloatField(default=0)
+    bookings_score = models.FloatField(default=0)
+    score = models.FloatField(default=0, db_index=True)  # rentals_score + bookings_score
+
+    class Meta:
+        ordering = ['-score']
+
+    def __str__(self):
+        return '{}: {}'.format(self.generic_book_id, self.score)
+
+    @classmethod
+    def landmark(cls, lock=False):
+        """
+        The moment the stored scores are relative to. With `lock`, share-lock it until the end
+        of the transaction: renormalize() waits for the events being recorded, and the reverse.
+        """
+        sql = 'SELECT id, last_at FROM {} WHERE name = %s'.format(HighWaterMark._meta.db_table)
+        if lock and connection.vendor == 'postgresql':
+            sql += ' FOR SHARE'
+        for mark in HighWaterMark.objects.raw(sql, [cls.MARK]):
+            return mark.last_at or cls.LANDMARK
+        return cls.LANDMARK
+
+    @classmethod
+    def weight(cls, moment, landmark):
+        days = (moment - landmark).total_seconds() / 86400
+        return 2 ** (days / settings.TRENDING_HALF_LIFE_DAYS)
+
+    @classmethod
+    def record(cls, generic_book_id, field):
+        """Add an event happening now to `field` (rentals_score or bookings_score) of a title"""
+        with transaction.atomic(savepoint=False):  # for the lock, when not within Rental.save()
+            weight = cls.weight(timezone.now(), cls.landmark(lock=True))
+            increments = {field: F(field) + weight, 'score': F('score') + weight}
+            if cls.objects.filter(pk=generic_book_id).update(**increments):
+                return
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        generic_book_id=generic_book_id, score=weight, **{field: weight}
+                    )
+            except IntegrityError:  # created by a concurrent request in the meantime
+                cls.objects.filter(pk=generic_book_id).update(**increments)
+
+    @classmethod
+    def decayed(cls, value, now=None, landmark=None):
+        """A stored score brought back to now's scale: the number of events, aged"""
+        return value / cls.weight(now or timezone.now(), landmark or cls.landmark())
+
+    @classmethod
+    def renormalize(cls, now=None):
+        """
+        Move the landmark to `now` and rescale the stored scores to it, in one transaction: the
+        decayed scores and the order don't change, the next weights restart from 1. Run daily, the
+        weights stay below 2 ** (1 / half-life). Return the number of scores rescaled.
+        """
+        now = now or timezone.now()
+        with transaction.atomic():
+            mark, _ = HighWaterMark.objects.get_or_create(
+                name=cls.MARK, defaults={'last_at': cls.LANDMARK}
+            )
+            mark = HighWaterMark.objects.select_for_update().get(pk=mark.pk)
+            # the weight of the old landmark seen from the new one: 2 ** -x underflows to 0
+            # rather than overflowing, scores too old to matter vanish
+            factor = cls.weight(mark.last_at or cls.LANDMARK, now)
+            rescaled = cls.objects.update(
+                rentals_score=F('rentals_score') * factor,
+                bookings_score=F('bookings_score') * factor,
+                score=F('score') * factor,
+            )
+            mark.last_at = now
+            mark.save()
+        return rescaled
+
+
+# Recommendations
+
+class RelatedGenericBook(models.Model):
+    """
+    "Readers of this title also borrowed": the closest GenericBooks to `generic_book` by their
+    readers (cosine similarity of the sets of subscribers who rented them), best first.
+    Rebuilt each night by the `build_related_generic_books` command, read by
+    /api/generic_books/<pk>/related/.
+    """
+    generic_book = models.ForeignKey(
+        to=GenericBook, on_delete=models.CASCADE, related_name='related'
+    )
+    related_generic_book = models.ForeignKey(
+        to=GenericBook, on_delete=models.CASCADE, related_name='+'
+    )
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    common_readers = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['generic_book_id', 'rank']
+        unique_together = ('generic_book', 'rank')  # its index serves the endpoint
+
+    def __str__(self):
+        return '{} -> {}'.format(self.generic_book_id, self.related_generic_book_id)
+
+
+class SimilarGenericBook(models.Model):
+    """
+    The closest GenericBooks to `generic_book` by their attributes (author, genre, publication
+    decade, title words), best first: unlike RelatedGenericBook, new titles get some
+    within minutes.
+    Refreshed for the GenericBooks changed lately by the `refresh_similar_generic_books` command
+    (refresh_for()), rebuilt by the `build_similar_generic_books` command, read by
+    /api/generic_books/<pk>/similar/.
+    """
+    generic_book = models.ForeignKey(
+        to=GenericBook, on_delete=models.CASCADE, related_name='similar'
+    )
+    similar_generic_book = models.ForeignKey(
+        to=GenericBook, on_delete=models.CASCADE, related_name='+'
+    )
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['generic_book_id', 'rank']
+        unique_together = ('generic_book', 'rank')  # its index serves the endpoint
+
+    def __str__(self):
+        return '{} -> {}'.format(self.generic_book_id, self.similar_generic_book_id)
+
+    @classmethod
+    def lock(cls):
+        """
+        Serialize the writers of the table until the end of the transaction: two of them deleting
+        then inserting the same (generic_book, rank) would break the unique constraint.
+        Advisory locks are a postgres feature, sqlite has one writer at a time anyway.
+        """
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_advisory_xact_lock(%s)', [zlib.crc32(cls._meta.db_table.encode())]
+                )
+
+    @classmethod
+    def refresh_for(cls, generic_book_ids):
+        """
+        Incremental: recompute the neighbours of `generic_book_ids` and of the titles whose list
+        they enter or may leave (the ones listing them, the ones where they now beat the last
+        neighbour).
+        The catalogue is read once for all of them.
+        Deleted GenericBooks just leave a shorter list behind them (CASCADE), until the
+        nightly rebuild.
+        """
+        top = settings.SIMILAR_GENERIC_BOOKS_TOP
+        with transaction.atomic():
+            cls.lock()
+            generic_books = list(GenericBook.objects.order_by().values_list(
+                'id', 'title', 'author_id', 'genre_id', 'publication_year'
+            ))
+            matrix = recommendations.feature_matrix(generic_books)
+            similarities = recommendations.content_similarities(
+                generic_books, generic_book_ids, matrix
+            )
+
+            affected = set(generic_book_ids)
+            affected.update(cls.objects.filter(
+                similar_generic_book_id__in=generic_book_ids
+            ).values_list('generic_book_id', flat=True))
+            candidates = {}  # the best score of each title against the changed ones
+            for _, scores in similarities:
+                for other_id, score in scores.items():
+                    candidates[other_id] = max(score, candidates.get(other_id, 0))
+            lists = (
+                cls.objects.filter(generic_book_id__in=candidates)
+                .values('generic_book_id').order_by()
+                .annotate(nb=Count('id'), worst=Min('score'))
+            )
+            lists = {row['generic_book_id']: row for row in lists}
+            for other_id, score in candidates.items():
+                current = lists.get(other_id)
+                if current is None or current['nb'] < top or score > current['worst']:
+                    affected.add(other_id)
+
+            neighbours = recommendations.content_neighbours(
+                generic_books, top, only=affected, matrix=matrix
+            )
+            cls.replace(neighbours, affected)
+
+    @classmethod
+    def replace(cls, neighbours, generic_book_ids=None):
+        """
+        neighbours: {generic_book_id: [(similar generic_book_id, score), ...]}, best first
+        generic_book_ids: the lists to replace, default all the table
+        """
+        with transaction.atomic():
+            cls.lock()
+            rows = cls.objects.all()
+            if generic_book_ids is not None:
+                rows = rows.filter(generic_book_id__in=generic_book_ids)
+            rows.delete()
+            cls.objects.bulk_create([
+                cls(
+                    generic_book_id=generic_book_id, similar_generic_book_id=similar_id,
+                    rank=rank, score=score,
+                )
+                for generic_book_id, similar in neighbours.items()
+                for rank, (similar_id, score) in enumerate(similar, 1)
+            ], batch_size=1000)
+
+
+# Operations
+
+class JobRun(models.Model):
+    """
+    One line per execution of a scheduled job (see erp/scheduler.py and the run_scheduler command).
+
+    started_at is also what prevents a job from running twice for the same slot when several
+    hosts run the scheduler: the host that gets the lock first records the run, the others see it.
+    rows_processed is whatever the job considers its unit of work (bookings resolved, rentals
+    flagged late...), it stays NULL when the job doesn't report it.
+    """
+    job_name = models.CharField(max_length=100)
+    host = models.CharField(max_length=100)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(blank=True, null=True)
+    duration = models.DurationField(blank=True, null=True)
+    rows_processed = models.IntegerField(blank=True, null=True)
+    has_failed = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [models.Index(fields=['job_name', 'started_at'])]
+
+    def __str__(self):
+        return "{} on {} ({})".format(
+            self.job_name,
+            self.started_at,
+            "failed" if self.has_failed else "ok"
+        )
+
+
+class RequestProfile(models.Model):
+    """
+    A request profiled on demand by a manager (X-Profile: 1 header or ?profile=1, see
+    erp/profiling.py).
+
+    stats is the cProfile dump (marshal, what pstats.Stats and snakeviz read), summary its top
+    functions as text. sql_timeline is a JSON list of the statements in the order they ran:
+    [{"start_ms", "duration_ms", "sql" (normalized, no parameters), "frames"}]
+    Only the last PROFILES_KEPT profiles are kept.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    url_name = models.CharField(max_length=100, blank=True)
+    status_code = models.IntegerField()
+    duration_ms = models.FloatField()
+    queries_count = models.IntegerField()
+    sql_ms = models.FloatField()
+    stats = models.BinaryField()
+    summary = models.TextField()
+    sql_timeline = models.TextField()
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+
+    def __str__(self):
+        return "{} {} ({} ms)".format(self.method, self.path, round(self.duration_ms))
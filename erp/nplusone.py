@@ -0,0 +1,130 @@
+"""
+N+1 queries detection, for development and staging (NPlusOneMiddleware, `with detect_nplusone():`).
+
+Every statement run on the connection is reduced to its shape: the SQL without its parameters, IN
+lists collapsed (see erp/query_plans.py). When one shape comes back more than NPLUSONE_THRESHOLD
+times in a request, it's most likely a loop doing one query per row: a related field serialized
+without select_related (the StringRelatedFields of GenericBookSerializerRead), or a model property
+read for each row (SubscriberSerializer.can_rent). The detection tells the serializer field being
+serialized when the threshold was crossed and the call sites in our code, then:
+- it's logged as a warning (erp.nplusone logger)
+- or with NPLUSONE_STRICT, NPlusOneError is raised: an AssertionError, the test making the
+  request fails
+"""
+import logging
+import sys
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.fields import Field
+
+from erp.query_plans import normalize_sql
+from erp.slowlog import code_frames
+
+
+INSTRUMENTATION = True  # not a call site, see slowlog.code_frames()
+logger = logging.getLogger(__name__)
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def query_shape(sql):
+    return normalize_sql(sql.replace('%s', '?'))
+
+
+def serializer_field():
+    """'SerializerName.field_name' of the innermost DRF field serialized up the stack, or None"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        field = frame.f_locals.get('self')
+        if (isinstance(field, Field) and field.parent is not None
+                and getattr(field, 'field_name', None)):
+            return '{}.{}'.format(type(field.parent).__name__, field.field_name)
+        frame = frame.f_back
+    return None
+
+
+def call_sites(limit=8):
+    """The last frames of the stack that are in our code, instrumentation aside, innermost last"""
+    return code_frames(settings.BASE_DIR, limit)
+
+
+class QueryShapes:
+    """execute_wrapper counting the statements by shape, the repeated ones kept in `detections`"""
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.counts = Counter()
+        # {shape: {'sql', 'field', 'stack'}}, taken when the shape crossed the threshold
+        self.detections = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = query_shape(sql)
+        self.counts[shape] += 1
+        if self.counts[shape] == self.threshold + 1:
+            self.detections[shape] = {
+                'sql': shape, 'field': serializer_field(), 'stack': call_sites(),
+            }
+        return execute(sql, params, many, context)
+
+    def report(self):
+        return [
+            dict(detection, count=self.counts[shape])
+            for shape, detection in self.detections.items()
+        ]
+
+
+def describe(where, detection):
+    return '{}: {} times the same query{}\n    {}\n    {}'.format(
+        where, detection['count'],
+        ' (serializing {})'.format(detection['field']) if detection['field'] else '',
+        detection['sql'][:300],
+        '\n    '.join(detection['stack']),
+    )
+
+
+def report(where, shapes, strict):
+    detections = shapes.report()
+    if detections and strict:
+        raise NPlusOneError('\n'.join(describe(where, detection) for detection in detections))
+    for detection in detections:
+        logger.warning("N+1 %s", describe(where, detection))
+
+
+@contextmanager
+def detect_nplusone(where='block', threshold=None, strict=None):
+    """
+    Detect the repeated queries of the block, logged or raised (strict) at its end.
+    threshold and strict default to the NPLUSONE_THRESHOLD and NPLUSONE_STRICT settings.
+    """
+    shapes = QueryShapes(settings.NPLUSONE_THRESHOLD if threshold is None else threshold)
+    with connection.execute_wrapper(shapes):
+        yield shapes
+    report(where, shapes, settings.NPLUSONE_STRICT if strict is None else strict)
+
+
+class NPlusOneMiddleware:
+    """Detects the repeated queries of each request, when NPLUSONE_DETECTION is on"""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.NPLUSONE_DETECTION:
+            return self.get_response(request)
+
+        shapes = QueryShapes(settings.NPLUSONE_THRESHOLD)
+        with connection.execute_wrapper(shapes):
+            response = self.get_response(request)
+        report(self.view_name(request), shapes, settings.NPLUSONE_STRICT)
+        return response
+
+    def view_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return '{} {}'.format(request.method, request.path)
+        return '{} {} ({})'.format(
+            request.method, request.path, match.view_name or match._func_path
+        )
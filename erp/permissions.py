@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 
 
@@ -10,6 +11,19 @@ class IsManager(BasePermission):
         return False
 
 
+class IsManagerOrAllowedAddress(BasePermission):
+    """
+    For the monitoring endpoints: managers, or the METRICS_ALLOWED_ADDRESSES (a Prometheus agent).
+    None by default: behind a reverse proxy on the same host every request comes from localhost.
+    """
+    message = "You need to be a manager to perform this action"
+
+    def has_permission(self, request, view):
+        if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_ADDRESSES:
+            return True
+        return IsManager().has_permission(request, view)
+
+
 class IsLibrarian(BasePermission):
     """
     IsLibrarian includes both librarians and managers as managers are
@@ -50,3 +64,16 @@ class IsSubscriber(BasePermission):
         if request.user and request.user.groups.filter(name='Subscribers').exists():
             return True
         return False
+
+
+class IsLibrarianOrOwnSubscriber(BasePermission):
+    """
+    Object level, the object being a Subscriber: librarians (and managers) see every subscriber,
+    a subscriber only sees himself. Views call check_object_permissions() once they have it.
+    """
+    message = "You can only access your own subscriber data."
+
+    def has_object_permission(self, request, view, obj):
+        if request.user and obj.user_id == request.user.id:
+            return True
+        return IsLibrarian().has_permission(request, view)
@@ -0,0 +1,115 @@
+"""
+On-demand profiling of a request, for managers: add the `X-Profile: 1` header or `?profile=1` to
+any /api/ request. The request is served as usual under cProfile, the SQL statements it runs are
+timed, and both are stored in a RequestProfile. The response carries X-Profile-Id, the profile is
+then at /api/profiles/<id>/ (summary, SQL timeline) and /api/profiles/<id>/stats/ (the cProfile
+dump: `python -m pstats file.prof`, or snakeviz).
+
+The middleware runs before DRF authenticates the request, so it checks the knox token itself:
+without a valid manager token the flag is ignored, the request isn't profiled and nothing tells.
+cProfile slows the request down (a lot for pure python code), the durations are relative ones.
+"""
+import cProfile
+import io
+import json
+import marshal
+import pstats
+import time
+
+from django.conf import settings
+from django.db import connection
+from knox.auth import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from erp import models as erp_models
+from erp.query_plans import normalize_sql
+from erp.slowlog import erp_frames
+
+
+INSTRUMENTATION = True  # not a call site, see slowlog.code_frames()
+
+
+def wants_profile(request):
+    return request.META.get('HTTP_X_PROFILE') == '1' or request.GET.get('profile') == '1'
+
+
+def manager_of(request):
+    """The user of the knox token of the request if it's a manager, else None"""
+    try:
+        authenticated = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    if authenticated is None:
+        return None
+    user = authenticated[0]
+    return user if user.groups.filter(name='Managers').exists() else None
+
+
+class SqlTimeline:
+    """execute_wrapper recording each statement's start, relative to the request, and duration"""
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append({
+                'start_ms': round((start - self.origin) * 1000, 3),
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+                'sql': normalize_sql(sql.replace('%s', '?')),
+                'frames': erp_frames(limit=3),
+            })
+
+
+def summary(profile, top=40):
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(top)
+    return out.getvalue()
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith('/api/') or not wants_profile(request):
+            return self.get_response(request)
+        user = manager_of(request)
+        if user is None:
+            return self.get_response(request)
+
+        profile = cProfile.Profile()
+        timeline = SqlTimeline()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timeline):
+            profile.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profile.disable()
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        profile.create_stats()
+        match = getattr(request, 'resolver_match', None)
+        stored = erp_models.RequestProfile.objects.create(
+            user=user,
+            method=request.method,
+            path=request.get_full_path()[:500],
+            url_name=(match.url_name or '') if match is not None else '',
+            status_code=response.status_code,
+            duration_ms=round(duration_ms, 3),
+            queries_count=len(timeline.statements),
+            sql_ms=round(sum(statement['duration_ms'] for statement in timeline.statements), 3),
+            stats=marshal.dumps(profile.stats),
+            summary=summary(profile),
+            sql_timeline=json.dumps(timeline.statements),
+        )
+        older = erp_models.RequestProfile.objects.values_list('pk', flat=True)
+        erp_models.RequestProfile.objects.filter(
+            pk__in=older[settings.PROFILES_KEPT:]
+        ).delete()
+        response['X-Profile-Id'] = stored.pk
+        return response
@@ -0,0 +1,82 @@
+"""
+Plans of the queries the app really runs (see the `snapshot_query_plans` command).
+
+The SQL of a query is normalized (literals replaced by ?, IN lists collapsed) so that the same ORM
+query run with other ids is the same query. Its EXPLAIN (FORMAT JSON) plan is reduced to its shape:
+node types, tables, indexes, join types, without the estimates that move with every ANALYZE,
+plus the total cost of the root node.
+
+compare() tells what changed between two sets of snapshots. What's worth failing for:
+- a sequential scan on a table the query used to reach through an index
+- a cost growing more than `cost_ratio` times
+A plan changing shape otherwise, or queries appearing and disappearing, are reported as notes.
+"""
+import hashlib
+import re
+
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w.\"])-?\d+(?:\.\d+)?\b")
+IN_LISTS = re.compile(r'IN \(\?(?:, \?)*\)')
+PLAN_KEYS = ('Node Type', 'Parent Relationship', 'Relation Name', 'Index Name', 'Join Type',
+             'Strategy', 'Scan Direction')
+
+
+def normalize_sql(sql):
+    sql = LITERALS.sub('?', sql)
+    sql = IN_LISTS.sub('IN (...)', sql)
+    return ' '.join(sql.split())
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize_sql(sql).encode()).hexdigest()[:12]
+
+
+def normalize_plan(explain_json):
+    """The output of EXPLAIN (FORMAT JSON), parsed -> {'cost': float, 'tree': {...}}"""
+    root = explain_json[0]['Plan']
+    return {'cost': round(root['Total Cost'], 2), 'tree': plan_shape(root)}
+
+
+def plan_shape(node):
+    shape = {key: node[key] for key in PLAN_KEYS if key in node}
+    children = [plan_shape(child) for child in node.get('Plans', [])]
+    if children:
+        shape['Plans'] = children
+    return shape
+
+
+def seq_scanned(tree):
+    """The tables the plan reads with a sequential scan"""
+    tables = set()
+    if tree.get('Node Type') == 'Seq Scan':
+        tables.add(tree.get('Relation Name'))
+    for child in tree.get('Plans', []):
+        tables |= seq_scanned(child)
+    return tables
+
+
+def compare(snapshots, plans, cost_ratio=2.0, min_cost=10.0):
+    """
+    snapshots, plans: {query key: {'sql': ..., 'cost': ..., 'tree': ...}}, committed and new
+    Costs staying under min_cost (a few page reads) aren't compared: an empty table going from
+    0 to 1 page is no jump.
+    Returns (failures, notes): {query key: [messages]} each
+    """
+    failures, notes = {}, {}
+    for key in sorted(set(snapshots) | set(plans)):
+        if key not in snapshots:
+            notes.setdefault(key, []).append('new query, no snapshot')
+            continue
+        if key not in plans:
+            notes.setdefault(key, []).append('not run anymore')
+            continue
+        old, new = snapshots[key], plans[key]
+        for table in sorted(seq_scanned(new['tree']) - seq_scanned(old['tree'])):
+            failures.setdefault(key, []).append('new sequential scan on {}'.format(table))
+        if old['cost'] and new['cost'] >= min_cost and new['cost'] / old['cost'] > cost_ratio:
+            failures.setdefault(key, []).append('cost x{:.1f} ({} -> {})'.format(
+                new['cost'] / old['cost'], old['cost'], new['cost']
+            ))
+        if old['tree'] != new['tree'] and key not in failures:
+            notes.setdefault(key, []).append('plan changed')
+    return failures, notes
@@ -0,0 +1,98 @@
+"""
+Booking queues: the position of a booking in the queue of its GenericBook and when a copy
+should be available for it.
+
+The queue of a GenericBook is its bookings waiting for a copy (book IS NULL, not cancelled),
+first come first served (request_made_on, then id). Positions come from a window function,
+computed by the DB for all the queues asked for in one query (erp_booking_queue_idx covers it).
+
+The availability estimate replays the queue against the copies: each copy is back on its rental's
+due_for (today if it's available or overdue), goes to the next booking in line, which keeps it
+settings.MAX_RENT_DAYS, and so on. A heap of the dates at which each copy is back gives, booking
+after booking, the earliest one. It's pessimistic on purpose: copies returned early or bookings
+cancelled only make it sooner.
+"""
+import heapq
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from erp import models as erp_models
+
+
+def availability_dates(back_on_dates, queue_length, loan_days):
+    """
+    back_on_dates: when each copy is back on the shelf
+    Returns the date a copy should be available for each of the first `queue_length` bookings
+    ([] if there's no copy at all).
+    """
+    heap = list(back_on_dates)
+    heapq.heapify(heap)
+    dates = []
+    while heap and len(dates) < queue_length:
+        back_on = heapq.heappop(heap)
+        dates.append(back_on)
+        heapq.heappush(heap, back_on + timedelta(days=loan_days))
+    return dates
+
+
+def waiting_bookings(user, generic_book_ids=None):
+    """
+    The bookings of `user` waiting for a copy, with .queue_position and .available_on (None when
+    the GenericBook has no copy in circulation), in a fixed number of queries whatever the
+    number of bookings.
+    """
+    queues = erp_models.Booking.objects.filter(
+        book__isnull=True,
+        was_cancelled=False,
+        generic_book__in=user.bookings.filter(
+            book__isnull=True, was_cancelled=False
+        ).values('generic_book'),
+    )
+    if generic_book_ids is not None:
+        queues = queues.filter(generic_book_id__in=generic_book_ids)
+    queues = queues.select_related('generic_book').annotate(queue_position=Window(
+        expression=RowNumber(),
+        partition_by=[F('generic_book_id')],
+        order_by=[F('request_made_on').asc(), F('id').asc()],
+    ))
+    # the window needs every booking of the queue, only then we keep the user's ones
+    bookings = [booking for booking in queues if booking.user_id == user.id]
+    if not bookings:
+        return []
+
+    positions = {}
+    for booking in bookings:
+        positions[booking.generic_book_id] = max(
+            positions.get(booking.generic_book_id, 0), booking.queue_position
+        )
+    estimates = {
+        generic_book_id: availability_dates(
+            back_on_dates, positions[generic_book_id], settings.MAX_RENT_DAYS
+        )
+        for generic_book_id, back_on_dates in copies_back_on(list(positions)).items()
+    }
+    for booking in bookings:
+        dates = estimates.get(booking.generic_book_id, [])
+        booking.available_on = dates[booking.queue_position - 1] if dates else None
+    return sorted(bookings, key=lambda booking: (booking.request_made_on, booking.id))
+
+
+def copies_back_on(generic_book_ids):
+    """{generic_book_id: [date each copy in circulation is back on the shelf]}"""
+    today = date.today()
+    back_on = defaultdict(list)
+    available = erp_models.Book.objects.filter(
+        generic_book_id__in=generic_book_ids, status='AVAILABLE'
+    ).values_list('generic_book_id', flat=True)
+    for generic_book_id in available:
+        back_on[generic_book_id].append(today)
+    rented = erp_models.Rental.objects.filter(
+        returned_on__isnull=True, book__generic_book_id__in=generic_book_ids,
+    ).values_list('book__generic_book_id', 'due_for')
+    for generic_book_id, due_for in rented:
+        back_on[generic_book_id].append(max(due_for, today))  # overdue ones are expected any day
+    return back_on
@@ -0,0 +1,178 @@
+"""
+GenericBook neighbours computed with numpy/scipy.
+
+Co-readers (see the `build_related_generic_books` command): a sparse subscriber x GenericBook
+matrix (1 when the subscriber rented the title at least once), its product by itself gives the
+number of common readers of each pair of titles, scaled into a cosine similarity by the number of
+readers of each title.
+
+Content (see SimilarGenericBook): each GenericBook is a sparse vector of hashed features (author,
+genre, publication decade, title words), normalized, so that the product of two vectors is their
+cosine similarity.
+New titles get neighbours before anyone rents them.
+"""
+import re
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+
+N_FEATURES = 2 ** 18  # hashed features, collisions are rare enough at this size
+FEATURE_WEIGHTS = {
+    'author': 3.0,
+    'genre': 1.0,
+    'decade': 1.0,
+    'near_decade': 0.5,  # the decades before and after, 1849 and 1851 are close
+    'title': 1.0,
+}
+TITLE_STOP_WORDS = {'the', 'and', 'les', 'des', 'une', 'for', 'with'}
+
+
+def top_neighbours(scores, top, counts=None):
+    """
+    scores: CSR matrix, one row per title to find neighbours for, the title itself already removed.
+    counts: optional CSR matrix with the same sparsity pattern, a tie-breaker returned along
+    the score.
+    Returns [(row, [(column, score, count or None), ...] best first), ...] for the rows
+    having neighbours.
+    """
+    neighbours = []
+    for row in range(scores.shape[0]):
+        begin, end = scores.indptr[row], scores.indptr[row + 1]
+        if begin == end:
+            continue
+        columns = scores.indices[begin:end]
+        row_scores = scores.data[begin:end]
+        row_counts = counts.data[begin:end] if counts is not None else np.zeros(end - begin)
+        # best score first, then the highest count, then the lowest index, to be deterministic
+        order = np.lexsort((columns, -row_counts, -row_scores))[:top]
+        neighbours.append((row, [
+            (
+                int(columns[i]), float(row_scores[i]),
+                int(row_counts[i]) if counts is not None else None,
+            )
+            for i in order
+        ]))
+    return neighbours
+
+
+def drop_self(matrix, positions, min_value=0):
+    """matrix (CSR) without the cells (row, positions[row]) nor the ones below `min_value`"""
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    keep = (positions[rows] != matrix.indices) & (matrix.data > 0) & (matrix.data >= min_value)
+    return sparse.csr_matrix(
+        (matrix.data[keep], (rows[keep], matrix.indices[keep])), shape=matrix.shape
+    )
+
+
+def cooccurrence_neighbours(pairs, top=10, min_common=1):
+    """
+    pairs: iterable of (user_id, generic_book_id), one per rental (duplicates don't count twice)
+    Returns {generic_book_id: [(other generic_book_id, cosine score, common readers), ...]},
+    best first, keeping the pairs of titles having at least `min_common` readers in common.
+    """
+    pairs = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+    if not len(pairs):
+        return {}
+    users, user_positions = np.unique(pairs[:, 0], return_inverse=True)
+    titles, title_positions = np.unique(pairs[:, 1], return_inverse=True)
+
+    readers = sparse.csr_matrix(
+        (np.ones(len(pairs)), (user_positions, title_positions)), shape=(len(users), len(titles))
+    )
+    readers.data[:] = 1  # the constructor sums the duplicates, a reread is still one reader
+    common = drop_self((readers.T @ readers).tocsr(), np.arange(len(titles)), min_common)
+
+    rows = np.repeat(np.arange(len(titles)), np.diff(common.indptr))
+    nb_readers = np.asarray(readers.sum(axis=0)).ravel()
+    scores = common.copy()
+    scores.data = common.data / np.sqrt(nb_readers[rows] * nb_readers[common.indices])
+
+    return {
+        int(titles[row]): [
+            (int(titles[column]), score, count) for column, score, count in row_neighbours
+        ]
+        for row, row_neighbours in top_neighbours(scores, top, common)
+    }
+
+
+def title_features(title, author_id, genre_id, publication_year):
+    """{feature name: weight} of a GenericBook"""
+    decade = publication_year // 10
+    features = {
+        'author:{}'.format(author_id): FEATURE_WEIGHTS['author'],
+        'genre:{}'.format(genre_id): FEATURE_WEIGHTS['genre'],
+        'decade:{}'.format(decade): FEATURE_WEIGHTS['decade'],
+        'decade:{}'.format(decade - 1): FEATURE_WEIGHTS['near_decade'],
+        'decade:{}'.format(decade + 1): FEATURE_WEIGHTS['near_decade'],
+    }
+    for word in re.findall(r'\w+', title.lower()):
+        if len(word) > 2 and word not in TITLE_STOP_WORDS:
+            features['title:' + word] = FEATURE_WEIGHTS['title']
+    return features
+
+
+def feature_matrix(generic_books):
+    """
+    generic_books: iterable of (id, title, author_id, genre_id, publication_year)
+    Returns (ids, CSR matrix of the normalized hashed features, one row per id) sorted by id.
+    """
+    generic_books = sorted(generic_books)
+    ids = np.array([row[0] for row in generic_books], dtype=np.int64)
+    rows, columns, weights = [], [], []
+    for position, row in enumerate(generic_books):
+        for feature, weight in title_features(*row[1:]).items():
+            rows.append(position)
+            # crc32 rather than hash(), which changes from one python process to another
+            columns.append(zlib.crc32(feature.encode()) % N_FEATURES)
+            weights.append(weight)
+    features = sparse.csr_matrix((weights, (rows, columns)), shape=(len(ids), N_FEATURES))
+    norms = np.sqrt(np.asarray(features.multiply(features).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return ids, sparse.diags(1 / norms) @ features
+
+
+def content_neighbours(generic_books, top=10, only=None, batch_size=500, matrix=None):
+    """
+    generic_books: iterable of (id, title, author_id, genre_id, publication_year), whole catalogue
+    only: ids to find neighbours for (default all)
+    matrix: feature_matrix(generic_books), when the caller already built it
+    Returns {generic_book_id: [(other generic_book_id, cosine score), ...]}, best first.
+
+    Rows are compared by batches: the batch x catalogue product stays small whatever the
+    catalogue size.
+    """
+    ids, features = matrix or feature_matrix(generic_books)
+    targets = np.arange(len(ids)) if only is None else np.flatnonzero(np.isin(ids, list(only)))
+    neighbours = {}
+    for begin in range(0, len(targets), batch_size):
+        batch = targets[begin:begin + batch_size]
+        scores = drop_self((features[batch] @ features.T).tocsr(), batch)
+        for row, row_neighbours in top_neighbours(scores, top):
+            neighbours[int(ids[batch[row]])] = [
+                (int(ids[column]), score) for column, score, _ in row_neighbours
+            ]
+    return neighbours
+
+
+def content_similarities(generic_books, generic_book_ids, matrix=None, batch_size=500):
+    """
+    Yields (generic_book_id, {other generic_book_id: cosine score}) for each of `generic_book_ids`,
+    the scores of the titles sharing a feature with it (the ids missing from the catalogue are
+    left out).
+
+    Batches as in content_neighbours(): the genres and decades are shared by many titles, all the
+    rows at once would be an almost dense catalogue x catalogue product.
+    """
+    ids, features = matrix or feature_matrix(generic_books)
+    positions = np.flatnonzero(np.isin(ids, list(generic_book_ids)))
+    for begin in range(0, len(positions), batch_size):
+        batch = positions[begin:begin + batch_size]
+        scores = drop_self((features[batch] @ features.T).tocsr(), batch)
+        for row, position in enumerate(batch):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            yield int(ids[position]), {
+                int(ids[column]): float(score)
+                for column, score in zip(scores.indices[start:end], scores.data[start:end])
+            }
@@ -0,0 +1,52 @@
+"""
+How the nightly commands grow with the library (see the `scaling_benchmark` command).
+
+Each command is measured at several synth_data scales, then each measure (seconds, queries, peak
+RSS) is fitted as a power law of the scale, y = a * scale ** k, by a least squares line through the
+log-log points. k is the growth: 1 linear, 2 quadratic, 0 constant. A k clearly above 1 means the
+job will overflow the nightly window long before the library doubles twice.
+"""
+import resource
+import sys
+
+import numpy as np
+
+
+def fit_power_law(xs, ys):
+    """(k, a, r2) of y = a * x ** k, None when there aren't 2 distinct x with positive values"""
+    points = [(x, y) for x, y in zip(xs, ys) if x > 0 and y > 0]
+    if len({x for x, _ in points}) < 2:
+        return None
+    log_x = np.log([x for x, _ in points])
+    log_y = np.log([y for _, y in points])
+    k, log_a = np.polyfit(log_x, log_y, 1)
+    residuals = log_y - (k * log_x + log_a)
+    total = ((log_y - log_y.mean()) ** 2).sum()
+    r2 = 1 - (residuals ** 2).sum() / total if total else 1.0
+    return float(k), float(np.exp(log_a)), float(r2)
+
+
+def reset_peak_rss():
+    """
+    Linux resets the peak RSS of the process (VmHWM) when 5 is written to /proc/self/clear_refs.
+    False where it can't be done: peak_rss_mb() is then the peak of the whole process so far.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
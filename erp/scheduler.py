@@ -0,0 +1,151 @@
+"""
+In-process scheduler for the periodic jobs of the library (see the run_scheduler command).
+
+Jobs are regular management commands of the erp app, listed in settings.SCHEDULED_JOBS:
+    SCHEDULED_JOBS = {
+        'try_book_gbook': {'every_minutes': 60},
+        'inform_user_rent_overdue': {'daily_at': '02:00'},
+    }
+
+Running them from one long-lived process saves the interpreter and django.setup() startup at
+each run (that's what cron + manage.py costs). Overlapping runs, including from other hosts
+running the scheduler too, are prevented with a postgres advisory lock per job plus a look at
+JobRun to know if the current slot was already served.
+"""
+import logging
+import socket
+import traceback
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.core.management import call_command, load_command_class
+from django.db import connection
+from django.utils import timezone
+
+from erp import models as erp_models
+from erp.memo import memo_scope
+from erp.slowlog import slow_query_log
+
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """
+    A management command of the erp app, run either every `every_minutes`
+    or once a day at `daily_at` ('HH:MM', in settings.TIME_ZONE).
+    """
+    def __init__(self, name, every_minutes=None, daily_at=None):
+        if bool(every_minutes) == bool(daily_at):
+            raise ValueError("Job {} needs either every_minutes or daily_at".format(name))
+        self.name = name
+        self.every_minutes = every_minutes
+        self.daily_at = datetime.strptime(daily_at, '%H:%M').time() if daily_at else None
+
+    def __repr__(self):
+        return '<Job {}>'.format(self.name)
+
+    def last_slot(self, now):
+        """The most recent moment, up to `now`, at which the job was supposed to start."""
+        now = timezone.localtime(now)
+        if self.every_minutes:
+            interval = self.every_minutes * 60
+            midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            elapsed = (now - midnight).total_seconds()
+            return midnight + timedelta(seconds=elapsed - elapsed % interval)
+
+        slot = now.replace(
+            hour=self.daily_at.hour, minute=self.daily_at.minute, second=0, microsecond=0
+        )
+        if slot > now:
+            slot -= timedelta(days=1)
+        return slot
+
+
+def jobs_from_settings(scheduled_jobs):
+    return [Job(name, **schedule) for name, schedule in scheduled_jobs.items()]
+
+
+@contextmanager
+def job_lock(name):
+    """
+    Yield True if we own the lock of the job `name`, False if someone else does.
+
+    Advisory locks are a postgres feature. On other backends (sqlite for quick local
+    experiments) we don't protect against other hosts, there aren't any.
+    """
+    if connection.vendor != 'postgresql':
+        yield True
+        return
+
+    key = zlib.crc32(name.encode())
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [key])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
+
+
+def run_job(job, slot):
+    """
+    Run the job for the given slot, unless another scheduler is on it or already did it.
+    Returns the JobRun, or None if the job was skipped.
+    """
+    with job_lock(job.name) as acquired:
+        if not acquired:
+            logger.info("%s is already running somewhere else, skipping", job.name)
+            return None
+        if _was_served(job, slot):
+            return None
+
+        run = erp_models.JobRun.objects.create(
+            job_name=job.name,
+            host=socket.gethostname(),
+            started_at=timezone.now(),
+        )
+        command = load_command_class('erp', job.name)
+        try:
+            with memo_scope(), slow_query_log('command ' + job.name):
+                call_command(command)
+        except Exception:
+            run.has_failed = True
+            run.error = traceback.format_exc()
+            logger.exception("%s failed", job.name)
+
+        run.finished_at = timezone.now()
+        run.duration = run.finished_at - run.started_at
+        run.rows_processed = getattr(command, 'rows_processed', None)
+        run.save()
+        return run
+
+
+def run_pending(jobs, now=None, served=None):
+    """
+    Run every job whose last slot hasn't been served yet. Returns the JobRuns created.
+
+    `served` is an optional {job name: slot} dict, kept by the caller between two calls,
+    so that we don't ask the DB about a slot we already dealt with.
+    """
+    now = now or timezone.now()
+    served = {} if served is None else served
+    runs = []
+    for job in jobs:
+        slot = job.last_slot(now)
+        if served.get(job.name) == slot:
+            continue
+        run = run_job(job, slot)
+        if run:
+            runs.append(run)
+        # when another host holds the lock, we look again at the next tick
+        if run or _was_served(job, slot):
+            served[job.name] = slot
+    return runs
+
+
+def _was_served(job, slot):
+    return erp_models.JobRun.objects.filter(job_name=job.name, started_at__gte=slot).exists()
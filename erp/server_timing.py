@@ -0,0 +1,152 @@
+"""
+Where the time of an API request goes, in a Server-Timing header (browser devtools show it in the
+network tab, timing section) and optionally in the logs (SERVER_TIMING_LOG, erp.server_timing
+logger):
+
+    auth       knox authentication, its SQL included
+    perm       permission checks, their SQL included
+    queryset   SQL run by the view and its serializers: the querysets being evaluated
+    serialize  the rest of the view: python code of the view and serializers, model instances
+    render     JSON rendering
+    db         all the SQL of the request, with the number of queries
+    total      the whole request, as seen from ServerTimingMiddleware
+
+ServerTimingMiddleware puts a ServerTiming on the request and times the SQL, the views measure
+the phases through ServerTimingMixin, the renderer through TimedJSONRenderer. A phase measured
+inside another (an object permission checked in the view) is only counted once, in the inner one.
+Views called without the middleware (tests with APIRequestFactory, erp/contention.py) aren't timed.
+"""
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+
+
+INSTRUMENTATION = True  # not a call site, see slowlog.code_frames()
+logger = logging.getLogger(__name__)
+
+
+class ServerTiming:
+    def __init__(self):
+        self.ms = defaultdict(float)  # {phase: ms spent in it, nested phases excluded}
+        self.sql_ms = defaultdict(float)  # {phase: ms of SQL run during it}
+        self.queries = 0
+        self.stack = []  # [phase, ms of the nested phases]
+
+    @contextmanager
+    def phase(self, name):
+        self.stack.append([name, 0.0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            _, nested = self.stack.pop()
+            self.ms[name] += elapsed - nested
+            if self.stack:
+                self.stack[-1][1] += elapsed
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            current = self.stack[-1][0] if self.stack else None
+            self.sql_ms[current] += (time.perf_counter() - start) * 1000
+
+    def phases(self, total_ms):
+        """[(name, ms, description)], in the order of the header"""
+        return [
+            ('auth', self.ms['auth'], 'authentication'),
+            ('perm', self.ms['perm'], 'permission checks'),
+            ('queryset', self.sql_ms['view'], 'SQL of the view and serializers'),
+            ('serialize', self.ms['view'] - self.sql_ms['view'],
+             'view and serializers without their SQL'),
+            ('render', self.ms['render'], 'rendering'),
+            ('db', sum(self.sql_ms.values()), '{} queries'.format(self.queries)),
+            ('total', total_ms, None),
+        ]
+
+
+def header(phases):
+    return ', '.join(
+        '{};dur={:.1f}{}'.format(name, ms, ';desc="{}"'.format(description) if description else '')
+        for name, ms, description in phases
+    )
+
+
+@contextmanager
+def phase(request, name):
+    """Measure the block as `name` in the timing of the request, if it has one"""
+    timing = getattr(request, 'server_timing', None)
+    if timing is None:
+        yield
+        return
+    with timing.phase(name):
+        yield
+
+
+class ServerTimingMixin:
+    """For the APIViews: times authentication, permission checks and the handler, serializers in"""
+    def perform_authentication(self, request):
+        with phase(request, 'auth'):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with phase(request, 'perm'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with phase(request, 'perm'):
+            super().check_object_permissions(request, obj)
+
+    def dispatch(self, request, *args, **kwargs):
+        # initial() (auth, permissions) runs inside the handler's phase, it's taken out as a nested
+        # phase
+        timing = getattr(request, 'server_timing', None)
+        if timing is None:
+            return super().dispatch(request, *args, **kwargs)
+        with timing.phase('view'):
+            return super().dispatch(request, *args, **kwargs)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        request = (renderer_context or {}).get('request')
+        with phase(request, 'render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        enabled = settings.SERVER_TIMING or settings.SERVER_TIMING_LOG
+        if not request.path.startswith('/api/') or not enabled:
+            return self.get_response(request)
+
+        request.server_timing = timing = ServerTiming()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timing):
+            response = self.get_response(request)
+        phases = timing.phases((time.perf_counter() - start) * 1000)
+
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = header(phases)
+        if settings.SERVER_TIMING_LOG:
+            match = getattr(request, 'resolver_match', None)
+            logger.info("%s", json.dumps(dict(
+                {name: round(ms, 2) for name, ms, _ in phases},
+                method=request.method,
+                url_name=match.url_name if match is not None else None,
+                status=response.status_code,
+                queries=timing.queries,
+            ), sort_keys=True))
+        return response
@@ -0,0 +1,192 @@
+"""
+Slow query log: the statements over SLOW_QUERY_THRESHOLD_MS, plus a SLOW_QUERY_SAMPLE_RATE sample
+of the others (what normal looks like), written as JSON lines to SLOW_QUERY_LOG_PATH, a rotating
+file. Off when SLOW_QUERY_LOG_PATH isn't set. `slow_query_report` summarises the log.
+
+One record per statement kept:
+    {"at": iso datetime, "kind": "slow"|"sampled", "fingerprint",
+     "sql" (normalized, see erp/query_plans.py), "duration_ms",
+     "rows" (null when the driver can't tell), "source" (url name or command),
+     "role" (manager, librarian, subscriber, anonymous, user), "frames" (our code, innermost last)}
+
+The records of a request are kept in memory while it runs and written once the response is ready,
+with the url name and the role of the user (knowing the role takes a query, which can't run from
+within the execute wrapper). `slow_query_log()` does the same around a job or any block.
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from erp.query_plans import fingerprint, normalize_sql
+
+
+ERP_DIR = os.path.dirname(os.path.abspath(__file__))
+INSTRUMENTATION = True  # not a call site, see code_frames()
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def get_logger():
+    """The erp.slowlog logger, writing bare JSON lines to the rotating SLOW_QUERY_LOG_PATH file"""
+    global _handler
+    logger = logging.getLogger(__name__)
+    path = os.path.abspath(settings.SLOW_QUERY_LOG_PATH)
+    with _handler_lock:
+        if _handler is not None and _handler.baseFilename == path:
+            return logger
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        if _handler is not None:
+            logger.removeHandler(_handler)
+            _handler.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _handler = RotatingFileHandler(
+            path, maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES,
+            backupCount=settings.SLOW_QUERY_LOG_BACKUPS,
+        )
+        _handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(_handler)
+        return logger
+
+
+def code_frames(root, limit):
+    """
+    The last frames of the stack in the files under `root`, innermost last.
+    The modules setting INSTRUMENTATION = True are left out: their execute_wrappers, middlewares
+    and view mixins stand between our code and every query, they would fill the `limit` frames.
+    """
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None and len(frames) < limit:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if (filename.startswith(root) and 'site-packages' not in filename
+                and not frame.f_globals.get('INSTRUMENTATION')):
+            frames.append('{}:{} in {}'.format(
+                os.path.relpath(filename, settings.BASE_DIR), frame.f_lineno, frame.f_code.co_name
+            ))
+        frame = frame.f_back
+    return frames[::-1]
+
+
+def erp_frames(limit=6):
+    """The last frames of the stack in the erp package, instrumentation aside, innermost last"""
+    return code_frames(ERP_DIR, limit)
+
+
+def role_of(user):
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    groups = set(user.groups.values_list('name', flat=True))
+    roles = (('Managers', 'manager'), ('Librarians', 'librarian'), ('Subscribers', 'subscriber'))
+    for group, role in roles:
+        if group in groups:
+            return role
+    return 'user'
+
+
+class SlowQueryRecorder:
+    """execute_wrapper keeping the slow statements and the sampled ones in `records`"""
+    def __init__(self, threshold_ms, sample_rate, rng=random):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.rng = rng
+        self.records = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if duration_ms >= self.threshold_ms:
+                self.keep('slow', sql, duration_ms, context)
+            elif self.sample_rate and self.rng.random() < self.sample_rate:
+                self.keep('sampled', sql, duration_ms, context)
+
+    def keep(self, kind, sql, duration_ms, context):
+        rowcount = getattr(context.get('cursor'), 'rowcount', -1)
+        shape = normalize_sql(sql.replace('%s', '?'))
+        self.records.append({
+            'at': timezone.now().isoformat(),
+            'kind': kind,
+            'fingerprint': fingerprint(shape),
+            'sql': shape,
+            'duration_ms': round(duration_ms, 3),
+            'rows': rowcount if rowcount is not None and rowcount >= 0 else None,
+            'frames': erp_frames(),
+        })
+
+
+def write(records, source, role):
+    if not records:
+        return
+    logger = get_logger()
+    for record in records:
+        record.update(source=source, role=role)
+        logger.info(json.dumps(record, sort_keys=True))
+
+
+def new_recorder():
+    return SlowQueryRecorder(settings.SLOW_QUERY_THRESHOLD_MS, settings.SLOW_QUERY_SAMPLE_RATE)
+
+
+@contextmanager
+def slow_query_log(source, role='job'):
+    """Log the slow and sampled statements of the block under `source`, when the log is on"""
+    if not settings.SLOW_QUERY_LOG_PATH:
+        yield None
+        return
+    recorder = new_recorder()
+    try:
+        with connection.execute_wrapper(recorder):
+            yield recorder
+    finally:
+        write(recorder.records, source, role)
+
+
+class SlowQueryLogMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.SLOW_QUERY_LOG_PATH:
+            return self.get_response(request)
+
+        recorder = new_recorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        if recorder.records:
+            match = getattr(request, 'resolver_match', None)
+            source = (match.url_name or 'unnamed') if match is not None else 'unmatched'
+            # DRF sets the user it authenticated (token) on the django request too
+            write(
+                recorder.records, '{} {}'.format(request.method, source),
+                role_of(getattr(request, 'user', None)),
+            )
+        return response
+
+
+def read_records(path):
+    """The records of the log and of its rotated files, oldest file first"""
+    paths = [
+        '{}.{}'.format(path, i) for i in range(settings.SLOW_QUERY_LOG_BACKUPS, 0, -1)
+    ] + [path]
+    for log_path in paths:
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path) as log_file:
+            for line in log_file:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
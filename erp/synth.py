@@ -0,0 +1,62 @@
+"""
+Random draws of the `synth_data` command: a library with a realistic shape, not uniform noise.
+
+- popularity is Zipfian: the title of rank r is rented in proportion to 1 / r ** exponent, a few
+  best-sellers and a long tail; popular titles get more copies, sublinearly (sqrt of
+  the popularity)
+- each copy's rentals are laid one after the other on its timeline, never overlapping (the
+  erp_rental_no_overlap constraint holds), with random gaps; a copy still out today has its
+  last rental open
+- a rental lasts 1 to loan_days days, or, for a `late_rate` share of them, loan_days plus a
+  geometric number of days (a week on average)
+
+Everything is drawn from one numpy RandomState: the same seed gives the same library.
+Days are ordinals (date.toordinal()).
+"""
+import numpy as np
+
+
+def zipf_weights(n, exponent):
+    """Probabilities of ranks 1..n, decreasing"""
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def spread(total, weights, rng):
+    """`total` split among len(weights) with these weights, every one getting at least 1"""
+    weights = np.asarray(weights, dtype=float)
+    extra = max(total - len(weights), 0)
+    return 1 + rng.multinomial(extra, weights / weights.sum())
+
+
+def draw_indexes(cdf, size, rng):
+    """Indexes drawn following a cumulative distribution (np.cumsum of probabilities)"""
+    return np.minimum(np.searchsorted(cdf, rng.random_sample(size), side='right'), len(cdf) - 1)
+
+
+def rental_durations(size, loan_days, late_rate, rng):
+    durations = rng.randint(1, loan_days + 1, size=size)
+    late = rng.random_sample(size) < late_rate
+    overdue = loan_days + rng.geometric(1 / 7, size=size)
+    return np.where(late, overdue, durations)
+
+
+def copy_timeline(first_day, last_day, nb_rentals, loan_days, late_rate, rng):
+    """
+    Rentals of one copy as [(rent_on, returned_on)] in days, sorted, not overlapping, within
+    [first_day, last_day) (returned_on is excluded, the copy can go out again that day).
+    Fewer than nb_rentals when they don't fit in the period: a popular copy is saturated.
+    """
+    if nb_rentals <= 0 or last_day <= first_day:
+        return []
+    durations = rental_durations(nb_rentals, loan_days, late_rate, rng)
+    fits = np.cumsum(durations) <= last_day - first_day
+    durations = durations[fits]
+    if not len(durations):
+        return []
+    # the free days, cut at random in len(durations) + 1 gaps
+    free = last_day - first_day - int(durations.sum())
+    cuts = np.sort(rng.randint(0, free + 1, size=len(durations)))
+    gaps = np.diff(np.concatenate(([0], cuts)))
+    starts = first_day + np.cumsum(gaps) + np.concatenate(([0], np.cumsum(durations)[:-1]))
+    return [(int(start), int(start + duration)) for start, duration in zip(starts, durations)]
@@ -0,0 +1,300 @@
+"""
+Endpoint benchmarks: every URL of erp/urls.py, as each role, against a seeded library,
+checked against the budgets committed in benchmark_budgets.json.
+
+What's checked on each run of the test suite: the status code and the number of SQL queries of each
+(endpoint, role). Query counts don't depend on the machine, an N+1 regression shows up here before
+it shows up in production.
+
+Latency is only measured on demand, it's meaningless on a loaded CI machine:
+    BENCHMARK=1 ./manage.py test erp.tests.test_benchmarks
+runs each request BENCHMARK_ITERATIONS times (default 20) and also checks the p95 against the
+budget. Other knobs:
+    BENCHMARK_SCALE=5             seed 5 times more rows (default 1)
+    BENCHMARK_REPORT=path.json    write the measures (status, queries, p50, p95) there
+    BENCHMARK_UPDATE_BUDGETS=1    rewrite benchmark_budgets.json from the measures instead of
+                                  checking them, to commit after an intended change
+                                  (review the diff!)
+
+Each request runs in a transaction rolled back afterwards, so the writes (rent, return, reserve,
+logout) measure the same thing at each iteration.
+"""
+import json
+import math
+import os
+import time
+from datetime import date, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.db import connection, reset_queries, transaction
+from django.test import tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase
+
+from knox.models import AuthToken
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+from erp import urls
+
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_budgets.json')
+ROLES = ('anonymous', 'subscriber', 'librarian', 'manager')
+
+
+def bulk_load(model, rows):
+    """bulk_create, then read the rows back: only postgres sets their pk on bulk_create"""
+    model.objects.bulk_create(rows, batch_size=500)
+    return list(model.objects.order_by('-id')[:len(rows)])[::-1]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(math.ceil(fraction * len(values))) - 1, len(values) - 1)]
+
+
+@tag('benchmark')
+class EndpointBenchmarkTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        scale = int(os.environ.get('BENCHMARK_SCALE', 1))
+        today = date.today()
+
+        authors = bulk_load(
+            erp_models.Author, [erp_models.Author(name='Author %d' % i) for i in range(20 * scale)]
+        )
+        genres = bulk_load(
+            erp_models.Genre, [erp_models.Genre(name='Genre %d' % i) for i in range(8)]
+        )
+        gbooks = bulk_load(
+            erp_models.GenericBook,
+            [
+                erp_models.GenericBook(
+                    title='Title %d' % i,
+                    author=authors[i % len(authors)],
+                    genre=genres[i % len(genres)],
+                    publication_year=1800 + i % 200,
+                )
+                for i in range(200 * scale)
+            ]
+        )
+        books = bulk_load(
+            erp_models.Book,
+            [
+                erp_models.Book(
+                    generic_book=gbooks[i % len(gbooks)],
+                    joined_library_on=today - timedelta(days=400),
+                    # 1 copy in 10 is out, the open rentals below
+                    status='RENT' if i % 10 == 0 else 'AVAILABLE',
+                )
+                for i in range(3 * len(gbooks))
+            ]
+        )
+
+        subscribers_group, _ = Group.objects.get_or_create(name='Subscribers')
+        users = bulk_load(
+            User,
+            [User(username='reader%d@test.co' % i, email='reader%d@test.co' % i,
+                  first_name='Reader')
+             for i in range(100 * scale)]
+        )
+        User.groups.through.objects.bulk_create(
+            User.groups.through(user_id=user.id, group_id=subscribers_group.id) for user in users
+        )
+        erp_models.Subscriber.objects.bulk_create(
+            erp_models.Subscriber(
+                user=user, address_number_and_street='1 rue', address_zipcode='75000', iban='FR76',
+            )
+            for user in users
+        )
+
+        # history: returned rentals (back the same day, rent_on is today for all), the open ones,
+        # and the bookings, half of them waiting for a copy
+        erp_models.Rental.objects.bulk_create(
+            erp_models.Rental(
+                user=users[i % len(users)], book=books[i % len(books)], returned_on=today
+            )
+            for i in range(2000 * scale)
+        )
+        erp_models.Rental.objects.bulk_create(
+            erp_models.Rental(user=users[i % len(users)], book=book)
+            for i, book in enumerate(books) if book.status == 'RENT'
+        )
+        erp_models.Booking.objects.bulk_create(
+            erp_models.Booking(user=users[i % len(users)], generic_book=gbooks[i % len(gbooks)])
+            for i in range(300 * scale)
+        )
+        call_command('reconcile_circulation_summaries', '--fix', stdout=StringIO())
+
+        # pre-aggregated tables, as the nightly jobs leave them
+        erp_models.DailyCirculationStat.objects.bulk_create(
+            erp_models.DailyCirculationStat(day=today - timedelta(days=i), rentals_count=i % 40)
+            for i in range(1, 366)
+        )
+        erp_models.GenericBookDailyCirculation.objects.bulk_create(
+            erp_models.GenericBookDailyCirculation(
+                generic_book=gbooks[i % 50], day=today - timedelta(days=1 + i // 50),
+                rentals_count=i % 7,
+            )
+            for i in range(50 * 30)
+        )
+        erp_models.RelatedGenericBook.objects.bulk_create(
+            erp_models.RelatedGenericBook(
+                generic_book=gbook, related_generic_book=gbooks[(i + rank) % len(gbooks)],
+                rank=rank, score=1 / rank, common_readers=10 - rank,
+            )
+            for i, gbook in enumerate(gbooks) for rank in range(1, 11)
+        )
+        erp_models.SimilarGenericBook.objects.bulk_create(
+            erp_models.SimilarGenericBook(
+                generic_book=gbook, similar_generic_book=gbooks[(i + 7 * rank) % len(gbooks)],
+                rank=rank, score=1 / rank,
+            )
+            for i, gbook in enumerate(gbooks) for rank in range(1, 11)
+        )
+        call_command('forecast_acquisitions', stdout=StringIO())
+
+        # the users of the roles, and what their requests act on
+        cls.subscriber = erp_factories.SubscriberFactory()
+        cls.librarian = erp_factories.StandardLibrarianFactory()
+        cls.manager = erp_factories.ManagerLibrarianFactory()
+        cls.tokens = {
+            'anonymous': None,
+            'subscriber': AuthToken.objects.create(cls.subscriber.user),
+            'librarian': AuthToken.objects.create(cls.librarian.user),
+            'manager': AuthToken.objects.create(cls.manager.user),
+        }
+        cls.gbook = gbooks[0]
+        cls.rented_book = erp_factories.RentBookFactory(generic_book=gbooks[1])
+        erp_models.Rental.objects.create(user=cls.subscriber.user, book=cls.rented_book)
+        cls.available_book = erp_factories.AvailableBookFactory(generic_book=gbooks[2])
+        cls.unavailable_gbook = erp_factories.GenericBookFactory(title='Out of stock')
+
+        cls.client = APIClient()
+        # what a manager's `X-Profile: 1` request leaves behind
+        profiled = cls.client.get(
+            reverse('genre-list'), HTTP_X_PROFILE='1',
+            HTTP_AUTHORIZATION='Token %s' % cls.tokens['manager'],
+        )
+        cls.profile_pk = int(profiled['X-Profile-Id'])
+
+    def cases(self):
+        """(method, url name, url kwargs, data)"""
+        sub_pk = {'sub_pk': self.subscriber.pk}
+        return [
+            ('POST', 'login', {},
+             {'username': self.librarian.user.username, 'password': 'fakepwdd'}),
+            ('POST', 'logout', {}, None),
+            ('POST', 'logoutall', {}, None),
+            ('GET', 'librarian-list', {}, None),
+            ('GET', 'librarian-detail', {'pk': self.librarian.pk}, None),
+            ('GET', 'subscriber-list', {}, None),
+            ('GET', 'subscriber-detail', {'pk': self.subscriber.pk}, None),
+            ('GET', 'author-list', {}, None),
+            ('GET', 'author-detail', {'pk': self.gbook.author_id}, None),
+            ('GET', 'genre-list', {}, None),
+            ('GET', 'genre-detail', {'pk': self.gbook.genre_id}, None),
+            ('GET', 'generic-book-list', {}, None),
+            ('GET', 'generic-book-detail', {'pk': self.gbook.pk}, None),
+            ('GET', 'generic-book-related', {'pk': self.gbook.pk}, None),
+            ('GET', 'generic-book-similar', {'pk': self.gbook.pk}, None),
+            ('GET', 'book-list', {}, None),
+            ('GET', 'book-detail', {'pk': self.available_book.pk}, None),
+            ('GET', 'rent', sub_pk, None),
+            ('POST', 'rent', sub_pk, {'book_id': self.available_book.pk}),
+            ('POST', 'return', sub_pk, {'book_id': self.rented_book.pk}),
+            ('POST', 'reserve', sub_pk, {'genericbook_id': self.unavailable_gbook.pk}),
+            ('GET', 'subscriber-bookings', sub_pk, None),
+            ('GET', 'analytics-popular', {}, None),
+            ('GET', 'analytics-timeseries', {}, None),
+            ('GET', 'analytics-acquisitions', {}, None),
+            ('GET', 'analytics-trending', {}, None),
+            ('GET', 'analytics-inventory', {}, None),
+            ('GET', 'metrics', {}, None),
+            ('GET', 'profile-list', {}, None),
+            ('GET', 'profile-detail', {'pk': self.profile_pk}, None),
+            ('GET', 'profile-stats', {'pk': self.profile_pk}, None),
+        ]
+
+    def test_every_url_has_a_case(self):
+        self.assertEqual(
+            {name for _, name, _, _ in self.cases()},
+            {pattern.name for pattern in urls.urlpatterns},
+        )
+
+    def measure(self, method, path, data, token, iterations):
+        """(status code, queries of the last request, latencies in ms)"""
+        headers = {'HTTP_AUTHORIZATION': 'Token %s' % token} if token else {}
+        send = getattr(self.client, method.lower())
+        latencies = []
+        for _ in range(iterations + 1):  # the first one warms up the caches, not measured
+            # the log is capped at 9000 queries, past that CaptureQueriesContext sees none
+            reset_queries()
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = send(path, data=data, format='json', **headers)
+                    latency = (time.perf_counter() - start) * 1000
+                transaction.set_rollback(True)
+            latencies.append(latency)
+        return response.status_code, len(queries), latencies[1:]
+
+    def test_endpoints_within_budget(self):
+        timed = os.environ.get('BENCHMARK') == '1'
+        iterations = int(os.environ.get('BENCHMARK_ITERATIONS', 20)) if timed else 1
+        update = os.environ.get('BENCHMARK_UPDATE_BUDGETS') == '1'
+        with open(BUDGETS_PATH) as budgets_file:
+            budgets = json.load(budgets_file)
+
+        measures = {}
+        for method, name, kwargs, data in self.cases():
+            key = '{} {}'.format(method, name)
+            path = reverse(name, kwargs=kwargs)
+            for role in ROLES:
+                status_code, nb_queries, latencies = self.measure(
+                    method, path, data, self.tokens[role], iterations
+                )
+                measure = {
+                    'status': status_code,
+                    'queries': nb_queries,
+                    'p50_ms': round(percentile(latencies, 0.5), 2),
+                    'p95_ms': round(percentile(latencies, 0.95), 2),
+                }
+                measures.setdefault(key, {})[role] = measure
+                if update:
+                    continue
+
+                budget = budgets.get(key, {}).get(role)
+                with self.subTest(endpoint=key, role=role):
+                    self.assertIsNotNone(
+                        budget, "No budget for {} as {}, measured {}".format(key, role, measure)
+                    )
+                    self.assertEqual(status_code, budget['status'])
+                    self.assertLessEqual(
+                        nb_queries, budget['queries'], "more queries than the budget, N+1?"
+                    )
+                    if timed:
+                        self.assertLessEqual(measure['p95_ms'], budget['p95_ms'])
+
+        if os.environ.get('BENCHMARK_REPORT'):
+            with open(os.environ['BENCHMARK_REPORT'], 'w') as report:
+                json.dump(measures, report, indent=2, sort_keys=True)
+        if update:
+            # 3 times the measured p95, a budget is a ceiling to catch regressions, not a target
+            for key, roles in measures.items():
+                for role, measure in roles.items():
+                    previous = budgets.get(key, {}).get(role, {})
+                    budgets.setdefault(key, {})[role] = {
+                        'status': measure['status'],
+                        'queries': measure['queries'],
+                        'p95_ms': (
+                            max(math.ceil(measure['p95_ms'] * 3), 20) if timed
+                            else previous.get('p95_ms', 100)
+                        ),
+                    }
+            with open(BUDGETS_PATH, 'w') as budgets_file:
+                json.dump(budgets, budgets_file, indent=2, sort_keys=True)
+                budgets_file.write('\n')
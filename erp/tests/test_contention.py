@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+from erp.contention import check_invariants, classify
+
+
+class PgError(Exception):
+    def __init__(self, pgcode):
+        self.pgcode = pgcode
+
+
+class ClassifyTest(SimpleTestCase):
+    def test_by_sqlstate(self):
+        def wrapped(pgcode):
+            exception = Exception()
+            exception.__cause__ = PgError(pgcode)
+            return exception
+
+        self.assertEqual(classify(wrapped('40P01')), 'deadlock')
+        self.assertEqual(classify(wrapped('40001')), 'serialization_failure')
+        self.assertEqual(classify(wrapped('23P01')), 'constraint')
+        self.assertEqual(classify(AttributeError()), 'error')
+
+
+class CheckInvariantsTest(TestCase):
+    def test_all_well(self):
+        subscriber = erp_factories.SubscriberFactory()
+        book = erp_factories.RentBookFactory()
+        erp_models.Rental.objects.create(user=subscriber.user, book=book)
+
+        self.assertFalse(any(check_invariants().values()))
+
+    def test_broken_invariants_are_reported(self):
+        # broken behind the models' back, with queryset.update() as a buggy job would
+        subscriber = erp_factories.SubscriberFactory()
+        # rented, yet on the shelf
+        shelved = erp_factories.RentBookFactory()
+        erp_models.Rental.objects.create(user=subscriber.user, book=shelved)
+        erp_models.Book.objects.filter(pk=shelved.pk).update(status='AVAILABLE')
+        # 3 more rentals: 4 open for the subscriber
+        for title in ('Emma', 'Ulysses', 'Walden'):
+            book = erp_factories.RentBookFactory(
+                generic_book=erp_factories.GenericBookFactory(title=title)
+            )
+            erp_models.Rental.objects.create(user=subscriber.user, book=book)
+        erp_models.CirculationSummary.objects.filter(pk=subscriber.pk).update(open_rentals_count=0)
+
+        invariants = check_invariants()
+        self.assertEqual(invariants['copies_rented_twice'], [])
+        self.assertEqual(invariants['status_mismatch'], [shelved.pk])
+        self.assertEqual(invariants['over_rent_quota'], [subscriber.user_id])
+        self.assertEqual(invariants['summary_drift'], [subscriber.pk])
+        scoped = check_invariants(book_ids=[shelved.pk], user_ids=[])
+        self.assertEqual(scoped['status_mismatch'], [shelved.pk])
+        self.assertEqual(scoped['over_rent_quota'], [])
+
+    @skipUnless(connection.vendor != 'postgresql', "erp_rental_no_overlap refuses a second rental")
+    def test_copies_rented_twice_are_reported(self):
+        twice = erp_factories.RentBookFactory()
+        erp_models.Rental.objects.create(user=erp_factories.SubscriberFactory().user, book=twice)
+        erp_models.Rental.objects.create(user=erp_factories.SubscriberFactory().user, book=twice)
+
+        self.assertEqual(check_invariants()['copies_rented_twice'], [twice.pk])
+        self.assertEqual(check_invariants(book_ids=[])['copies_rented_twice'], [])
+
+
+class ContentionBenchmarkCommandTest(TestCase):
+    def test_single_client_run(self):
+        report_path = os.path.join(tempfile.mkdtemp(), 'report.json')
+        call_command(
+            'contention_benchmark', '--clients', '1', '--operations', '40', '--subscribers', '5',
+            '--copies', '2', '--json', report_path, stdout=StringIO(),
+        )
+
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report['operations'], 40)
+        self.assertEqual(report['errors'], 0)
+        self.assertGreater(report['per_operation']['rent']['ok'], 0)
+        self.assertFalse(any(report['invariants'].values()))
+        # the run cleaned up after itself
+        self.assertFalse(User.objects.filter(username__startswith='contention').exists())
+        self.assertFalse(erp_models.GenericBook.objects.exists())
+
+    def test_concurrent_clients_need_postgres(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('this is postgres')
+        with self.assertRaises(CommandError):
+            call_command('contention_benchmark', '--clients', '4', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', "concurrent transactions need postgres")
+class ContentionBenchmarkPostgresTest(TransactionTestCase):
+    def test_concurrent_clients(self):
+        report_path = os.path.join(tempfile.mkdtemp(), 'report.json')
+        try:
+            call_command(
+                'contention_benchmark', '--clients', '8', '--operations', '25',
+                '--subscribers', '20', '--json', report_path, stdout=StringIO(),
+            )
+        except CommandError:
+            pass  # broken invariants are in the report, checked below
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report['operations'], 8 * 25)
+        # the exclusion constraint keeps a copy from being rented twice, whatever the views do
+        self.assertEqual(report['invariants']['copies_rented_twice'], [])
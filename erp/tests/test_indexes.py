@@ -0,0 +1,120 @@
+"""
+Each hot circulation query must be able to use its index (see design_considerations.txt).
+
+The seeded dataset is small, the planner would rightly prefer sequential scans on it,
+so they are disabled: what's tested is that the index *can* serve the query,
+i.e. that the WHERE of the query still implies the condition of the partial index.
+"""
+from datetime import date, timedelta
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+
+from erp import factories as erp_factories
+from erp import inventory
+from erp import models as erp_models
+
+
+@skipUnless(connection.vendor == 'postgresql', "EXPLAIN plans are postgres specific")
+class HotQueryIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = erp_factories.AuthorFactory()
+        genre = erp_factories.GenreFactory()
+        gbooks = erp_models.GenericBook.objects.bulk_create(
+            erp_models.GenericBook(
+                title='Title %d' % i, author=author, genre=genre, publication_year=1900,
+            ) for i in range(50)
+        )
+        statuses = ['AVAILABLE', 'RENT', 'BOOKED', 'MAINTENANCE']
+        books = erp_models.Book.objects.bulk_create(
+            erp_models.Book(generic_book=gbooks[i % 50], status=statuses[i % 4])
+            for i in range(2000)
+        )
+        users = User.objects.bulk_create(User(username='reader%d' % i) for i in range(200))
+
+        # rent_on is today for all (auto_now_add), the returned ones are back the same day,
+        # the periods of a copy never overlap (erp_rental_no_overlap).
+        # As in a real library, few of the open rentals are overdue: 5 out of 100
+        erp_models.Rental.objects.bulk_create(
+            erp_models.Rental(
+                user=users[i % 200],
+                book=books[i % 2000],
+                due_for=date.today() + timedelta(days=i % 400 - 20),
+                # 1 copy out of 20 is still out
+                returned_on=None if i < 2000 and i % 20 == 0 else date.today(),
+            )
+            for i in range(10000)
+        )
+        erp_models.Booking.objects.bulk_create(
+            erp_models.Booking(
+                user=users[i % 200],
+                generic_book=gbooks[i % 50],
+                book=None if i % 10 == 0 else books[i % 2000],
+                was_cancelled=i % 3 == 0,
+            )
+            for i in range(3000)
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE erp_book')
+            cursor.execute('ANALYZE erp_rental')
+            cursor.execute('ANALYZE erp_booking')
+
+        cls.gbook = gbooks[0]
+        cls.book = books[0]
+        cls.user = users[0]
+
+    def assertUsesIndex(self, queryset, index_name):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+        self.assertNotIn('Seq Scan', plan, plan)
+
+    def test_copies_of_a_title_by_status(self):
+        self.assertUsesIndex(
+            self.gbook.books.filter(status='AVAILABLE'),
+            'erp_book_gbook_status_idx',
+        )
+
+    def test_open_rental_of_a_copy(self):
+        self.assertUsesIndex(
+            self.book.rentals.filter(returned_on__isnull=True),
+            'erp_rental_open_book_idx',
+        )
+
+    def test_open_rentals_of_a_subscriber(self):
+        self.assertUsesIndex(
+            self.user.rent_books.filter(returned_on__isnull=True),
+            'erp_rental_open_user_idx',
+        )
+
+    def test_overdue_and_tight_rentals(self):
+        self.assertUsesIndex(
+            erp_models.Rental.objects.filter(returned_on__isnull=True, due_for__lt=date.today()),
+            'erp_rental_open_due_for_idx',
+        )
+        self.assertUsesIndex(
+            erp_models.Rental.objects.filter(
+                returned_on__isnull=True,
+                due_for=date.today() + timedelta(days=4),
+            ),
+            'erp_rental_open_due_for_idx',
+        )
+
+    def test_booking_queue_of_a_title(self):
+        self.assertUsesIndex(
+            (self.gbook.bookings
+             .filter(book__isnull=True, was_cancelled=False)
+             .order_by('request_made_on')),
+            'erp_booking_queue_idx',
+        )
+
+    def test_rentals_going_on_at_a_date(self):
+        self.assertUsesIndex(
+            inventory.rentals_overlapping(date.today() - timedelta(days=30)),
+            'erp_rental_no_overlap',
+        )
@@ -0,0 +1,75 @@
+from datetime import date, timedelta
+from unittest import skipUnless
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase
+
+from freezegun import freeze_time
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+from erp.inventory import inventory_as_of, rentals_overlapping
+
+
+today = date.today()
+
+
+class RentalPeriodTest(TestCase):
+    def setUp(self):
+        self.sub = erp_factories.SubscriberFactory()
+        self.copy = erp_factories.RentBookFactory(joined_library_on=today - timedelta(days=100))
+        self.other_copy = erp_factories.AvailableBookFactory(
+            joined_library_on=today - timedelta(days=100)
+        )
+        erp_factories.RetiredBookFactory()  # left in 2010
+        erp_factories.AvailableBookFactory()  # joined today
+        # out from 20 to 10 days ago, then from 5 days ago on
+        with freeze_time(today - timedelta(days=20)):
+            self.returned = erp_models.Rental.objects.create(user=self.sub.user, book=self.copy)
+        self.returned.returned_on = today - timedelta(days=10)
+        self.returned.save()
+        with freeze_time(today - timedelta(days=5)):
+            self.open = erp_models.Rental.objects.create(user=self.sub.user, book=self.copy)
+
+    def days_ago(self, days):
+        return today - timedelta(days=days)
+
+    def test_rentals_overlapping(self):
+        self.assertEqual(list(rentals_overlapping(self.days_ago(15))), [self.returned])
+        self.assertEqual(list(rentals_overlapping(self.days_ago(10))), [])  # returned that day
+        self.assertEqual(list(rentals_overlapping(self.days_ago(7))), [])
+        self.assertEqual(list(rentals_overlapping(today)), [self.open])
+        self.assertEqual(
+            set(rentals_overlapping(self.days_ago(11), self.days_ago(5))),
+            {self.returned, self.open},
+        )
+        self.assertEqual(list(rentals_overlapping(self.days_ago(30), self.days_ago(21))), [])
+
+    def test_inventory_as_of(self):
+        snapshot = {book: book.rental_id for book in inventory_as_of(self.days_ago(15))}
+        self.assertEqual(snapshot, {self.copy: self.returned.id, self.other_copy: None})
+        snapshot = inventory_as_of(self.days_ago(7))
+        self.assertEqual([book.rental_id for book in snapshot], [None, None])
+        snapshot = inventory_as_of(today)
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(snapshot[0].rented_by_id, self.sub.user_id)
+
+    @skipUnless(connection.vendor == 'postgresql', "exclusion constraints are postgres specific")
+    def test_overlapping_rentals_of_a_copy_are_refused(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            erp_models.Rental.objects.create(user=self.sub.user, book=self.copy)
+        # another copy is fine
+        erp_models.Rental.objects.create(user=self.sub.user, book=self.other_copy)
+
+    def test_returns_before_the_rent_are_refused(self):
+        self.open.returned_on = self.days_ago(6)
+        with self.assertRaisesMessage(ValidationError, "returned before it was rented"):
+            self.open.save()
+
+    @skipUnless(connection.vendor == 'postgresql', "the check constraint is added on postgres")
+    def test_returns_before_the_rent_are_refused_by_the_db(self):
+        rentals = erp_models.Rental.objects.filter(pk=self.open.pk)
+        with self.assertRaisesMessage(IntegrityError, 'erp_rental_returned_after_rent'), \
+                transaction.atomic():
+            rentals.update(returned_on=self.days_ago(6))
@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import LiveServerTestCase, SimpleTestCase
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+from erp.loadgen import LatencyStats
+
+
+class LatencyStatsTest(SimpleTestCase):
+    def test_errors_rejections_and_histogram(self):
+        stats = LatencyStats()
+        stats.add('login', 200, 3)
+        stats.add('login', 0, 30000)
+        other = LatencyStats()
+        other.add('rent', 400, 12)
+        other.add('rent', 500, 60)
+        stats.merge(other)
+
+        self.assertEqual(stats.requests, 4)
+        self.assertEqual(stats.errors(), 2)  # the connection error and the 500
+        self.assertEqual(stats.rejections(), 1)
+        self.assertEqual(stats.errors('login'), 1)
+        histogram = dict(stats.histogram(stats.all_latencies()))
+        self.assertEqual(
+            (histogram[5], histogram[25], histogram[100], histogram[None]), (1, 1, 1, 1)
+        )
+        self.assertEqual(stats.summary(stats.all_latencies())['max_ms'], 30000)
+
+    def test_percentile(self):
+        latencies = list(range(1, 101))
+        self.assertEqual(LatencyStats.percentile(latencies, 0.5), 51)
+        self.assertEqual(LatencyStats.percentile(latencies, 0.95), 96)
+        self.assertEqual(LatencyStats.percentile(latencies, 1), 100)
+        self.assertIsNone(LatencyStats.percentile([], 0.5))
+
+
+class LoadgenCommandTest(LiveServerTestCase):
+    def setUp(self):
+        self.librarian = erp_factories.StandardLibrarianFactory()
+        self.subscriber = erp_factories.SubscriberFactory()
+        erp_factories.SubscriberFactory()
+        for title in ('Walden', 'Emma', 'Ulysses'):
+            erp_factories.AvailableBookFactory(
+                generic_book=erp_factories.GenericBookFactory(title=title)
+            )
+
+    def loadgen(self, *args):
+        """The report of a run; one virtual user at a time, the live server shares the sqlite DB"""
+        report_path = os.path.join(tempfile.mkdtemp(), 'report.json')
+        out = StringIO()
+        call_command(
+            'loadgen', '--url', self.live_server_url + '/api/',
+            '--concurrency', '1', '--think-time', '0',
+            '--json', report_path, *args, stdout=out,
+        )
+        self.assertIn('req/s', out.getvalue())
+        with open(report_path) as report_file:
+            return json.load(report_file)
+
+    def test_librarian_sessions(self):
+        report = self.loadgen(
+            '--librarian', self.librarian.user.username + ':fakepwdd',
+            '--mix', 'librarian=1', '--sessions', '2',
+        )
+
+        self.assertEqual(report['sessions'], 2)
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['steps']['login']['statuses'], {'200': 2})
+        self.assertEqual(report['steps']['rent_check']['statuses'], {'200': 2})
+        self.assertEqual(report['steps']['rent']['statuses'], {'200': 2})
+        self.assertEqual(report['steps']['return']['statuses'], {'200': 2})
+        self.assertEqual(report['steps']['logout']['statuses'], {'204': 2})
+        self.assertEqual(report['rejections'], 0)
+        # every copy rented was returned
+        self.assertFalse(erp_models.Book.objects.exclude(status='AVAILABLE').exists())
+        self.assertFalse(erp_models.Rental.objects.filter(returned_on__isnull=True).exists())
+
+    def test_subscriber_sessions(self):
+        report = self.loadgen(
+            '--subscriber', self.subscriber.user.username + ':fakepwdd',
+            '--mix', 'subscriber=1', '--sessions', '2',
+        )
+
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['steps']['title']['statuses'], {'200': 2})
+        self.assertEqual(report['steps']['similar']['statuses'], {'200': 2})
+        self.assertEqual(report['steps']['reserve']['statuses'], {'200': 2})
+        self.assertEqual(self.subscriber.user.bookings.count(), 2)
+        self.assertEqual(
+            report['total']['requests'], sum(bucket['requests'] for bucket in report['histogram'])
+        )
+
+    def test_a_role_of_the_mix_needs_an_account(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                'loadgen', '--librarian', 'someone:pwd', '--mix', 'librarian=1,subscriber=1'
+            )
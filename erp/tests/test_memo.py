@@ -0,0 +1,87 @@
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from knox.models import AuthToken
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+from erp.memo import memo_scope
+
+
+class MemoizedPropertyTest(TestCase):
+    def setUp(self):
+        self.sub = erp_factories.SubscriberFactory()
+        self.book = erp_factories.RentBookFactory()
+        self.rental = erp_models.Rental.objects.create(user=self.sub.user, book=self.book)
+
+    def test_no_scope_no_memo(self):
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.sub.current_rentals.count(), 1)
+
+    def test_memoized_within_scope(self):
+        with memo_scope() as scope:
+            with self.assertNumQueries(1):
+                self.assertEqual(self.sub.current_rentals.count(), 1)
+            with self.assertNumQueries(1):
+                self.assertTrue(self.sub.can_rent)
+            with self.assertNumQueries(1):
+                self.assertEqual(self.book.current_rental, self.rental)
+
+            with self.assertNumQueries(0):
+                self.assertEqual(self.sub.current_rentals.count(), 1)
+                self.assertEqual(list(self.sub.current_rentals), [self.rental])
+                rental = self.sub.current_rentals[0]
+                self.assertEqual(rental.book.generic_book, self.book.generic_book)
+                self.assertTrue(self.sub.can_rent)
+                self.assertEqual(self.book.current_rental, self.rental)
+                # another instance of the same subscriber shares the memo
+                same_sub = erp_models.Subscriber(pk=self.sub.pk, user_id=self.sub.user_id)
+                self.assertEqual(same_sub.current_rentals.count(), 1)
+
+        self.assertEqual(scope.hits, 6)
+        self.assertEqual(scope.saved_queries, 6)
+
+    def test_instance_fields_arent_memoized(self):
+        with memo_scope() as scope:
+            self.assertTrue(self.sub.can_rent)
+            self.sub.has_issue = True  # not saved
+            self.assertFalse(self.sub.can_rent)
+            self.assertTrue(erp_models.Subscriber.objects.get(pk=self.sub.pk).can_rent)
+
+            self.book.status = 'AVAILABLE'
+            self.assertIsNone(self.book.current_rental)
+
+            self.assertIsNone(erp_models.Book(generic_book=self.book.generic_book).open_rental)
+            self.assertNotIn(('book', None), scope.values)
+
+    def test_writes_invalidate(self):
+        with memo_scope():
+            self.assertEqual(self.sub.current_rentals.count(), 1)
+            self.assertEqual(self.book.current_rental, self.rental)
+
+            self.rental.returned_on = self.rental.rent_on
+            self.rental.save()
+            self.assertEqual(self.sub.current_rentals.count(), 0)
+            self.assertIsNone(self.book.current_rental)
+
+            self.assertTrue(self.sub.can_rent)
+            self.sub.didnt_follow_rules()
+            self.sub.didnt_follow_rules()
+            self.assertFalse(self.sub.can_rent)
+
+
+class MemoScopeMiddlewareTest(TestCase):
+    @override_settings(DEBUG=True)
+    def test_saved_queries_header(self):
+        lib = erp_factories.StandardLibrarianFactory()
+        token = AuthToken.objects.create(lib.user)
+        sub = erp_factories.SubscriberFactory()
+
+        res = APIClient().get(
+            path='/api/rent/%s/' % sub.pk,
+            format='json',
+            HTTP_AUTHORIZATION='Token %s' % token,
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertGreaterEqual(int(res['X-Memo-Saved-Queries']), 1)
@@ -0,0 +1,140 @@
+import threading
+from datetime import timedelta
+
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from erp import factories as erp_factories
+from erp import metrics
+from erp import models as erp_models
+
+
+REMOTE = {'REMOTE_ADDR': '10.0.0.7'}
+
+
+def sample(text, series):
+    """Value of the series (name and labels, as exposed) in the exposition, 0 if absent"""
+    for line in text.splitlines():
+        if line.startswith(series + ' '):
+            return float(line.split()[-1])
+    return 0
+
+
+class RegistryTest(SimpleTestCase):
+    def test_counter_and_histogram(self):
+        registry = metrics.Registry()
+        counter = registry.counter('test_total', 'Things', ('kind',))
+        histogram = registry.histogram('test_seconds', 'Durations', buckets=(0.1, 1))
+        counter.inc(kind='a')
+        counter.inc(2, kind='a "quoted"')
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value)
+
+        text = '\n'.join(registry.expose())
+        self.assertIn('# TYPE test_total counter', text)
+        self.assertEqual(sample(text, 'test_total{kind="a"}'), 1)
+        self.assertEqual(sample(text, 'test_total{kind="a \\"quoted\\""}'), 2)
+        # buckets are cumulated
+        self.assertEqual(sample(text, 'test_seconds_bucket{le="0.1"}'), 1)
+        self.assertEqual(sample(text, 'test_seconds_bucket{le="1"}'), 3)
+        self.assertEqual(sample(text, 'test_seconds_bucket{le="+Inf"}'), 4)
+        self.assertEqual(sample(text, 'test_seconds_count'), 4)
+        self.assertAlmostEqual(sample(text, 'test_seconds_sum'), 4.25)
+
+    def test_thread_safe(self):
+        counter = metrics.Registry().counter('test_total', 'Things')
+
+        def work():
+            for _ in range(5000):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.values[()], 40000)
+
+
+class MetricsEndpointTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mgr = erp_factories.ManagerLibrarianFactory()
+        cls.sub = erp_factories.SubscriberFactory()
+
+    def scrape(self):
+        self.client.force_authenticate(user=self.mgr.user)
+        response = self.client.get('/api/metrics/', **REMOTE)
+        self.client.force_authenticate(user=None)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_requests_are_counted(self):
+        series = 'library_http_requests_total{method="GET",url_name="genre-list",status="200"}'
+        queries = 'library_db_queries_per_request_count{method="GET",url_name="genre-list"}'
+        before = self.scrape()
+        self.client.force_authenticate(user=self.mgr.user)
+        self.client.get('/api/genres/')
+        self.client.get('/api/genres/')
+        after = self.scrape()
+
+        self.assertEqual(sample(after, series) - sample(before, series), 2)
+        self.assertEqual(sample(after, queries) - sample(before, queries), 2)
+        self.assertIn(
+            'library_http_request_duration_seconds_bucket'
+            '{method="GET",url_name="genre-list",le="0.005"}',
+            after,
+        )
+
+    def test_memo_hits(self):
+        before = self.scrape()
+        self.client.force_authenticate(user=self.mgr.user)
+        self.client.get('/api/subscribers/{}/'.format(self.sub.pk))
+        after = self.scrape()
+        self.assertGreater(
+            sample(after, 'library_memo_misses_total'), sample(before, 'library_memo_misses_total')
+        )
+
+    def test_auth_failures(self):
+        unauthenticated = 'library_auth_failures_total{reason="unauthenticated"}'
+        forbidden = 'library_auth_failures_total{reason="forbidden"}'
+        bad_credentials = 'library_auth_failures_total{reason="bad_credentials"}'
+        before = self.scrape()
+        self.assertEqual(self.client.get('/api/metrics/', **REMOTE).status_code, 401)
+        self.client.force_authenticate(user=self.sub.user)
+        self.assertEqual(self.client.get('/api/metrics/', **REMOTE).status_code, 403)
+        self.client.force_authenticate(user=None)
+        self.client.post(
+            '/api/login/', {'username': self.sub.user.username, 'password': 'wrong'}, format='json'
+        )
+        after = self.scrape()
+
+        self.assertEqual(sample(after, unauthenticated) - sample(before, unauthenticated), 1)
+        self.assertEqual(sample(after, forbidden) - sample(before, forbidden), 1)
+        self.assertEqual(sample(after, bad_credentials) - sample(before, bad_credentials), 1)
+
+    def test_allowed_addresses_need_no_token(self):
+        # none by default, localhost included: it is a reverse proxy's address too
+        localhost = {'REMOTE_ADDR': '127.0.0.1'}
+        self.assertEqual(self.client.get('/api/metrics/', **localhost).status_code, 401)
+        with override_settings(METRICS_ALLOWED_ADDRESSES=('127.0.0.1', '::1')):
+            self.assertEqual(self.client.get('/api/metrics/', **localhost).status_code, 200)
+            self.assertEqual(self.client.get('/api/metrics/', **REMOTE).status_code, 401)
+
+    def test_jobs(self):
+        now = timezone.now()
+        for hours_ago, rows, failed in ((2, 10, False), (1, 4, True)):
+            erp_models.JobRun.objects.create(
+                job_name='try_book_gbook', host='test',
+                started_at=now - timedelta(hours=hours_ago), duration=timedelta(seconds=rows),
+                rows_processed=rows, has_failed=failed,
+            )
+        text = self.scrape()
+        self.assertEqual(sample(text, 'library_job_runs_total{job="try_book_gbook"}'), 2)
+        self.assertEqual(sample(text, 'library_job_failures_total{job="try_book_gbook"}'), 1)
+        self.assertEqual(
+            sample(text, 'library_job_last_duration_seconds{job="try_book_gbook"}'), 4
+        )
+        self.assertEqual(sample(text, 'library_job_last_rows_processed{job="try_book_gbook"}'), 4)
@@ -1 +1,334 @@
-# TODO wait for the email formater and delivery backend to be set-up to write test
\ No newline at end of file
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from freezegun import freeze_time
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+
+
+class InformUserRentOverdueTest(TestCase):
+    def test_only_overdue_rentals_are_marked_late(self):
+        sub = erp_factories.SubscriberFactory()
+        overdue = erp_models.Rental.objects.create(
+            user=sub.user,
+            book=erp_factories.RentBookFactory(),
+            due_for=date.today() - timedelta(days=1),
+        )
+        on_time = erp_models.Rental.objects.create(
+            user=sub.user,
+            book=erp_factories.RentBookFactory(),
+        )
+        other_sub = erp_factories.SubscriberFactory()
+        erp_models.Rental.objects.create(
+            user=other_sub.user,
+            book=erp_factories.RentBookFactory(),
+            due_for=date.today() - timedelta(days=1),
+            returned_on=date.today(),
+        )
+
+        call_command('inform_user_rent_overdue')
+
+        overdue.refresh_from_db()
+        on_time.refresh_from_db()
+        sub.refresh_from_db()
+        other_sub.refresh_from_db()
+        self.assertTrue(overdue.late)
+        self.assertFalse(on_time.late)
+        self.assertTrue(sub.has_issue)
+        self.assertFalse(other_sub.has_issue)
+
+
+class ReconcileCirculationSummariesTest(TestCase):
+    def test_drift_reported_then_fixed(self):
+        sub = erp_factories.SubscriberFactory()
+        erp_models.Rental.objects.create(user=sub.user, book=erp_factories.RentBookFactory())
+        # bulk updates skip Rental.save(), hence the summaries
+        erp_models.Rental.objects.filter(user=sub.user).update(returned_on=date.today())
+
+        out = StringIO()
+        call_command('reconcile_circulation_summaries', stdout=out)
+        self.assertIn('1 summaries drifting', out.getvalue())
+        self.assertEqual(sub.circulation_summary.open_rentals_count, 1)
+
+        call_command('reconcile_circulation_summaries', '--fix', stdout=out)
+        self.assertEqual(sub.circulation_summary.open_rentals_count, 0)
+
+        out = StringIO()
+        call_command('reconcile_circulation_summaries', stdout=out)
+        self.assertIn('0 summaries drifting', out.getvalue())
+
+
+class RollupCirculationTest(TestCase):
+    def setUp(self):
+        self.sub = erp_factories.SubscriberFactory()
+        self.walden = erp_factories.GenericBookFactory()
+        self.other = erp_factories.GenericBookFactory(
+            title='Civil Disobedience',
+            genre=erp_factories.GenreFactory(name='Politics'),
+        )
+
+    def rent(self, gbook, day):
+        with freeze_time(day):
+            erp_models.Rental.objects.create(
+                user=self.sub.user,
+                book=erp_factories.RentBookFactory(generic_book=gbook),
+            )
+
+    def book(self, gbook, day):
+        with freeze_time(day):
+            erp_models.Booking.objects.create(user=self.sub.user, generic_book=gbook)
+
+    def test_rollup_is_incremental(self):
+        two_days_ago = date.today() - timedelta(days=2)
+        yesterday = date.today() - timedelta(days=1)
+        self.rent(self.walden, two_days_ago)
+        self.rent(self.walden, yesterday)
+        self.rent(self.other, yesterday)
+        self.book(self.walden, yesterday)
+        self.rent(self.walden, date.today())  # today isn't complete, not rolled up yet
+
+        call_command('rollup_circulation', stdout=StringIO())
+        call_command('rollup_circulation', stdout=StringIO())  # nothing new, nothing added
+
+        walden_days = erp_models.GenericBookDailyCirculation.objects.filter(
+            generic_book=self.walden
+        )
+        self.assertEqual(
+            sorted(walden_days.values_list('day', 'rentals_count', 'bookings_count')),
+            [(two_days_ago, 1, 0), (yesterday, 1, 1)],
+        )
+        author_yesterday = erp_models.AuthorDailyCirculation.objects.get(day=yesterday)
+        self.assertEqual((author_yesterday.rentals_count, author_yesterday.bookings_count), (2, 1))
+        genre_yesterday = erp_models.GenreDailyCirculation.objects.get(
+            genre=self.other.genre, day=yesterday
+        )
+        self.assertEqual(genre_yesterday.rentals_count, 1)
+
+        # the next day, today's rental gets in, added to what's there
+        with freeze_time(date.today() + timedelta(days=1)):
+            call_command('rollup_circulation', stdout=StringIO())
+        self.assertEqual(walden_days.get(day=date.today()).rentals_count, 1)
+        author_yesterday.refresh_from_db()
+        self.assertEqual(author_yesterday.rentals_count, 2)
+
+
+class RollupDailyStatsTest(TestCase):
+    def test_daily_buckets_filled_incrementally(self):
+        sub = erp_factories.SubscriberFactory()
+        gbook = erp_factories.GenericBookFactory()
+        three_days_ago = date.today() - timedelta(days=3)
+        yesterday = date.today() - timedelta(days=1)
+
+        with freeze_time(three_days_ago):
+            rental = erp_models.Rental.objects.create(
+                user=sub.user, book=erp_factories.RentBookFactory(generic_book=gbook)
+            )
+            booking = erp_models.Booking.objects.create(user=sub.user, generic_book=gbook)
+        with freeze_time(yesterday):
+            rental.returned_on = date.today()
+            rental.late = True
+            rental.save()
+            booking.was_cancelled = True
+            booking.save()
+
+        call_command('rollup_daily_stats', stdout=StringIO())
+
+        stats = erp_models.DailyCirculationStat.objects.all()
+        self.assertEqual(
+            [stat.day for stat in stats],
+            [three_days_ago + timedelta(days=i) for i in range(3)],
+        )
+        self.assertEqual((stats[0].rentals_count, stats[0].bookings_count), (1, 1))
+        self.assertEqual(stats[1].rentals_count, 0)
+        self.assertEqual(
+            (stats[2].returns_count, stats[2].late_returns_count, stats[2].cancellations_count),
+            (1, 1, 1),
+        )
+
+        # next run, only the new day
+        with freeze_time(date.today() + timedelta(days=1)):
+            out = StringIO()
+            call_command('rollup_daily_stats', stdout=out)
+        self.assertIn('1 days bucketed', out.getvalue())
+        self.assertEqual(erp_models.DailyCirculationStat.objects.count(), 4)
+
+
+class CopyUtilizationReportTest(TestCase):
+    def test_report_by_title(self):
+        sub = erp_factories.SubscriberFactory()
+        gbook = erp_factories.GenericBookFactory()
+        ten_days_ago = date.today() - timedelta(days=10)
+        rented = erp_factories.RentBookFactory(generic_book=gbook, joined_library_on=ten_days_ago)
+        erp_factories.AvailableBookFactory(generic_book=gbook, joined_library_on=ten_days_ago)
+        with freeze_time(date.today() - timedelta(days=5)):
+            erp_models.Rental.objects.create(user=sub.user, book=rented)
+        erp_models.Booking.objects.create(user=sub.user, generic_book=gbook)
+
+        out = StringIO()
+        call_command(
+            'copy_utilization_report', '--format', 'json', '--chunk-size', '1',
+            '--start', str(ten_days_ago), stdout=out,
+        )
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(report, [{
+            'generic_book_id': gbook.id,
+            'copies': 2,
+            'in_library_days': 20,  # 10 days up to yesterday, 2 copies
+            'rented_days': 5,
+            'idle_days': 15,
+            'rentals': 1,
+            'utilization': 0.25,
+            'queue_length': 1,
+            'queue_pressure': 0.5,
+        }])
+
+    def test_report_by_copy_as_csv(self):
+        book = erp_factories.AvailableBookFactory(
+            joined_library_on=date.today() - timedelta(days=30)
+        )
+        out = StringIO()
+        call_command('copy_utilization_report', '--by', 'copy', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            lines[0],
+            'book_id,generic_book_id,in_library_days,rented_days,idle_days,rentals,utilization',
+        )
+        self.assertEqual(lines[1], '{},{},30,0,30,0,0.0'.format(book.id, book.generic_book_id))
+
+    def test_invalid_dates(self):
+        for value in ('2018/02/01', '2018-02-30'):
+            with self.assertRaisesMessage(CommandError, 'is not a YYYY-MM-DD date'):
+                call_command('copy_utilization_report', '--start', value, stdout=StringIO())
+
+
+class BuildRelatedGenericBooksTest(TestCase):
+    def test_table_rebuilt_from_rentals(self):
+        walden = erp_factories.GenericBookFactory()
+        civil = erp_factories.GenericBookFactory(title='Civil Disobedience')
+        cod = erp_factories.GenericBookFactory(title='Cape Cod')
+        for titles in ([walden, civil], [walden, civil, cod], [cod]):
+            sub = erp_factories.SubscriberFactory()
+            for gbook in titles:
+                erp_models.Rental.objects.create(
+                    user=sub.user, book=erp_factories.RentBookFactory(generic_book=gbook)
+                )
+        erp_models.RelatedGenericBook.objects.create(
+            generic_book=cod, related_generic_book=walden, rank=1, score=1, common_readers=9
+        )
+
+        call_command('build_related_generic_books', '--min-common', '1', stdout=StringIO())
+
+        related = erp_models.RelatedGenericBook.objects.filter(generic_book=walden)
+        self.assertEqual(
+            [(row.related_generic_book, row.rank, row.common_readers) for row in related],
+            [(civil, 1, 2), (cod, 2, 1)],
+        )
+        self.assertAlmostEqual(related[0].score, 1.0)
+        # the stale row is gone
+        self.assertEqual(erp_models.RelatedGenericBook.objects.filter(generic_book=cod).count(), 2)
+
+
+class ForecastAcquisitionsTest(TestCase):
+    def test_forecast_per_generic_book(self):
+        gbook = erp_factories.GenericBookFactory()
+        copy = erp_factories.RentBookFactory(generic_book=gbook)
+        erp_factories.RetiredBookFactory(generic_book=gbook)
+        sub = erp_factories.SubscriberFactory()
+        with freeze_time(date.today() - timedelta(days=20)):
+            rental = erp_models.Rental.objects.create(user=sub.user, book=copy)
+        with freeze_time(date.today() - timedelta(days=12)):
+            resolved = erp_models.Booking.objects.create(user=sub.user, generic_book=gbook)
+        resolved.book = copy
+        resolved.book_booked_on = date.today() - timedelta(days=8)
+        resolved.save()
+        rental.returned_on = date.today() - timedelta(days=10)
+        rental.save()
+        with freeze_time(date.today() - timedelta(days=5)):
+            erp_models.Rental.objects.create(user=sub.user, book=copy)
+        for _ in range(2):
+            erp_models.Booking.objects.create(
+                user=erp_factories.SubscriberFactory().user, generic_book=gbook
+            )
+        erp_factories.GenericBookFactory(title='Cape Cod')  # no activity, no forecast
+
+        call_command('forecast_acquisitions', stdout=StringIO())
+
+        forecast = erp_models.AcquisitionForecast.objects.get()
+        self.assertEqual(forecast.generic_book, gbook)
+        self.assertEqual(forecast.queue_length, 2)
+        self.assertEqual(forecast.average_wait_days, 4)
+        self.assertEqual(forecast.copies_in_circulation, 1)
+        self.assertAlmostEqual(forecast.rentals_per_day, 2 / 90)
+        self.assertEqual(forecast.average_rental_days, 10)
+        # 2/90 * 10 copies busy + 2 bookings * 10 days / 7 days target = 3.08
+        self.assertEqual(forecast.copies_needed, 4)
+        self.assertEqual(forecast.extra_copies_needed, 3)
+
+    def test_days_at_least_one(self):
+        for days in ('0', '-7'):
+            with self.assertRaisesMessage(CommandError, '--days must be at least 1'):
+                call_command('forecast_acquisitions', '--days', days, stdout=StringIO())
+
+
+class ExtractChangesTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def extract(self, *args):
+        call_command('extract_changes', '--output-dir', self.tmp.name, '--lag', '0', *args,
+                     stdout=StringIO())
+        run_dir = os.path.join(self.tmp.name, sorted(os.listdir(self.tmp.name))[-1])
+        with open(os.path.join(run_dir, 'manifest.json')) as manifest:
+            return run_dir, json.load(manifest)
+
+    def read(self, run_dir, file):
+        with open(os.path.join(run_dir, file['path']), 'rb') as compressed:
+            content = compressed.read()
+        self.assertEqual(hashlib.sha256(content).hexdigest(), file['sha256'])
+        return [json.loads(line) for line in gzip.decompress(content).decode().splitlines()]
+
+    def test_only_changed_rows_extracted(self):
+        with freeze_time('2026-10-01 10:00'):
+            sub = erp_factories.SubscriberFactory()
+            booking = erp_models.Booking.objects.create(
+                user=sub.user, generic_book=erp_factories.GenericBookFactory()
+            )
+        with freeze_time('2026-10-02 01:00'):
+            run_dir, manifest = self.extract()
+        self.assertEqual(manifest['tables']['erp_booking']['rows'], 1)
+        self.assertIsNone(manifest['tables']['erp_booking']['changed_after'])
+        self.assertEqual(manifest['tables']['erp_subscriber']['rows'], 1)
+        [row] = self.read(run_dir, manifest['tables']['erp_booking']['files'][0])
+        self.assertEqual(row['id'], booking.id)
+        self.assertFalse(row['was_cancelled'])
+
+        with freeze_time('2026-10-02 12:00'):
+            booking.was_cancelled = True
+            booking.save()
+        with freeze_time('2026-10-03 01:00'):
+            run_dir, manifest = self.extract('--rows-per-file', '1')
+        self.assertEqual(
+            manifest['tables']['erp_booking']['changed_after'], '2026-10-02T01:00:00+00:00'
+        )
+        self.assertEqual(manifest['tables']['erp_subscriber']['rows'], 0)
+        self.assertEqual(manifest['tables']['erp_subscriber']['files'], [])
+        [row] = self.read(run_dir, manifest['tables']['erp_booking']['files'][0])
+        self.assertTrue(row['was_cancelled'])
+        self.assertEqual(row['cancelled_on'], '2026-10-02')
+
+        with freeze_time('2026-10-04 01:00'):
+            _, manifest = self.extract('--full', '--tables', 'erp_booking')
+        self.assertEqual(list(manifest['tables']), ['erp_booking'])
+        self.assertEqual(manifest['tables']['erp_booking']['rows'], 1)
@@ -1,8 +1,11 @@
 from datetime import date, timedelta
+from io import StringIO
 
 from django.conf import settings
+from django.core.management import call_command
 from django.core.exceptions import ValidationError # could do a test with ProtectedError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 
 from freezegun import freeze_time
 
@@ -76,6 +79,67 @@ class SubscriberModelTest(TestCase):
         self.assertFalse(sub_with_books.can_rent)
 
 
+class CirculationSummaryModelTest(TestCase):
+    def setUp(self):
+        self.sub = erp_factories.SubscriberFactory()
+
+    def test_summary_created_with_subscriber(self):
+        summary = erp_models.CirculationSummary.objects.get(subscriber=self.sub)
+        self.assertEqual(summary.open_rentals_count, 0)
+        self.assertEqual(summary.open_bookings_count, 0)
+        self.assertIsNone(summary.next_due_for)
+
+    def test_summary_follows_rentals(self):
+        books = erp_factories.RentBookFactory.create_batch(2)
+        rentals = [
+            erp_models.Rental.objects.create(user=self.sub.user, book=book) for book in books
+        ]
+        rentals[1].due_for = today + timedelta(days=1)
+        rentals[1].late = True
+        rentals[1].save()
+
+        summary = self.sub.circulation_summary
+        self.assertEqual(summary.open_rentals_count, 2)
+        self.assertEqual(summary.next_due_for, today + timedelta(days=1))
+        self.assertEqual(summary.late_rentals_count, 1)
+
+        rentals[1].returned_on = today
+        rentals[1].save()
+        summary = self.sub.circulation_summary
+        self.assertEqual(summary.open_rentals_count, 1)
+        self.assertEqual(summary.next_due_for, rentals[0].due_for)
+        self.assertEqual(summary.late_rentals_count, 0)
+
+        rentals[0].delete()
+        self.assertEqual(self.sub.circulation_summary.open_rentals_count, 0)
+
+    def test_summary_follows_bookings(self):
+        gbook = erp_factories.GenericBookFactory()
+        booking = erp_models.Booking.objects.create(user=self.sub.user, generic_book=gbook)
+        self.assertEqual(self.sub.circulation_summary.open_bookings_count, 1)
+
+        booking.was_cancelled = True
+        booking.save()
+        self.assertEqual(self.sub.circulation_summary.open_bookings_count, 0)
+
+    def test_can_rent_is_one_primary_key_read(self):
+        erp_models.Rental.objects.create(user=self.sub.user, book=erp_factories.RentBookFactory())
+        with self.assertNumQueries(1):
+            self.assertTrue(self.sub.can_rent)
+
+    def test_summary_of_subscriber_created_in_bulk(self):
+        user = erp_factories.SubscriberUserFactory()
+        sub, = erp_models.Subscriber.objects.bulk_create([erp_models.Subscriber(
+            user=user,
+            address_number_and_street='1, rue de la Paix',
+            address_zipcode='75001',
+            iban='FR7630056009271234567890182',
+        )])
+        sub = erp_models.Subscriber.objects.get(user=user)
+        self.assertEqual(sub.circulation_summary.open_rentals_count, 0)
+        self.assertTrue(erp_models.CirculationSummary.objects.filter(subscriber=sub).exists())
+
+
 class BookModelTest(TestCase):
     def test_joined_date(self):
         new_book = erp_factories.AvailableBookFactory()
@@ -135,4 +199,161 @@ class BookModelTest(TestCase):
 
 
 class BookingModelTest(TestCase):
-    pass # to come
+    def test_cancellation_date(self):
+        sub = erp_factories.SubscriberFactory()
+        booking = erp_models.Booking.objects.create(
+            user=sub.user,
+            generic_book=erp_factories.GenericBookFactory(),
+        )
+        self.assertIsNone(booking.cancelled_on)
+
+        with freeze_time(one_year_ago):
+            booking.was_cancelled = True
+            booking.save()
+        booking.save()
+        self.assertEqual(booking.cancelled_on, one_year_ago)
+
+    def test_is_over(self):
+        booking = erp_models.Booking.objects.create(
+            user=erp_factories.SubscriberFactory().user,
+            generic_book=erp_factories.GenericBookFactory(),
+        )
+        self.assertFalse(booking.is_over)  # still waiting for a copy
+
+        booking.book_booked_on = date.today() - timedelta(days=settings.MAX_BOOKING_DAYS)
+        self.assertFalse(booking.is_over)  # last day to fetch it
+        booking.book_booked_on -= timedelta(days=1)
+        self.assertTrue(booking.is_over)
+
+
+class SimilarGenericBookModelTest(TestCase):
+    def snapshot(self):
+        return [
+            (row.generic_book_id, row.rank, row.similar_generic_book_id, round(row.score, 6))
+            for row in erp_models.SimilarGenericBook.objects.all()
+        ]
+
+    def refresh(self):
+        call_command('refresh_similar_generic_books', stdout=StringIO())
+
+    @override_settings(SIMILAR_GENERIC_BOOKS_TOP=2)
+    def test_refreshed_like_a_full_rebuild(self):
+        thoreau = erp_factories.AuthorFactory()
+        emerson = erp_factories.AuthorFactory(name='Ralph Waldo Emerson')
+        walden = erp_factories.GenericBookFactory(author=thoreau)
+        self.refresh()
+        self.assertEqual(self.snapshot(), [])  # nothing to compare with yet
+
+        cod = erp_factories.GenericBookFactory(
+            title='Cape Cod', author=thoreau, publication_year=1865
+        )
+        nature = erp_factories.GenericBookFactory(
+            title='Nature', author=emerson, publication_year=1836
+        )
+        woods = erp_factories.GenericBookFactory(
+            title='The Maine Woods', author=thoreau, publication_year=1864
+        )
+        with self.assertNumQueries(1):
+            woods.save()  # only the UPDATE, the catalogue isn't read
+        self.refresh()
+        self.assertEqual(
+            [row.similar_generic_book for row in walden.similar.all()], [woods, cod]
+        )
+
+        # edits move titles in and out of the other lists
+        nature.author = thoreau
+        nature.title = 'Walden Woods'
+        nature.save()
+        woods.author = emerson
+        woods.save()
+        self.refresh()
+        incremental = self.snapshot()
+
+        call_command('build_similar_generic_books', stdout=StringIO())
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_only_the_changed_titles_are_refreshed(self):
+        erp_factories.GenericBookFactory()
+        erp_factories.GenericBookFactory(title='The Maine Woods')
+        later = timezone.now() + timedelta(hours=1)
+        for delay, title, expected in ((0, None, 2), (1, None, 0), (2, 'Cape Cod', 1)):
+            with freeze_time(later + timedelta(hours=delay)):
+                if title:
+                    erp_factories.GenericBookFactory(title=title)
+                out = StringIO()
+                call_command('refresh_similar_generic_books', stdout=out)
+            self.assertIn('{} GenericBooks refreshed'.format(expected), out.getvalue())
+        self.assertEqual(erp_models.SimilarGenericBook.objects.count(), 6)
+
+
+class AcquisitionForecastModelTest(TestCase):
+    def test_copies_for(self):
+        copies_for = erp_models.AcquisitionForecast.copies_for
+        # 0.5 rental a day lasting 10 days: 5 copies out on average
+        self.assertEqual(copies_for(0, 0.5, 10, 7), 5)
+        # 7 bookings waiting, 7 days rentals, 7 days target: one more copy per booking
+        self.assertEqual(copies_for(7, 0, 7, 7), 7)
+        self.assertEqual(copies_for(3, 0.2, 10, 10), 5)
+        self.assertEqual(copies_for(0, 0, 10, 7), 0)
+
+
+class TrendingScoreModelTest(TestCase):
+    @override_settings(TRENDING_HALF_LIFE_DAYS=7)
+    def test_events_decay_with_their_age(self):
+        walden = erp_factories.GenericBookFactory()
+        cod = erp_factories.GenericBookFactory(title='Cape Cod')
+        sub = erp_factories.SubscriberFactory()
+
+        with freeze_time('2026-10-05'):
+            for _ in range(2):
+                erp_models.Booking.objects.create(user=sub.user, generic_book=walden)
+        with freeze_time('2026-10-12'):
+            erp_models.Rental.objects.create(
+                user=sub.user, book=erp_factories.RentBookFactory(generic_book=cod)
+            )
+
+        with freeze_time('2026-10-12'):
+            walden_score = erp_models.TrendingScore.objects.get(pk=walden.pk)
+            cod_score = erp_models.TrendingScore.objects.get(pk=cod.pk)
+            decayed = erp_models.TrendingScore.decayed
+            # 2 bookings a week ago weigh as much as 1 rental today
+            self.assertAlmostEqual(decayed(walden_score.bookings_score), 1)
+            self.assertAlmostEqual(decayed(cod_score.rentals_score), 1)
+            self.assertEqual(walden_score.rentals_score, 0)
+        with freeze_time('2026-10-26'):
+            self.assertAlmostEqual(decayed(cod_score.score), 0.25)
+
+        # the stored scores rank the titles like the decayed ones
+        with freeze_time('2026-10-12 01:00'):
+            erp_models.Booking.objects.create(user=sub.user, generic_book=walden)
+        self.assertEqual(
+            [trending.generic_book for trending in erp_models.TrendingScore.objects.all()],
+            [walden, cod],
+        )
+
+    @override_settings(TRENDING_HALF_LIFE_DAYS=3)
+    def test_renormalization(self):
+        walden = erp_factories.GenericBookFactory()
+        cod = erp_factories.GenericBookFactory(title='Cape Cod')
+        sub = erp_factories.SubscriberFactory()
+        TrendingScore = erp_models.TrendingScore
+
+        # 2 ** ((2026 - 2018) / 3 days) is beyond the floats, the landmark has to move first
+        with freeze_time('2026-10-05'):
+            self.assertEqual(TrendingScore.renormalize(), 0)
+            self.assertEqual(TrendingScore.landmark(), timezone.now())
+            erp_models.Booking.objects.create(user=sub.user, generic_book=walden)
+        with freeze_time('2026-10-08'):
+            erp_models.Rental.objects.create(
+                user=sub.user, book=erp_factories.RentBookFactory(generic_book=cod)
+            )
+            before = {t.pk: TrendingScore.decayed(t.score) for t in TrendingScore.objects.all()}
+            self.assertEqual(TrendingScore.renormalize(), 2)
+            after = {t.pk: TrendingScore.decayed(t.score) for t in TrendingScore.objects.all()}
+
+        self.assertEqual(before.keys(), after.keys())
+        for pk in before:
+            self.assertAlmostEqual(before[pk], after[pk])
+        self.assertAlmostEqual(after[walden.pk], 0.5)
+        self.assertAlmostEqual(TrendingScore.objects.get(pk=cod.pk).score, 1)
+        self.assertEqual([t.generic_book for t in TrendingScore.objects.all()], [cod, walden])
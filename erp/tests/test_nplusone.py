@@ -0,0 +1,57 @@
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+from erp.nplusone import NPlusOneError, detect_nplusone, query_shape
+
+
+class QueryShapeTest(SimpleTestCase):
+    def test_parameters_and_in_lists(self):
+        sql = 'SELECT "erp_author"."id" FROM "erp_author" WHERE "erp_author"."id" = %s'
+        self.assertEqual(query_shape(sql), query_shape(sql.replace(' WHERE', '  WHERE')))
+        self.assertEqual(
+            query_shape('SELECT 1 FROM "erp_book" WHERE "id" IN (%s, %s, %s)'),
+            query_shape('SELECT 1 FROM "erp_book" WHERE "id" IN (%s)'),
+        )
+
+
+@override_settings(NPLUSONE_DETECTION=True, NPLUSONE_THRESHOLD=3, NPLUSONE_STRICT=False)
+class NPlusOneMiddlewareTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mgr = erp_factories.ManagerLibrarianFactory()
+        for i in range(6):
+            erp_factories.GenericBookFactory(
+                title='Title %d' % i, author=erp_factories.AuthorFactory(),
+                genre=erp_factories.GenreFactory(),
+            )
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.mgr.user)
+
+    def test_repeated_query_is_logged_with_its_field(self):
+        with self.assertLogs('erp.nplusone', 'WARNING') as logs:
+            response = self.client.get('/api/generic_books/')
+        self.assertEqual(response.status_code, 200)
+        output = '\n'.join(logs.output)
+        self.assertIn('generic-book-list', output)
+        self.assertIn('GenericBookSerializerRead.author', output)
+        self.assertIn('erp/views.py', output)
+
+    @override_settings(NPLUSONE_STRICT=True)
+    def test_strict_mode_fails(self):
+        with self.assertRaises(NPlusOneError):
+            self.client.get('/api/generic_books/')
+
+    @override_settings(NPLUSONE_STRICT=True)
+    def test_no_repeat_no_detection(self):
+        response = self.client.get('/api/genres/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_detect_block(self):
+        with self.assertRaises(NPlusOneError) as raised:
+            with detect_nplusone('titles', threshold=2, strict=True):
+                for gbook in erp_models.GenericBook.objects.all():
+                    str(gbook.author)
+        self.assertIn('titles: 6 times the same query', str(raised.exception))
@@ -0,0 +1,83 @@
+import marshal
+import pstats
+
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from knox.models import AuthToken
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+
+
+class ProfilingMiddlewareTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mgr = erp_factories.ManagerLibrarianFactory()
+        cls.librarian = erp_factories.StandardLibrarianFactory()
+        cls.sub = erp_factories.SubscriberFactory()
+
+    def get(self, path, user, **extra):
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % AuthToken.objects.create(user))
+        return self.client.get(path, **extra)
+
+    @override_settings(SERVER_TIMING=True, NPLUSONE_DETECTION=True)
+    def test_manager_gets_a_profile(self):
+        response = self.get(
+            '/api/subscribers/{}/'.format(self.sub.pk), self.mgr.user, HTTP_X_PROFILE='1'
+        )
+        self.assertEqual(response.status_code, 200)
+        profile = erp_models.RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(
+            (profile.url_name, profile.status_code, profile.user),
+            ('subscriber-detail', 200, self.mgr.user),
+        )
+        self.assertGreater(profile.queries_count, 0)
+
+        detail = self.get('/api/profiles/{}/'.format(profile.pk), self.mgr.user).json()
+        self.assertEqual(detail['queries_count'], len(detail['sql_timeline']))
+        starts = [statement['start_ms'] for statement in detail['sql_timeline']]
+        self.assertEqual(starts, sorted(starts))
+        frames = [frame for statement in detail['sql_timeline'] for frame in statement['frames']]
+        self.assertIn('erp/views.py', ' '.join(frames))
+        # where the queries come from, not the middlewares and execute_wrappers they go through
+        for module in ('server_timing', 'metrics', 'nplusone', 'profiling', 'memo'):
+            self.assertFalse(
+                [f for f in frames if f.startswith('erp/{}.py'.format(module))], frames
+            )
+        self.assertIn('cumulative', detail['summary'])
+
+        stats = self.get('/api/profiles/{}/stats/'.format(profile.pk), self.mgr.user)
+        self.assertEqual(stats.status_code, 200)
+        self.assertIn('attachment', stats['Content-Disposition'])
+        loaded = pstats.Stats()
+        loaded.stats = marshal.loads(stats.content)
+        self.assertTrue(any(name == 'get' for _, _, name in loaded.stats))
+
+        listed = self.get('/api/profiles/', self.mgr.user).json()
+        self.assertEqual(listed[0]['id'], profile.pk)
+
+    def test_query_flag(self):
+        response = self.get('/api/genres/?profile=1', self.mgr.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Profile-Id', response)
+
+    def test_only_managers(self):
+        for user in (self.librarian.user, self.sub.user):
+            response = self.get('/api/genres/', user, HTTP_X_PROFILE='1')
+            self.assertNotIn('X-Profile-Id', response)
+        self.client.credentials(HTTP_AUTHORIZATION='Token nonsense')
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/genres/', HTTP_X_PROFILE='1'))
+        self.assertFalse(erp_models.RequestProfile.objects.exists())
+        self.assertEqual(self.get('/api/profiles/', self.librarian.user).status_code, 403)
+
+    @override_settings(PROFILES_KEPT=2)
+    def test_only_the_last_are_kept(self):
+        ids = [
+            self.get('/api/genres/', self.mgr.user, HTTP_X_PROFILE='1')['X-Profile-Id']
+            for _ in range(3)
+        ]
+        self.assertEqual(
+            sorted(erp_models.RequestProfile.objects.values_list('pk', flat=True)),
+            sorted(map(int, ids[1:])),
+        )
@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+from erp import query_plans
+
+
+def scan(node_type, relation, index=None, **extra):
+    node = {'Node Type': node_type, 'Relation Name': relation, 'Total Cost': 10.0, 'Plan Rows': 3}
+    if index:
+        node['Index Name'] = index
+    node.update(extra)
+    return node
+
+
+def snapshot(root):
+    return query_plans.normalize_plan([{'Plan': root}])
+
+
+class NormalizeTest(SimpleTestCase):
+    def test_same_query_other_literals(self):
+        first = query_plans.normalize_sql(
+            'SELECT "erp_book"."id" FROM "erp_book" WHERE ("erp_book"."generic_book_id" = 12 '
+            'AND "erp_book"."status" = \'AVAILABLE\') LIMIT 1'
+        )
+        second = query_plans.normalize_sql(
+            'SELECT "erp_book"."id"  FROM "erp_book" WHERE ("erp_book"."generic_book_id" = 4071 '
+            'AND "erp_book"."status" = \'RENT\') LIMIT 21'
+        )
+        self.assertEqual(first, second)
+        self.assertIn('"generic_book_id" = ?', first)
+        self.assertEqual(
+            query_plans.normalize_sql('SELECT 1 FROM "erp_rental" WHERE "book_id" IN (1, 2, 3)'),
+            query_plans.normalize_sql('SELECT 1 FROM "erp_rental" WHERE "book_id" IN (7)'),
+        )
+        self.assertEqual(query_plans.fingerprint('SELECT 1'), query_plans.fingerprint('SELECT 2'))
+
+    def test_plan_shape_leaves_the_estimates_out(self):
+        plan = snapshot(scan(
+            'Nested Loop', None, **{'Join Type': 'Inner', 'Total Cost': 42.123, 'Plans': [
+                scan('Index Scan', 'erp_rental', 'erp_rental_open_user_idx',
+                     **{'Parent Relationship': 'Outer'}),
+                scan('Seq Scan', 'erp_book', **{'Parent Relationship': 'Inner'}),
+            ]}
+        ))
+        self.assertEqual(plan['cost'], 42.12)
+        self.assertNotIn('Plan Rows', json.dumps(plan))
+        self.assertEqual(plan['tree']['Plans'][0]['Index Name'], 'erp_rental_open_user_idx')
+        self.assertEqual(query_plans.seq_scanned(plan['tree']), {'erp_book'})
+
+
+class CompareTest(SimpleTestCase):
+    def test_flags(self):
+        index_scan = snapshot(scan('Index Scan', 'erp_rental', 'erp_rental_open_book_idx'))
+        seq_scan = snapshot(scan('Seq Scan', 'erp_rental'))
+        expensive = snapshot(
+            scan('Index Scan', 'erp_rental', 'erp_rental_open_book_idx', **{'Total Cost': 35.0})
+        )
+        other_index = snapshot(scan('Index Scan', 'erp_rental', 'erp_rental_open_user_idx'))
+        snapshots = {
+            'a': index_scan, 'b': index_scan, 'c': index_scan, 'd': index_scan, 'gone': index_scan,
+        }
+        plans = {'a': index_scan, 'b': seq_scan, 'c': expensive, 'd': other_index, 'new': seq_scan}
+
+        failures, notes = query_plans.compare(snapshots, plans, cost_ratio=2.0)
+        self.assertEqual(failures, {
+            'b': ['new sequential scan on erp_rental'],
+            'c': ['cost x3.5 (10.0 -> 35.0)'],
+        })
+        self.assertEqual(notes, {
+            'd': ['plan changed'],
+            'gone': ['not run anymore'],
+            'new': ['new query, no snapshot'],
+        })
+        # a seq scan already in the snapshot isn't news
+        self.assertEqual(query_plans.compare({'b': seq_scan}, {'b': seq_scan}), ({}, {}))
+        # a few page reads more on an almost empty table neither
+        empty = snapshot(scan('Seq Scan', 'erp_rental', **{'Total Cost': 0.05}))
+        one_page = snapshot(scan('Seq Scan', 'erp_rental', **{'Total Cost': 1.05}))
+        self.assertEqual(query_plans.compare({'e': empty}, {'e': one_page}), ({}, {}))
+
+
+class SnapshotQueryPlansCommandTest(TestCase):
+    def test_needs_postgres(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('this is postgres')
+        with self.assertRaises(CommandError):
+            call_command('snapshot_query_plans', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', "EXPLAIN plans are postgres specific")
+class SnapshotQueryPlansPostgresTest(TestCase):
+    def test_update_then_check(self):
+        manager = erp_factories.ManagerLibrarianFactory()
+        subscriber = erp_factories.SubscriberFactory()
+        erp_models.Rental.objects.create(
+            user=subscriber.user, book=erp_factories.RentBookFactory()
+        )
+        erp_factories.AvailableBookFactory()
+        snapshots_path = os.path.join(tempfile.mkdtemp(), 'plans.json')
+
+        call_command('snapshot_query_plans', '--current-db', '--update',
+                     '--snapshots', snapshots_path, stdout=StringIO())
+        with open(snapshots_path) as snapshots_file:
+            snapshots = json.load(snapshots_file)
+        sources = {plan['source'] for plan in snapshots.values()}
+        self.assertIn('GET generic-book-list', sources)
+        self.assertIn('command try_book_gbook', sources)
+
+        # the same library, the same plans
+        out = StringIO()
+        call_command('snapshot_query_plans', '--current-db', '--check',
+                     '--snapshots', snapshots_path, stdout=out)
+        self.assertIn('0 flagged', out.getvalue())
+        self.assertTrue(erp_models.Librarian.objects.filter(pk=manager.pk).exists())
+
+    def test_committed_snapshots(self):
+        # the library the snapshots were made on, see snapshot_query_plans
+        call_command('synth_data', '--scale', '0.1', '--seed', '0', stdout=StringIO())
+
+        out = StringIO()
+        call_command('snapshot_query_plans', '--current-db', stdout=out)
+        self.assertIn(' 0 flagged', out.getvalue(), out.getvalue())
@@ -0,0 +1,74 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.test import TestCase
+
+from freezegun import freeze_time
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+from erp.queues import availability_dates, waiting_bookings
+
+
+today = date.today()
+
+
+class AvailabilityDatesTest(TestCase):
+    def test_copies_go_round_the_queue(self):
+        in_3_days = today + timedelta(days=3)
+        self.assertEqual(
+            availability_dates([in_3_days, today], 4, loan_days=10),
+            [
+                today,
+                in_3_days,
+                today + timedelta(days=10),  # the first copy, back from the first booking
+                in_3_days + timedelta(days=10),
+            ],
+        )
+        self.assertEqual(availability_dates([today], 0, loan_days=10), [])
+        self.assertEqual(availability_dates([], 3, loan_days=10), [])
+
+
+class WaitingBookingsTest(TestCase):
+    def setUp(self):
+        self.gbook = erp_factories.GenericBookFactory()
+        self.other_gbook = erp_factories.GenericBookFactory(title='Cape Cod')
+        self.sub = erp_factories.SubscriberFactory()
+        self.copy = erp_factories.RentBookFactory(generic_book=self.gbook)
+        with freeze_time(today - timedelta(days=10)):
+            self.rental = erp_models.Rental.objects.create(
+                user=erp_factories.SubscriberFactory().user, book=self.copy
+            )
+
+    def book(self, user, gbook, days_ago):
+        with freeze_time(today - timedelta(days=days_ago)):
+            return erp_models.Booking.objects.create(user=user, generic_book=gbook)
+
+    def test_positions_and_estimates(self):
+        others = [erp_factories.SubscriberFactory().user for _ in range(2)]
+        self.book(others[0], self.gbook, 5)
+        mine = self.book(self.sub.user, self.gbook, 3)
+        self.book(others[1], self.gbook, 1)
+        erp_models.Booking.objects.create(
+            user=others[1], generic_book=self.gbook, was_cancelled=True
+        )
+        no_copy = self.book(self.sub.user, self.other_gbook, 2)
+
+        with self.assertNumQueries(3):  # the queues, the available copies, the open rentals
+            bookings = waiting_bookings(self.sub.user)
+
+        self.assertEqual([booking.id for booking in bookings], [mine.id, no_copy.id])
+        self.assertEqual(bookings[0].queue_position, 2)
+        # the copy is back on its due date, goes to the first in line for a full loan, then to us
+        self.assertEqual(
+            bookings[0].available_on, self.rental.due_for + timedelta(days=settings.MAX_RENT_DAYS)
+        )
+        self.assertEqual(bookings[1].queue_position, 1)
+        self.assertIsNone(bookings[1].available_on)
+
+    def test_overdue_copies_expected_today(self):
+        self.rental.due_for = today - timedelta(days=1)
+        self.rental.save()
+        self.book(self.sub.user, self.gbook, 1)
+        self.assertEqual(waiting_bookings(self.sub.user)[0].available_on, today)
+        self.assertEqual(waiting_bookings(erp_factories.SubscriberFactory().user), [])
@@ -0,0 +1,121 @@
+import random
+from math import sqrt
+
+from django.test import SimpleTestCase
+
+from erp.recommendations import (
+    content_neighbours, content_similarities, cooccurrence_neighbours, title_features,
+)
+
+
+class CooccurrenceNeighboursTest(SimpleTestCase):
+    def setUp(self):
+        # user -> titles rented
+        self.history = {
+            1: [10, 11, 12],
+            2: [10, 11],
+            3: [10, 11, 13],
+            4: [12, 13, 13],  # 13 reread
+            5: [14],
+        }
+        self.pairs = [(user, title) for user, titles in self.history.items() for title in titles]
+
+    def reference(self, title, other):
+        readers = {user for user, titles in self.history.items() if title in titles}
+        other_readers = {user for user, titles in self.history.items() if other in titles}
+        common = len(readers & other_readers)
+        return common / sqrt(len(readers) * len(other_readers)), common
+
+    def test_matches_cosine_of_reader_sets(self):
+        neighbours = cooccurrence_neighbours(self.pairs, top=10)
+
+        self.assertNotIn(14, neighbours)  # nobody else read it
+        for title, related in neighbours.items():
+            self.assertNotIn(title, [other for other, _, _ in related])
+            for other, score, common in related:
+                ref_score, ref_common = self.reference(title, other)
+                self.assertAlmostEqual(score, ref_score)
+                self.assertEqual(common, ref_common)
+            scores = [score for _, score, _ in related]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+
+        self.assertEqual(neighbours[10][0][:1], (11,))  # same 3 readers
+        self.assertAlmostEqual(neighbours[10][0][1], 1.0)
+
+    def test_top_and_min_common(self):
+        neighbours = cooccurrence_neighbours(self.pairs, top=1, min_common=2)
+        self.assertEqual(neighbours, {10: [(11, 1.0, 3)], 11: [(10, 1.0, 3)]})
+        self.assertEqual(cooccurrence_neighbours([]), {})
+
+
+class ContentNeighboursTest(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        words = ['walden', 'woods', 'river', 'night', 'civil', 'cod', 'journal', 'week']
+        self.generic_books = [
+            (
+                generic_book_id,
+                ' '.join(rng.sample(words, rng.randrange(1, 4))),
+                rng.randrange(1, 5),  # author
+                rng.randrange(1, 4),  # genre
+                rng.randrange(1800, 1900),
+            )
+            for generic_book_id in rng.sample(range(1, 500), 60)
+        ]
+
+    def reference(self, generic_book, other):
+        features = title_features(*generic_book[1:])
+        other_features = title_features(*other[1:])
+        dot = sum(weight * other_features.get(feature, 0) for feature, weight in features.items())
+        norm = sqrt(
+            sum(w * w for w in features.values()) * sum(w * w for w in other_features.values())
+        )
+        return dot / norm
+
+    def test_features(self):
+        self.assertEqual(title_features('The Maine Woods', 1, 2, 1864), {
+            'author:1': 3.0,
+            'genre:2': 1.0,
+            'decade:186': 1.0,
+            'decade:185': 0.5,
+            'decade:187': 0.5,
+            'title:maine': 1.0,
+            'title:woods': 1.0,
+        })
+
+    def test_matches_brute_force_cosine(self):
+        by_id = {row[0]: row for row in self.generic_books}
+        neighbours = content_neighbours(self.generic_books, top=5, batch_size=7)
+
+        # same genre or author at least, with 60 titles
+        self.assertEqual(set(neighbours), set(by_id))
+        for generic_book_id, similar in neighbours.items():
+            generic_book = by_id[generic_book_id]
+            expected = sorted(
+                (-self.reference(generic_book, other), other[0])
+                for other in self.generic_books if other[0] != generic_book_id
+            )
+            self.assertEqual(len(similar), 5)
+            for (other_id, score), (ref_score, _) in zip(similar, expected):
+                self.assertAlmostEqual(score, -ref_score)
+            # same neighbours, except among ties on the last score
+            last = similar[-1][1] + 1e-9
+            self.assertEqual(
+                {other_id for other_id, score in similar if score > last},
+                {other_id for ref_score, other_id in expected[:5] if -ref_score > last},
+            )
+
+    def test_similarities_of_some_titles(self):
+        first, second = self.generic_books[:2]
+        similarities = dict(content_similarities(
+            self.generic_books, [first[0], second[0], 10 ** 6], batch_size=1
+        ))
+        self.assertEqual(set(similarities), {first[0], second[0]})
+        for generic_book in (first, second):
+            self.assertNotIn(generic_book[0], similarities[generic_book[0]])
+            for other in self.generic_books:
+                if other is not generic_book:
+                    self.assertAlmostEqual(
+                        similarities[generic_book[0]].get(other[0], 0),
+                        self.reference(generic_book, other),
+                    )
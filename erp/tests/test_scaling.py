@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+
+from erp import models as erp_models
+from erp import scaling
+
+
+class FitPowerLawTest(SimpleTestCase):
+    def test_exponents(self):
+        scales = [0.01, 0.1, 1, 10]
+        k, a, r2 = scaling.fit_power_law(scales, [3 * x ** 2 for x in scales])
+        self.assertAlmostEqual(k, 2)
+        self.assertAlmostEqual(a, 3)
+        self.assertAlmostEqual(r2, 1)
+        k, _, _ = scaling.fit_power_law(scales, [5, 5, 5, 5])
+        self.assertAlmostEqual(k, 0)
+
+    def test_not_enough_points(self):
+        self.assertIsNone(scaling.fit_power_law([1, 1], [2, 3]))
+        self.assertIsNone(scaling.fit_power_law([1, 2], [0, 3]))  # a zero has no log
+
+    def test_peak_rss(self):
+        self.assertGreater(scaling.peak_rss_mb(), 0)
+
+
+class ScalingBenchmarkCommandTest(TestCase):
+    def scaling_benchmark(self, *args):
+        call_command(
+            'scaling_benchmark', '--current-db', '--scales', '0.005,0.01', '--batch-size', '100',
+            '--repeat', '1', *args, stdout=StringIO(), stderr=StringIO(),
+        )
+
+    def test_report(self):
+        report_path = os.path.join(tempfile.mkdtemp(), 'report.json')
+        self.scaling_benchmark('--json', report_path)
+
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(len(report['runs']), 6)
+        small, large = [
+            run for run in report['runs'] if run['command'] == 'inform_user_rent_overdue'
+        ]
+        self.assertLess(small['rentals'], large['rentals'])
+        self.assertGreater(large['queries'], 0)
+        self.assertIn('exponent', report['fits']['inform_user_rent_overdue']['seconds'])
+        # the waiting bookings of the seeded library get copies
+        small, large = [run for run in report['runs'] if run['command'] == 'try_book_gbook']
+        self.assertGreater(large['rows_processed'], 0)
+        self.assertIn('exponent', report['fits']['try_book_gbook']['queries'])
+        # each scale was rolled back
+        self.assertFalse(erp_models.GenericBook.objects.exists())
+
+    def test_check_fails_on_flagged_commands(self):
+        # anything growing faster than scale ** -1 is flagged
+        with self.assertRaises(CommandError):
+            self.scaling_benchmark('--check', '--max-exponent', '-1')
@@ -0,0 +1,85 @@
+from datetime import datetime
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.test import TestCase
+from django.utils import timezone
+
+from freezegun import freeze_time
+
+from erp import models as erp_models
+from erp import scheduler
+
+
+def aware(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+class CountingCommand(BaseCommand):
+    def handle(self, *args, **options):
+        self.rows_processed = 7
+
+
+class JobTest(TestCase):
+    def test_job_needs_one_schedule(self):
+        with self.assertRaises(ValueError):
+            scheduler.Job('try_book_gbook')
+        with self.assertRaises(ValueError):
+            scheduler.Job('try_book_gbook', every_minutes=5, daily_at='02:00')
+
+    def test_last_slot_daily(self):
+        job = scheduler.Job('inform_user_rent_overdue', daily_at='02:00')
+        self.assertEqual(job.last_slot(aware(2018, 10, 28, 1, 59)), aware(2018, 10, 27, 2, 0))
+        self.assertEqual(job.last_slot(aware(2018, 10, 28, 2, 0)), aware(2018, 10, 28, 2, 0))
+        self.assertEqual(job.last_slot(aware(2018, 10, 28, 23, 0)), aware(2018, 10, 28, 2, 0))
+
+    def test_last_slot_every_minutes(self):
+        job = scheduler.Job('try_book_gbook', every_minutes=15)
+        self.assertEqual(job.last_slot(aware(2018, 10, 28, 10, 14)), aware(2018, 10, 28, 10, 0))
+        self.assertEqual(job.last_slot(aware(2018, 10, 28, 10, 15)), aware(2018, 10, 28, 10, 15))
+
+
+class RunPendingTest(TestCase):
+    def setUp(self):
+        self.jobs = [
+            scheduler.Job('try_book_gbook', every_minutes=60),
+            scheduler.Job('inform_user_rent_deadline_is_close', daily_at='02:30'),
+        ]
+
+    def test_each_slot_runs_once(self):
+        with freeze_time('2018-10-28 10:05'):
+            runs = scheduler.run_pending(self.jobs)
+        self.assertEqual(len(runs), 2)
+        self.assertTrue(all(not run.has_failed for run in runs))
+        self.assertTrue(all(run.duration is not None for run in runs))
+
+        # same slots, from another process (no `served` memory): nothing to do
+        with freeze_time('2018-10-28 10:30'):
+            runs = scheduler.run_pending(self.jobs)
+        self.assertEqual(runs, [])
+
+        # next hour: only the hourly job
+        served = {}
+        with freeze_time('2018-10-28 11:00'):
+            runs = scheduler.run_pending(self.jobs, served=served)
+            self.assertEqual([run.job_name for run in runs], ['try_book_gbook'])
+            self.assertEqual(served['try_book_gbook'], aware(2018, 10, 28, 11, 0))
+
+            with self.assertNumQueries(0):
+                scheduler.run_pending(self.jobs, served=served)
+
+    @freeze_time('2018-10-28 10:05')
+    def test_rows_processed_recorded(self):
+        with mock.patch('erp.scheduler.load_command_class', return_value=CountingCommand()):
+            run, = scheduler.run_pending(self.jobs[:1])
+        self.assertEqual(run.rows_processed, 7)
+
+    @freeze_time('2018-10-28 10:05')
+    def test_failure_recorded(self):
+        with mock.patch('erp.scheduler.call_command', side_effect=RuntimeError('boom')), \
+                self.assertLogs('erp.scheduler', level='ERROR'):
+            runs = scheduler.run_pending(self.jobs[:1])
+
+        self.assertTrue(runs[0].has_failed)
+        self.assertIn('RuntimeError: boom', runs[0].error)
+        self.assertEqual(erp_models.JobRun.objects.filter(has_failed=True).count(), 1)
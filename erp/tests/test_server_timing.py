@@ -0,0 +1,87 @@
+import json
+import time
+
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from knox.models import AuthToken
+
+from erp import factories as erp_factories
+from erp.server_timing import ServerTiming, header
+
+
+def parse(value):
+    """{name: (ms, description)} of a Server-Timing header"""
+    phases = {}
+    for entry in value.split(', '):
+        name, *params = entry.split(';')
+        params = dict(param.split('=', 1) for param in params)
+        phases[name] = (float(params['dur']), params.get('desc', '').strip('"'))
+    return phases
+
+
+class ServerTimingTest(SimpleTestCase):
+    def test_nested_phases_count_once(self):
+        timing = ServerTiming()
+        with timing.phase('view'):
+            time.sleep(0.01)
+            with timing.phase('perm'):
+                time.sleep(0.02)
+        self.assertGreaterEqual(timing.ms['perm'], 20)
+        self.assertLess(timing.ms['view'], 20)
+
+    def test_header(self):
+        self.assertEqual(
+            header([('auth', 1.23, 'authentication'), ('total', 10, None)]),
+            'auth;dur=1.2;desc="authentication", total;dur=10.0',
+        )
+
+
+@override_settings(SERVER_TIMING=True)
+class ServerTimingMiddlewareTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mgr = erp_factories.ManagerLibrarianFactory()
+        for i in range(3):
+            erp_factories.GenericBookFactory(title='Title %d' % i)
+
+    def setUp(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token %s' % AuthToken.objects.create(self.mgr.user)
+        )
+
+    def test_phases(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/generic_books/')
+        self.assertEqual(response.status_code, 200)
+
+        phases = parse(response['Server-Timing'])
+        self.assertEqual(
+            list(phases), ['auth', 'perm', 'queryset', 'serialize', 'render', 'db', 'total']
+        )
+        self.assertEqual(phases['db'][1], '{} queries'.format(len(queries)))
+        for name in ('auth', 'perm', 'queryset'):
+            self.assertGreater(phases[name][0], 0, name)
+        # rendering 3 titles can take less than the 0.1ms of the header
+        self.assertGreaterEqual(phases['render'][0], 0)
+        parts = sum(
+            phases[name][0] for name in ('auth', 'perm', 'queryset', 'serialize', 'render')
+        )
+        self.assertLessEqual(parts, phases['total'][0] + 0.5)  # rounding of each part
+
+    def test_refused_requests_are_timed_too(self):
+        self.client.credentials()
+        response = self.client.get('/api/generic_books/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(SERVER_TIMING=False, SERVER_TIMING_LOG=True)
+    def test_log_only(self):
+        with self.assertLogs('erp.server_timing', 'INFO') as logs:
+            response = self.client.get('/api/generic_books/')
+        self.assertNotIn('Server-Timing', response)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['url_name'], record['status']), ('generic-book-list', 200))
+        self.assertGreater(record['queries'], 0)
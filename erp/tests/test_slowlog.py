@@ -0,0 +1,120 @@
+import json
+import os
+import random
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.test import APITestCase
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+from erp.metrics import QueryTimer
+from erp.nplusone import QueryShapes
+from erp.server_timing import ServerTiming
+from erp.slowlog import SlowQueryRecorder, read_records, slow_query_log
+
+
+def log_path():
+    return os.path.join(tempfile.mkdtemp(), 'slow_queries.jsonl')
+
+
+class SlowQueryRecorderTest(TestCase):
+    def record(self, threshold_ms, sample_rate):
+        recorder = SlowQueryRecorder(threshold_ms, sample_rate, random.Random(0))
+        with connection.execute_wrapper(recorder):
+            for _ in range(50):
+                list(erp_models.Genre.objects.filter(name='Poetry'))
+        return recorder.records
+
+    def test_threshold_and_sample(self):
+        slow = self.record(0, 0)
+        self.assertEqual(len(slow), 50)
+        self.assertEqual({record['kind'] for record in slow}, {'slow'})
+        self.assertIn('"erp_genre"."name" = ?', slow[0]['sql'])
+        self.assertIn('erp/tests/test_slowlog.py', slow[0]['frames'][-1])
+
+        sampled = self.record(10 ** 6, 0.2)
+        self.assertTrue(0 < len(sampled) < 50)
+        self.assertEqual({record['kind'] for record in sampled}, {'sampled'})
+        self.assertEqual(self.record(10 ** 6, 0), [])
+
+    def test_frames_skip_the_instrumentation(self):
+        recorder = SlowQueryRecorder(0, 0)
+        # the recorder innermost, the other execute_wrappers are on the stack of each query
+        with connection.execute_wrapper(QueryTimer()), \
+                connection.execute_wrapper(QueryShapes(5)), \
+                connection.execute_wrapper(ServerTiming()), \
+                connection.execute_wrapper(recorder):
+            erp_models.Genre.objects.count()
+        frames = recorder.records[0]['frames']
+        self.assertIn('erp/tests/test_slowlog.py', frames[-1])
+        for module in ('slowlog', 'metrics', 'nplusone', 'server_timing'):
+            self.assertFalse(
+                [f for f in frames if f.startswith('erp/{}.py'.format(module))], frames
+            )
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_SAMPLE_RATE=0)
+    def test_block(self):
+        path = log_path()
+        with override_settings(SLOW_QUERY_LOG_PATH=path):
+            with slow_query_log('command try_book_gbook'):
+                erp_models.Genre.objects.count()
+        records = list(read_records(path))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(
+            (records[0]['source'], records[0]['role']), ('command try_book_gbook', 'job')
+        )
+
+    @override_settings(SLOW_QUERY_LOG_PATH=None)
+    def test_off_without_a_path(self):
+        with slow_query_log('anything') as recorder:
+            erp_models.Genre.objects.count()
+        self.assertIsNone(recorder)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_SAMPLE_RATE=0)
+class SlowQueryLogMiddlewareTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mgr = erp_factories.ManagerLibrarianFactory()
+        cls.sub = erp_factories.SubscriberFactory()
+        erp_factories.GenreFactory()
+
+    def test_requests_are_attributed(self):
+        path = log_path()
+        self.client.force_authenticate(user=self.mgr.user)
+        with override_settings(SLOW_QUERY_LOG_PATH=path):
+            self.client.get('/api/genres/')
+        self.client.force_authenticate(user=self.sub.user)
+        with override_settings(SLOW_QUERY_LOG_PATH=path):
+            self.client.get('/api/genres/')
+
+        records = list(read_records(path))
+        self.assertTrue(records)
+        self.assertEqual({record['source'] for record in records}, {'GET genre-list'})
+        self.assertEqual({record['role'] for record in records}, {'manager', 'subscriber'})
+        self.assertTrue(
+            any('erp/views.py' in frame for record in records for frame in record['frames'])
+        )
+
+        # the report
+        report_path = os.path.join(os.path.dirname(path), 'report.json')
+        out = StringIO()
+        call_command('slow_query_report', '--path', path, '--by', 'source', '--json', report_path,
+                     stdout=out)
+        self.assertIn('GET genre-list', out.getvalue())
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(len(report), 1)
+        self.assertEqual(report[0]['slow'], len(records))
+        self.assertEqual(
+            report[0]['roles']['manager'] + report[0]['roles']['subscriber'], len(records)
+        )
+
+        call_command('slow_query_report', '--path', path, '--json', report_path, stdout=StringIO())
+        with open(report_path) as report_file:
+            by_statement = json.load(report_file)
+        self.assertEqual(sum(row['slow'] for row in by_statement), len(records))
@@ -0,0 +1,146 @@
+from collections import Counter
+from datetime import date, datetime, time
+from io import StringIO
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from erp import factories as erp_factories
+from erp import models as erp_models
+from erp import synth
+
+
+class SynthDrawsTest(SimpleTestCase):
+    def test_zipf_weights(self):
+        weights = synth.zipf_weights(100, 1.0)
+        self.assertAlmostEqual(weights.sum(), 1)
+        self.assertAlmostEqual(weights[0] / weights[9], 10)
+        self.assertTrue((np.diff(weights) < 0).all())
+
+    def test_spread_gives_at_least_one_each(self):
+        counts = synth.spread(50, [10, 1, 1, 0.1], np.random.RandomState(0))
+        self.assertEqual(counts.sum(), 50)
+        self.assertTrue((counts >= 1).all())
+        self.assertEqual(counts.argmax(), 0)
+
+    def test_copy_timeline_never_overlaps(self):
+        rng = np.random.RandomState(1)
+        for nb_rentals in (0, 1, 5, 40, 200):
+            timeline = synth.copy_timeline(1000, 1365, nb_rentals, 14, 0.1, rng)
+            self.assertLessEqual(len(timeline), nb_rentals)
+            for rent_on, returned_on in timeline:
+                self.assertTrue(1000 <= rent_on < returned_on <= 1365)
+            for (_, returned_on), (next_rent_on, _) in zip(timeline, timeline[1:]):
+                self.assertLessEqual(returned_on, next_rent_on)
+        # 200 rentals of at least a day don't fit in a year: the copy is saturated
+        self.assertLess(len(timeline), 200)
+
+    def test_late_rate(self):
+        durations = synth.rental_durations(20000, 14, 0.1, np.random.RandomState(2))
+        self.assertAlmostEqual((durations > 14).mean(), 0.1, delta=0.01)
+        self.assertEqual(durations.min(), 1)
+
+
+class SynthDataCommandTest(TestCase):
+    def synth_data(self, seed=3):
+        call_command('synth_data', '--scale', '0.01', '--seed', str(seed), '--batch-size', '100',
+                     stdout=StringIO())
+
+    def test_library_is_consistent(self):
+        self.synth_data()
+        today = date.today()
+
+        self.assertEqual(erp_models.GenericBook.objects.count(), 100)
+        self.assertEqual(erp_models.Subscriber.objects.count(), 50)
+        self.assertEqual(erp_models.Librarian.objects.filter(is_manager=True).count(), 1)
+        self.assertGreater(erp_models.Rental.objects.count(), 500)
+        self.assertEqual(erp_models.Booking.objects.count(), 100)
+        # dates weren't overwritten by auto_now_add
+        self.assertTrue(erp_models.Rental.objects.filter(rent_on__lt=today).exists())
+
+        # copies out and open rentals match, and a copy's rentals never overlap
+        open_rentals = erp_models.Rental.objects.filter(returned_on__isnull=True)
+        self.assertEqual(
+            set(open_rentals.values_list('book_id', flat=True)),
+            set(erp_models.Book.objects.filter(status='RENT').values_list('id', flat=True)),
+        )
+        periods = {}
+        rentals = erp_models.Rental.objects.order_by('book_id', 'rent_on')
+        for book_id, rent_on, returned_on in rentals.values_list(
+            'book_id', 'rent_on', 'returned_on'
+        ):
+            self.assertLessEqual(periods.get(book_id, rent_on), rent_on)
+            periods[book_id] = returned_on or date.max
+        self.assertFalse(erp_models.Rental.objects.filter(
+            book__status='RETIRED', returned_on__isnull=True
+        ).exists())
+
+        # the rules of the desk hold, and the summaries say so
+        per_user = Counter(open_rentals.values_list('user_id', flat=True))
+        self.assertLessEqual(max(per_user.values()), settings.MAX_RENT_BOOKS)
+        for summary in erp_models.CirculationSummary.objects.select_related('subscriber'):
+            self.assertEqual(
+                summary.open_rentals_count, per_user.get(summary.subscriber.user_id, 0)
+            )
+
+        # the most popular title is rented more than the median one
+        rentals = Counter(
+            erp_models.Rental.objects.values_list('book__generic_book_id', flat=True)
+        )
+        ranked = list(erp_models.GenericBook.objects.order_by('id').values_list('id', flat=True))
+        self.assertGreater(rentals[ranked[0]], rentals[ranked[50]])
+        # trending is about the last weeks, but the best-sellers lead there too
+        self.assertIn(
+            erp_models.TrendingScore.objects.order_by('-score')
+            .values_list('generic_book_id', flat=True)[0],
+            ranked[:5],
+        )
+
+    def test_same_seed_same_library(self):
+        def library():
+            return (
+                list(erp_models.GenericBook.objects.order_by('id')
+                     .values_list('title', 'publication_year')),
+                list(erp_models.Rental.objects.order_by('id')
+                     .values_list('rent_on', 'returned_on', 'late')),
+            )
+
+        self.synth_data()
+        first = library()
+        erp_models.Booking.objects.all().delete()
+        erp_models.Rental.objects.all().delete()
+        erp_models.Book.objects.all().delete()
+        erp_models.GenericBook.objects.all().delete()
+        erp_models.Author.objects.all().delete()
+        erp_models.Subscriber.objects.all().delete()
+        erp_models.Librarian.objects.all().delete()
+        User.objects.filter(username__startswith='synth.').delete()
+        self.synth_data()
+        self.assertEqual(library(), first)
+
+    @override_settings(TRENDING_HALF_LIFE_DAYS=3)
+    def test_trending_scores_as_record_would_have_them(self):
+        self.synth_data()
+        now = timezone.now()
+
+        def aged(day):
+            moment = datetime.combine(day, time.min, tzinfo=timezone.utc)
+            return 2 ** (-(now - moment).total_seconds() / 86400 / 3)
+
+        trending = erp_models.TrendingScore.objects.first()
+        rentals = erp_models.Rental.objects.filter(book__generic_book_id=trending.generic_book_id)
+        self.assertAlmostEqual(
+            erp_models.TrendingScore.decayed(trending.rentals_score, now),
+            sum(aged(day) for day in rentals.values_list('rent_on', flat=True)),
+            places=4,
+        )
+
+    def test_refuses_a_library_with_titles(self):
+        erp_factories.GenericBookFactory()
+        with self.assertRaises(CommandError):
+            self.synth_data()
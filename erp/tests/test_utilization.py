@@ -0,0 +1,113 @@
+import random
+from datetime import date, timedelta
+
+from django.test import SimpleTestCase
+
+from erp.utilization import UtilizationReport
+
+
+def reference_per_copy(copies, rentals, start, end):
+    """Same report, day by day, in plain python"""
+    period = {start + timedelta(days=i) for i in range((end - start).days + 1)}
+    report = {}
+    for book_id, generic_book_id, joined, left in copies:
+        present = {day for day in period if day >= joined and (left is None or day < left)}
+        rented, nb_rentals = set(), 0
+        for rental_book_id, rent_on, returned_on in rentals:
+            if rental_book_id != book_id:
+                continue
+            days = {
+                day for day in present
+                if day >= rent_on and (returned_on is None or day < returned_on)
+            }
+            if days:
+                nb_rentals += 1
+            rented |= days
+        report[book_id] = {
+            'generic_book_id': generic_book_id,
+            'in_library_days': len(present),
+            'rented_days': len(rented),
+            'rentals': nb_rentals,
+        }
+    return report
+
+
+class UtilizationReportTest(SimpleTestCase):
+    def setUp(self):
+        self.rng = random.Random(42)
+        self.start = date(2026, 1, 1)
+        self.end = date(2026, 3, 31)
+
+    def random_day(self):
+        return date(2025, 11, 1) + timedelta(days=self.rng.randrange(200))
+
+    def random_data(self):
+        copies = []
+        for book_id in self.rng.sample(range(1, 1000), 40):
+            joined = self.random_day()
+            left = None
+            if self.rng.random() < 0.3:
+                left = joined + timedelta(days=self.rng.randrange(1, 150))
+            copies.append((book_id, self.rng.randrange(1, 8), joined, left))
+
+        # rentals of one copy don't overlap, like in the library
+        rentals = []
+        for book_id, _, joined, left in copies:
+            day = joined
+            while self.rng.random() < 0.8:
+                rent_on = day + timedelta(days=self.rng.randrange(0, 20))
+                if self.rng.random() < 0.1:
+                    rentals.append((book_id, rent_on, None))
+                    break
+                returned_on = rent_on + timedelta(days=self.rng.randrange(1, 30))
+                rentals.append((book_id, rent_on, returned_on))
+                day = returned_on
+        rentals.append((5000, self.start, None))  # copy out of the report
+        self.rng.shuffle(rentals)
+        return copies, rentals
+
+    def test_matches_reference_implementation(self):
+        copies, rentals = self.random_data()
+        report = UtilizationReport(copies, self.start, self.end)
+        for i in range(0, len(rentals), 7):  # several chunks
+            report.add_rentals(rentals[i:i + 7])
+
+        expected = reference_per_copy(copies, rentals, self.start, self.end)
+        per_copy = report.per_copy()
+        self.assertEqual(len(per_copy), len(copies))
+        for row in per_copy:
+            ref = expected[row['book_id']]
+            self.assertEqual(row['generic_book_id'], ref['generic_book_id'])
+            self.assertEqual(row['in_library_days'], ref['in_library_days'])
+            self.assertEqual(row['rented_days'], ref['rented_days'])
+            self.assertEqual(row['rentals'], ref['rentals'])
+            self.assertEqual(row['idle_days'], ref['in_library_days'] - ref['rented_days'])
+
+        for row in report.per_title():
+            refs = [
+                ref for ref in expected.values()
+                if ref['generic_book_id'] == row['generic_book_id']
+            ]
+            in_library = sum(ref['in_library_days'] for ref in refs)
+            rented = sum(ref['rented_days'] for ref in refs)
+            self.assertEqual(row['in_library_days'], in_library)
+            self.assertEqual(row['rented_days'], rented)
+            self.assertEqual(row['copies'], len([ref for ref in refs if ref['in_library_days']]))
+            self.assertAlmostEqual(
+                row['utilization'], rented / in_library if in_library else 0, places=4
+            )
+
+    def test_queue_pressure(self):
+        copies = [
+            (1, 10, date(2025, 1, 1), None),
+            (2, 10, date(2025, 1, 1), None),
+            (3, 11, date(2025, 1, 1), date(2026, 2, 1)),  # retired during the period
+        ]
+        report = UtilizationReport(copies, self.start, self.end)
+        report.add_rentals([(1, date(2026, 3, 1), None)])
+
+        titles = {row['generic_book_id']: row for row in report.per_title({10: 3, 11: 2})}
+        self.assertEqual(titles[10]['queue_pressure'], 1.5)
+        self.assertEqual(titles[10]['rented_days'], 31)
+        self.assertIsNone(titles[11]['queue_pressure'])
+        self.assertEqual(titles[11]['in_library_days'], 31)
@@ -12,8 +12,12 @@ I only test the business logic intensive/process-centric ones.
 See urls.py for the difference.
 """
 from datetime import date, timedelta
+from io import StringIO
+from unittest import skipUnless
 
 from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
@@ -352,6 +356,27 @@ class RentViewTest(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(res.data['detail'], "No book_id was provided.")
 
+    @skipUnless(connection.vendor == 'postgresql', "exclusion constraints are postgres specific")
+    def test_rent_a_book__rented_in_the_meantime(self):
+        # another librarian's request rented the copy after this one read it as AVAILABLE
+        book = self.books[0]
+        other = erp_factories.SubscriberFactory()
+        erp_models.Rental.objects.create(user=other.user, book=book)
+        erp_models.Book.objects.filter(pk=book.pk).update(status='AVAILABLE')
+
+        res = self.client.post(
+            path='/api/rent/%s/' % self.sub.pk,
+            data={'book_id': book.pk},
+            format='json',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['detail'], "{} was rented in the meantime.".format(
+            book.generic_book.title
+        ))
+        self.assertFalse(erp_models.Rental.objects.filter(user=self.sub.user).exists())
+
 
 class ReturnViewTest(APITestCase):
     @classmethod
@@ -457,6 +482,9 @@ class ReserveGenericBookViewTest(APITestCase):
     def test_book_non_available_copy_genericbook(self):
         gbook = self.gbook
         book = erp_factories.RentBookFactory()
+        rental = erp_models.Rental.objects.create(
+            user=erp_factories.SubscriberFactory().user, book=book
+        )
 
         res = self.client.post(
             path='/api/reserve/%s/' % self.sub.id,
@@ -472,6 +500,12 @@ class ReserveGenericBookViewTest(APITestCase):
                 gbook=gbook,
             )
         )
+        self.assertContains(
+            response=res,
+            text="You are number 1 in the queue, a copy should be available around {}.".format(
+                rental.due_for
+            ),
+        )
 
     def test_reserve_non_existing_book(self):
         res = self.client.post(
@@ -513,3 +547,379 @@ class ReserveGenericBookViewTest(APITestCase):
             text="Sorry, you can't reserve books. Check your status to find out why.",
             status_code=status.HTTP_400_BAD_REQUEST,
         )
+
+
+class SubscriberBookingsViewTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sub = erp_factories.SubscriberFactory()
+        cls.sub_token = AuthToken.objects.create(cls.sub.user)
+        cls.client = APIClient()
+
+    def test_waiting_bookings_with_queue_position(self):
+        gbook = erp_factories.GenericBookFactory()
+        erp_factories.AvailableBookFactory(generic_book=gbook)
+        with freeze_time(today - timedelta(days=1)):
+            erp_models.Booking.objects.create(
+                user=erp_factories.SubscriberFactory().user, generic_book=gbook
+            )
+        booking = erp_models.Booking.objects.create(user=self.sub.user, generic_book=gbook)
+
+        res = self.client.get(
+            path='/api/bookings/%s/' % self.sub.id,
+            HTTP_AUTHORIZATION='Token %s' % self.sub_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [{
+            'id': booking.id,
+            'generic_book_id': gbook.id,
+            'title': gbook.title,
+            'request_made_on': today,
+            'queue_position': 2,
+            'available_on': today + timedelta(days=settings.MAX_RENT_DAYS),
+        }])
+
+    def test_only_own_bookings_or_librarians(self):
+        other = erp_factories.SubscriberFactory()
+        res = self.client.get(
+            path='/api/bookings/%s/' % other.id,
+            HTTP_AUTHORIZATION='Token %s' % self.sub_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        lib = erp_factories.StandardLibrarianFactory()
+        res = self.client.get(
+            path='/api/bookings/%s/' % other.id,
+            HTTP_AUTHORIZATION='Token %s' % AuthToken.objects.create(lib.user),
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+class CirculationPopularityViewTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.lib = erp_factories.StandardLibrarianFactory()
+        cls.lib_token = AuthToken.objects.create(cls.lib.user)
+        cls.client = APIClient()
+
+    def setUp(self):
+        self.walden = erp_factories.GenericBookFactory()
+        self.civil = erp_factories.GenericBookFactory(title='Civil Disobedience')
+        self.unread = erp_factories.GenericBookFactory(title='Cape Cod')
+        yesterday = today - timedelta(days=1)
+        erp_models.GenericBookDailyCirculation.objects.bulk_create([
+            erp_models.GenericBookDailyCirculation(
+                generic_book=self.walden, day=yesterday, rentals_count=5, bookings_count=1),
+            erp_models.GenericBookDailyCirculation(
+                generic_book=self.civil, day=yesterday, rentals_count=2, bookings_count=0),
+            # out of the default 30 days window
+            erp_models.GenericBookDailyCirculation(
+                generic_book=self.civil, day=today - timedelta(days=100), rentals_count=10),
+        ])
+
+    def test_most_and_least_circulated(self):
+        res = self.client.get(
+            path='/api/analytics/popular/?top=2',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': self.walden.id, 'name': self.walden.title, 'rentals': 5, 'bookings': 1},
+            {'id': self.civil.id, 'name': self.civil.title, 'rentals': 2, 'bookings': 0},
+        ])
+
+        res = self.client.get(
+            path='/api/analytics/popular/?order=least&top=1',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+        self.assertEqual(res.data, [
+            {'id': self.unread.id, 'name': self.unread.title, 'rentals': 0, 'bookings': 0},
+        ])
+
+        res = self.client.get(
+            path='/api/analytics/popular/?days=365&top=1',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+        self.assertEqual(res.data[0]['id'], self.civil.id)
+
+        res = self.client.get(
+            path='/api/analytics/popular/?order=least',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+        self.assertEqual(
+            [item['id'] for item in res.data], [self.unread.id, self.civil.id, self.walden.id]
+        )
+
+    def test_by_author(self):
+        res = self.client.get(
+            path='/api/analytics/popular/?by=author',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': self.walden.author.id, 'name': str(self.walden.author),
+             'rentals': 0, 'bookings': 0},
+        ])
+
+    def test_bad_params(self):
+        res = self.client.get(
+            path='/api/analytics/popular/?by=isbn',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.get(
+            path='/api/analytics/popular/?top=-1',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 1)
+
+        for days in ('0', '-30'):
+            res = self.client.get(
+                path='/api/analytics/popular/?days={}'.format(days),
+                HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+            )
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(res.data['detail'], "`days` is at least 1.")
+
+
+class CirculationTimeSeriesViewTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mgr = erp_factories.ManagerLibrarianFactory()
+        cls.mgr_token = AuthToken.objects.create(cls.mgr.user)
+        cls.client = APIClient()
+
+    def setUp(self):
+        erp_models.DailyCirculationStat.objects.bulk_create([
+            erp_models.DailyCirculationStat(
+                day=date(2018, 9, 30), rentals_count=1, returns_count=2),
+            erp_models.DailyCirculationStat(
+                day=date(2018, 10, 1), rentals_count=3, late_returns_count=1),
+            erp_models.DailyCirculationStat(
+                day=date(2018, 10, 2), rentals_count=5, cancellations_count=1),
+        ])
+
+    def test_daily(self):
+        res = self.client.get(
+            path='/api/analytics/timeseries/?start=2018-10-01&end=2018-10-31',
+            HTTP_AUTHORIZATION='Token %s' % self.mgr_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [row['period'] for row in res.data],
+            [date(2018, 10, 1), date(2018, 10, 2)],
+        )
+        self.assertEqual(res.data[1]['rentals'], 5)
+
+    def test_monthly(self):
+        res = self.client.get(
+            path='/api/analytics/timeseries/?start=2018-01-01&end=2018-12-31&bucket=month',
+            HTTP_AUTHORIZATION='Token %s' % self.mgr_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'period': date(2018, 9, 1), 'rentals': 1, 'returns': 2, 'late_returns': 0,
+             'bookings': 0, 'resolutions': 0, 'cancellations': 0},
+            {'period': date(2018, 10, 1), 'rentals': 8, 'returns': 0, 'late_returns': 1,
+             'bookings': 0, 'resolutions': 0, 'cancellations': 1},
+        ])
+
+    def test_weekly(self):
+        res = self.client.get(
+            path='/api/analytics/timeseries/?start=2018-09-01&end=2018-10-31&bucket=week',
+            HTTP_AUTHORIZATION='Token %s' % self.mgr_token,
+        )
+        # 2018-09-30 is a Sunday, weeks start on Monday
+        self.assertEqual(
+            [row['period'] for row in res.data],
+            [date(2018, 9, 24), date(2018, 10, 1)],
+        )
+
+    def test_invalid_dates(self):
+        for query in ('start=2018-13-45', 'end=2018-02-30', 'bucket=year'):
+            res = self.client.get(
+                path='/api/analytics/timeseries/?' + query,
+                HTTP_AUTHORIZATION='Token %s' % self.mgr_token,
+            )
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+
+class GenericBookRelatedViewTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sub = erp_factories.SubscriberFactory()
+        cls.sub_token = AuthToken.objects.create(cls.sub.user)
+        cls.client = APIClient()
+
+    def test_related_generic_books(self):
+        walden = erp_factories.GenericBookFactory()
+        civil = erp_factories.GenericBookFactory(title='Civil Disobedience')
+        erp_models.RelatedGenericBook.objects.create(
+            generic_book=walden, related_generic_book=civil, rank=1, score=0.5, common_readers=3
+        )
+
+        with self.assertNumQueries(5):  # knox auth and permission (4), then the neighbours
+            res = self.client.get(
+                path='/api/generic_books/{}/related/'.format(walden.pk),
+                HTTP_AUTHORIZATION='Token %s' % self.sub_token,
+            )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [{
+            'id': civil.pk,
+            'title': civil.title,
+            'author': civil.author.name,
+            'score': 0.5,
+            'common_readers': 3,
+        }])
+
+        res = self.client.get(
+            path='/api/generic_books/{}/related/'.format(civil.pk),
+            HTTP_AUTHORIZATION='Token %s' % self.sub_token,
+        )
+        self.assertEqual(res.data, [])
+        res = self.client.get(
+            path='/api/generic_books/0/related/',
+            HTTP_AUTHORIZATION='Token %s' % self.sub_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class GenericBookSimilarViewTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sub = erp_factories.SubscriberFactory()
+        cls.sub_token = AuthToken.objects.create(cls.sub.user)
+        cls.client = APIClient()
+
+    def test_similar_generic_books(self):
+        walden = erp_factories.GenericBookFactory()
+        woods = erp_factories.GenericBookFactory(title='The Maine Woods', publication_year=1864)
+        call_command('refresh_similar_generic_books', stdout=StringIO())
+
+        res = self.client.get(
+            path='/api/generic_books/{}/similar/'.format(walden.pk),
+            HTTP_AUTHORIZATION='Token %s' % self.sub_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 1)
+        self.assertEqual(
+            {key: res.data[0][key] for key in ('id', 'title', 'author')},
+            {'id': woods.pk, 'title': woods.title, 'author': woods.author.name},
+        )
+        self.assertGreater(res.data[0]['score'], 0)
+
+
+class AcquisitionForecastsViewTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.lib = erp_factories.StandardLibrarianFactory()
+        cls.lib_token = AuthToken.objects.create(cls.lib.user)
+        cls.client = APIClient()
+
+    def test_titles_short_of_copies(self):
+        walden = erp_factories.GenericBookFactory()
+        cod = erp_factories.GenericBookFactory(title='Cape Cod')
+        for gbook, extra in ((walden, 2), (cod, 0)):
+            erp_models.AcquisitionForecast.objects.create(
+                generic_book=gbook, computed_on=today, queue_length=extra * 2,
+                copies_in_circulation=1, rentals_per_day=0.1, average_rental_days=10,
+                copies_needed=extra + 1, extra_copies_needed=extra,
+            )
+
+        res = self.client.get(
+            path='/api/analytics/acquisitions/',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['id'] for row in res.data], [walden.id])
+        self.assertEqual(res.data[0]['extra_copies_needed'], 2)
+        self.assertIsNone(res.data[0]['average_wait_days'])
+
+        res = self.client.get(
+            path='/api/analytics/acquisitions/?all=1',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+        self.assertEqual([row['id'] for row in res.data], [walden.id, cod.id])
+
+        res = self.client.get(
+            path='/api/analytics/acquisitions/?all=1&top=-1',
+            HTTP_AUTHORIZATION='Token %s' % self.lib_token,
+        )
+        self.assertEqual([row['id'] for row in res.data], [walden.id])
+
+
+class TrendingGenericBooksViewTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sub = erp_factories.SubscriberFactory()
+        cls.sub_token = AuthToken.objects.create(cls.sub.user)
+        cls.client = APIClient()
+
+    def test_top_trending(self):
+        walden = erp_factories.GenericBookFactory()
+        cod = erp_factories.GenericBookFactory(title='Cape Cod')
+        erp_factories.GenericBookFactory(title='Nature')  # no rental nor booking
+        erp_models.Booking.objects.create(user=self.sub.user, generic_book=cod)
+        erp_models.Rental.objects.create(
+            user=self.sub.user, book=erp_factories.RentBookFactory(generic_book=cod)
+        )
+        erp_models.Booking.objects.create(user=self.sub.user, generic_book=walden)
+
+        res = self.client.get(
+            path='/api/analytics/trending/?top=5',
+            HTTP_AUTHORIZATION='Token %s' % self.sub_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['id'] for row in res.data], [cod.id, walden.id])
+        self.assertEqual(
+            (res.data[0]['score'], res.data[0]['rentals'], res.data[0]['bookings']), (2, 1, 1)
+        )
+
+        res = self.client.get(
+            path='/api/analytics/trending/?top=-1',
+            HTTP_AUTHORIZATION='Token %s' % self.sub_token,
+        )
+        self.assertEqual([row['id'] for row in res.data], [cod.id])
+
+
+class InventoryAsOfViewTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = erp_factories.ManagerLibrarianFactory()
+        cls.manager_token = AuthToken.objects.create(cls.manager.user)
+        cls.client = APIClient()
+
+    def test_inventory_snapshot(self):
+        sub = erp_factories.SubscriberFactory()
+        book = erp_factories.RentBookFactory(joined_library_on=today - timedelta(days=30))
+        with freeze_time(today - timedelta(days=10)):
+            rental = erp_models.Rental.objects.create(user=sub.user, book=book)
+
+        res = self.client.get(
+            path='/api/analytics/inventory/?as_of={}'.format(today - timedelta(days=5)),
+            HTTP_AUTHORIZATION='Token %s' % self.manager_token,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [{
+            'book_id': book.id,
+            'generic_book_id': book.generic_book_id,
+            'title': book.generic_book.title,
+            'status': 'RENT',
+            'rental_id': rental.id,
+            'rented_by': sub.user_id,
+        }])
+
+        res = self.client.get(
+            path='/api/analytics/inventory/?as_of={}'.format(today - timedelta(days=20)),
+            HTTP_AUTHORIZATION='Token %s' % self.manager_token,
+        )
+        self.assertEqual(res.data['results'][0]['status'], 'IN_LIBRARY')
+
+        for as_of in ('yesterday', '2018-02-30'):
+            res = self.client.get(
+                path='/api/analytics/inventory/?as_of={}'.format(as_of),
+                HTTP_AUTHORIZATION='Token %s' % self.manager_token,
+            )
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -15,25 +15,48 @@ urlpatterns = [
     ### RESOURCE MGT / RESOURCE-CENTRIC
     # These endpoints mostly act on just one resource (REST principle)
     # They highly rely on DRF's serializers for serialization, deserialization, creation and update
-    path('librarians/', views.LibrarianList.as_view()),
-    path('librarians/<int:pk>/', views.LibrarianDetail.as_view()),
-    path('subscribers/', views.SubscriberList.as_view()),
-    path('subscribers/<int:pk>/', views.SubscriberDetail.as_view()),
-
-    path('authors/', views.AuthorList.as_view()),
-    path('authors/<int:pk>/', views.AuthorDetail.as_view()),
-    path('genres/', views.GenreList.as_view()),
-    path('genres/<int:pk>/', views.GenreDetail.as_view()),
-    path('generic_books/', views.GenericBookList.as_view()),
-    path('generic_books/<int:pk>/', views.GenericBookDetail.as_view()),
-    path('books/', views.BookList.as_view()),
-    path('books/<int:pk>/', views.BookDetail.as_view()),
+    path('librarians/', views.LibrarianList.as_view(), name='librarian-list'),
+    path('librarians/<int:pk>/', views.LibrarianDetail.as_view(), name='librarian-detail'),
+    path('subscribers/', views.SubscriberList.as_view(), name='subscriber-list'),
+    path('subscribers/<int:pk>/', views.SubscriberDetail.as_view(), name='subscriber-detail'),
+
+    path('authors/', views.AuthorList.as_view(), name='author-list'),
+    path('authors/<int:pk>/', views.AuthorDetail.as_view(), name='author-detail'),
+    path('genres/', views.GenreList.as_view(), name='genre-list'),
+    path('genres/<int:pk>/', views.GenreDetail.as_view(), name='genre-detail'),
+    path('generic_books/', views.GenericBookList.as_view(), name='generic-book-list'),
+    path('generic_books/<int:pk>/', views.GenericBookDetail.as_view(), name='generic-book-detail'),
+    path('generic_books/<int:pk>/related/', views.GenericBookRelated.as_view(),
+         name='generic-book-related'),
+    path('generic_books/<int:pk>/similar/', views.GenericBookSimilar.as_view(),
+         name='generic-book-similar'),
+    path('books/', views.BookList.as_view(), name='book-list'),
+    path('books/<int:pk>/', views.BookDetail.as_view(), name='book-detail'),
 
 
     ### BUSINESS LOGIC / PROCESS-CENTRIC
     # These endpoints do more than CRUD operations (span several resources and are process-oriented)
     # They barely not rely on DRF's serializers
-    path('rent/<int:sub_pk>/', views.RentBook.as_view()),
-    path('return/<int:sub_pk>/', views.ReturnBook.as_view()),
-    path('reserve/<int:sub_pk>/', views.ReserveGenericBook.as_view()),
-]
\ No newline at end of file
+    path('rent/<int:sub_pk>/', views.RentBook.as_view(), name='rent'),
+    path('return/<int:sub_pk>/', views.ReturnBook.as_view(), name='return'),
+    path('reserve/<int:sub_pk>/', views.ReserveGenericBook.as_view(), name='reserve'),
+    path('bookings/<int:sub_pk>/', views.SubscriberBookings.as_view(), name='subscriber-bookings'),
+
+
+    ### ANALYTICS
+    # Read-only, served from the pre-aggregated tables filled by the scheduled jobs
+    path('analytics/popular/', views.CirculationPopularity.as_view(), name='analytics-popular'),
+    path('analytics/timeseries/', views.CirculationTimeSeries.as_view(),
+         name='analytics-timeseries'),
+    path('analytics/acquisitions/', views.AcquisitionForecasts.as_view(),
+         name='analytics-acquisitions'),
+    path('analytics/trending/', views.TrendingGenericBooks.as_view(), name='analytics-trending'),
+    path('analytics/inventory/', views.InventoryAsOf.as_view(), name='analytics-inventory'),
+
+
+    ### OPERATIONS
+    path('metrics/', views.Metrics.as_view(), name='metrics'),
+    path('profiles/', views.RequestProfiles.as_view(), name='profile-list'),
+    path('profiles/<int:pk>/', views.RequestProfileDetail.as_view(), name='profile-detail'),
+    path('profiles/<int:pk>/stats/', views.RequestProfileStats.as_view(), name='profile-stats'),
+]
@@ -0,0 +1,130 @@
+"""
+Utilization of the Book copies over a period, computed with numpy arrays (see the
+`copy_utilization_report` command).
+
+Dates are handled as day numbers (date.toordinal()) and periods as half-open [start, end)
+intervals: a rental from the 1st, returned on the 3rd, covers 2 days.
+
+Rentals are fed by chunks with add_rentals(): only per-copy totals are kept between two chunks,
+the memory used depends on the number of copies, not on the length of the Rental history.
+"""
+import numpy as np
+
+
+class UtilizationReport:
+    def __init__(self, copies, start, end):
+        """
+        copies: iterable of (book_id, generic_book_id, joined_library_on, left_library_on or None)
+        start, end: dates, the report covers [start, end]
+        """
+        self.start = start.toordinal()
+        self.end = end.toordinal() + 1
+
+        rows = list(copies)
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        order = np.argsort(ids)
+        self.ids = ids[order]
+        self.generic_book_ids = np.array([row[1] for row in rows], dtype=np.int64)[order]
+        joined = np.array([row[2].toordinal() for row in rows], dtype=np.int64)[order]
+        left = np.array(
+            [row[3].toordinal() if row[3] else self.end for row in rows], dtype=np.int64
+        )[order]
+
+        # days each copy spent in the library during the period
+        self.present_from = np.maximum(joined, self.start)
+        self.present_until = np.minimum(left, self.end)
+        self.in_library_days = np.clip(self.present_until - self.present_from, 0, None)
+        self.rented_days = np.zeros(len(self.ids), dtype=np.int64)
+        self.rentals_count = np.zeros(len(self.ids), dtype=np.int64)
+
+    def add_rentals(self, rentals):
+        """rentals: iterable of (book_id, rent_on, returned_on or None)"""
+        rentals = list(rentals)
+        if not rentals or not len(self.ids):
+            return
+        book_ids = np.fromiter((row[0] for row in rentals), dtype=np.int64, count=len(rentals))
+        rent_on = np.fromiter(
+            (row[1].toordinal() for row in rentals), dtype=np.int64, count=len(rentals)
+        )
+        returned_on = np.fromiter(
+            (row[2].toordinal() if row[2] else self.end for row in rentals),
+            dtype=np.int64, count=len(rentals),
+        )
+
+        # rentals of copies we don't report on are dropped
+        positions = np.clip(np.searchsorted(self.ids, book_ids), 0, len(self.ids) - 1)
+        known = self.ids[positions] == book_ids
+        positions, rent_on, returned_on = positions[known], rent_on[known], returned_on[known]
+
+        overlap = (
+            np.minimum(returned_on, self.present_until[positions])
+            - np.maximum(rent_on, self.present_from[positions])
+        )
+        overlap = np.clip(overlap, 0, None)
+        self.rented_days += np.bincount(
+            positions, weights=overlap, minlength=len(self.ids)
+        ).astype(np.int64)
+        self.rentals_count += np.bincount(positions[overlap > 0], minlength=len(self.ids))
+
+    def per_copy(self):
+        # overlapping rentals of one copy (a data issue) can't make it more than 100% used
+        rented = np.minimum(self.rented_days, self.in_library_days)
+        utilization = np.divide(
+            rented, self.in_library_days,
+            out=np.zeros(len(self.ids)), where=self.in_library_days > 0,
+        )
+        return [
+            {
+                'book_id': int(book_id),
+                'generic_book_id': int(generic_book_id),
+                'in_library_days': int(in_library),
+                'rented_days': int(rented_days),
+                'idle_days': int(in_library - rented_days),
+                'rentals': int(nb_rentals),
+                'utilization': round(float(ratio), 4),
+            }
+            for book_id, generic_book_id, in_library, rented_days, nb_rentals, ratio in zip(
+                self.ids, self.generic_book_ids, self.in_library_days, rented,
+                self.rentals_count, utilization,
+            )
+        ]
+
+    def per_title(self, queue_lengths=None):
+        """
+        queue_lengths: {generic_book_id: nb of bookings waiting for a copy}
+        queue_pressure is the waiting bookings per copy still in the library at the end of the
+        period (None when there's no copy left).
+        """
+        queue_lengths = queue_lengths or {}
+        titles, title_positions = np.unique(self.generic_book_ids, return_inverse=True)
+        rented = np.minimum(self.rented_days, self.in_library_days)
+
+        def by_title(values):
+            return np.bincount(
+                title_positions, weights=values, minlength=len(titles)
+            ).astype(np.int64)
+
+        in_library = by_title(self.in_library_days)
+        rented = by_title(rented)
+        rentals = by_title(self.rentals_count)
+        copies = by_title((self.in_library_days > 0).astype(np.int64))
+        copies_at_end = by_title((self.present_until == self.end).astype(np.int64))
+        utilization = np.divide(
+            rented, in_library, out=np.zeros(len(titles)), where=in_library > 0
+        )
+
+        report = []
+        for i, generic_book_id in enumerate(titles):
+            queue = queue_lengths.get(int(generic_book_id), 0)
+            report.append({
+                'generic_book_id': int(generic_book_id),
+                'copies': int(copies[i]),
+                'in_library_days': int(in_library[i]),
+                'rented_days': int(rented[i]),
+                'idle_days': int(in_library[i] - rented[i]),
+                'rentals': int(rentals[i]),
+                'utilization': round(float(utilization[i]), 4),
+                'queue_length': queue,
+                'queue_pressure': round(queue / copies_at_end[i], 4) if copies_at_end[i] else None,
+            })
+        return report
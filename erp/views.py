@@ -1,7 +1,14 @@
+import json
 from datetime import date, timedelta
 
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import DateField, Sum
+from django.db.models.functions import Trunc
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
 from knox.models import AuthToken
 from knox.views import LoginView as KnoxLoginView
@@ -16,19 +23,25 @@ from rest_framework.views import APIView
 
 from library import settings as library_settings # for now, the hard coded way is fine
 
+from erp import inventory
+from erp import metrics
 from erp import models as erp_models
+from erp import queues
 from erp import serializers as erp_serializers
 from erp.permissions import (
     IsSubscriber,
     IsLibrarianOrSubscriberReadOnly,
     IsLibrarian,
-    IsManager
+    IsLibrarianOrOwnSubscriber,
+    IsManager,
+    IsManagerOrAllowedAddress,
 )
+from erp.server_timing import ServerTimingMixin
 
 
 # AUTH
 
-class LoginView(KnoxLoginView):
+class LoginView(ServerTimingMixin, KnoxLoginView):
     """
     The login view must be overwritten, because knox doesn't check user's credentials
 
@@ -52,7 +65,7 @@ class LoginView(KnoxLoginView):
 
 # RESOURCE MGT
 
-class LibrarianList(ListCreateAPIView):
+class LibrarianList(ServerTimingMixin, ListCreateAPIView):
     """
     As expected, ListCreateAPIView and its parents provide the same features
     than the standard stuff I manually created below the other resources.
@@ -64,13 +77,13 @@ class LibrarianList(ListCreateAPIView):
     permission_classes = (IsManager,)
 
 
-class LibrarianDetail(RetrieveUpdateDestroyAPIView):
+class LibrarianDetail(ServerTimingMixin, RetrieveUpdateDestroyAPIView):
     queryset = erp_models.Librarian.objects.all()
     serializer_class = erp_serializers.LibrarianSerializer
     permission_classes = (IsManager,)
 
 
-class SubscriberList(PageNumberPagination, APIView):
+class SubscriberList(ServerTimingMixin, PageNumberPagination, APIView):
     """
     Due to a choice of splitting the User information in two tables to maintain
     the default User model clean, the related serializer writes into 2 models.
@@ -94,7 +107,7 @@ class SubscriberList(PageNumberPagination, APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class SubscriberDetail(APIView):
+class SubscriberDetail(ServerTimingMixin, APIView):
     permission_classes = (IsLibrarian,)
 
     def get(self, request, pk):
@@ -127,7 +140,7 @@ class SubscriberDetail(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class AuthorList(PageNumberPagination, APIView):
+class AuthorList(ServerTimingMixin, PageNumberPagination, APIView):
     permission_classes = (IsLibrarian,)
 
     def get(self, request):
@@ -145,7 +158,7 @@ class AuthorList(PageNumberPagination, APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class AuthorDetail(APIView):
+class AuthorDetail(ServerTimingMixin, APIView):
     permission_classes = (IsLibrarian,)
 
     def get(self, request, pk):
@@ -167,7 +180,7 @@ class AuthorDetail(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class GenreList(PageNumberPagination, APIView):
+class GenreList(ServerTimingMixin, PageNumberPagination, APIView):
     permission_classes = (IsLibrarian,)
 
     def get(self, request):
@@ -185,7 +198,7 @@ class GenreList(PageNumberPagination, APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class GenreDetail(APIView):
+class GenreDetail(ServerTimingMixin, APIView):
     permission_classes = (IsLibrarian,)
 
     def get(self, request, pk):
@@ -207,7 +220,7 @@ class GenreDetail(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class GenericBookList(PageNumberPagination, APIView):
+class GenericBookList(ServerTimingMixin, PageNumberPagination, APIView):
     permission_classes = (IsLibrarianOrSubscriberReadOnly,)
 
     def get(self, request):
@@ -225,7 +238,7 @@ class GenericBookList(PageNumberPagination, APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class GenericBookDetail(APIView):
+class GenericBookDetail(ServerTimingMixin, APIView):
     permission_classes = (IsLibrarianOrSubscriberReadOnly,)
 
     def get(self, request, pk):
@@ -247,7 +260,61 @@ class GenericBookDetail(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class BookList(PageNumberPagination, APIView):
+class GenericBookNeighbours(ServerTimingMixin, APIView):
+    """
+    Base of the endpoints serving precomputed neighbours of a GenericBook:
+    one indexed read, whatever the size of the catalogue or of the rental history.
+    """
+    permission_classes = (IsLibrarianOrSubscriberReadOnly,)
+    model = None  # RelatedGenericBook or SimilarGenericBook
+    neighbour_field = None
+
+    def get(self, request, pk):
+        rows = (
+            self.model.objects
+            .filter(generic_book_id=pk)
+            .select_related(self.neighbour_field + '__author')
+        )
+        data = [self.serialize(row, getattr(row, self.neighbour_field)) for row in rows]
+        if not data:  # tell an unknown GenericBook from one without neighbours yet
+            get_object_or_404(erp_models.GenericBook, pk=pk)
+        return Response(data)
+
+    def serialize(self, row, generic_book):
+        return {
+            'id': generic_book.pk,
+            'title': generic_book.title,
+            'author': generic_book.author.name,
+            'score': row.score,
+        }
+
+
+class GenericBookRelated(GenericBookNeighbours):
+    """
+    "Readers of this title also borrowed", precomputed each night (see the
+    `build_related_generic_books` command)
+
+    O: [{"id": int, "title": "...", "author": "...", "score": float, "common_readers": int},
+        ...] best first
+    """
+    model = erp_models.RelatedGenericBook
+    neighbour_field = 'related_generic_book'
+
+    def serialize(self, row, generic_book):
+        return dict(super().serialize(row, generic_book), common_readers=row.common_readers)
+
+
+class GenericBookSimilar(GenericBookNeighbours):
+    """
+    Titles alike by author, genre, publication decade and title words (see SimilarGenericBook)
+
+    O: [{"id": int, "title": "...", "author": "...", "score": float}, ...] best first
+    """
+    model = erp_models.SimilarGenericBook
+    neighbour_field = 'similar_generic_book'
+
+
+class BookList(ServerTimingMixin, PageNumberPagination, APIView):
     permission_classes = (IsLibrarianOrSubscriberReadOnly,)
 
     def get(self, request):
@@ -265,7 +332,7 @@ class BookList(PageNumberPagination, APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class BookDetail(APIView):
+class BookDetail(ServerTimingMixin, APIView):
     permission_classes = (IsLibrarianOrSubscriberReadOnly,)
 
     def get(self, request, pk):
@@ -289,7 +356,7 @@ class BookDetail(APIView):
 
 # BUSINESS LOGIC / PROCESS-CENTRIC
 
-class RentBook(APIView):
+class RentBook(ServerTimingMixin, APIView):
     """
     2 steps in the process of giving a rent to a member:
     - 1st: check the subscriber is allowed to rent new books
@@ -310,10 +377,11 @@ class RentBook(APIView):
         }
         """
         sub = get_object_or_404(erp_models.Subscriber.objects.select_related('user'), pk=sub_pk)
+        summary = sub.circulation_summary
         issues = None
         current_rentals = None
 
-        if sub.current_rentals.count():
+        if summary.open_rentals_count:
             rentals = sub.current_rentals
             current_rentals = [{'title': rental.book.generic_book.title,
                                 'date_of_return': rental.due_for} for rental in rentals]
@@ -329,13 +397,13 @@ class RentBook(APIView):
                 issues.append({"type": "The subscriber has rent issues."})
             if not sub.valid_subscription:
                 issues.append({"type": "The subscriber's subscription is over."})
-            if sub.current_rentals.count() == library_settings.MAX_RENT_BOOKS:
+            if summary.open_rentals_count == library_settings.MAX_RENT_BOOKS:
                 issues.append({"type": "Max number of books rent already reached."})
 
         # subscriber can rent
         else:
             can_rent = True
-            nb_books_allowed = library_settings.MAX_RENT_BOOKS - sub.current_rentals.count()
+            nb_books_allowed = library_settings.MAX_RENT_BOOKS - summary.open_rentals_count
 
         message = {
             'can_rent': can_rent,
@@ -381,9 +449,16 @@ class RentBook(APIView):
                 subscriber.didnt_follow_rules()
                 return self.get(request, sub_pk)
 
-        erp_models.Rental.objects.create(user=subscriber.user, book=book)
-        book.status = 'RENT'
-        book.save()
+        try:
+            with transaction.atomic():
+                erp_models.Rental.objects.create(user=subscriber.user, book=book)
+                book.status = 'RENT'
+                book.save()
+        except IntegrityError:  # erp_rental_no_overlap: rented by a concurrent request
+            return Response(
+                data={"detail": "{} was rented in the meantime.".format(book.generic_book.title)},
+                status=status.HTTP_409_CONFLICT,
+            )
 
         # values() is a fast, easy way to serialize querysets with the good fields
         # opti: return book_title instead of book__generic_book__title
@@ -391,7 +466,7 @@ class RentBook(APIView):
         return Response(last_rental)
 
 
-class ReturnBook(APIView):
+class ReturnBook(ServerTimingMixin, APIView):
     permission_classes = (IsLibrarian,)
 
     def post(self, request, sub_pk):
@@ -425,7 +500,7 @@ class ReturnBook(APIView):
         )
 
 
-class ReserveGenericBook(APIView):
+class ReserveGenericBook(ServerTimingMixin, APIView):
     """
     Subscribers book generic_books, not books. A subscriber doesn't want to reserve book_id=679430 which happens to be
     one of the copies of the "The Great Gatsby" the library owns, he wants to book "The Great Gatsby".
@@ -464,7 +539,7 @@ class ReserveGenericBook(APIView):
             book.status = 'BOOKED'
             book.save()
 
-        erp_models.Booking.objects.create(
+        booking = erp_models.Booking.objects.create(
             user=sub.user,
             generic_book=gbook,
             request_made_on=date.today(),
@@ -484,5 +559,322 @@ class ReserveGenericBook(APIView):
             msg = "The book {gbook} is booked for you. Unfortunately, no book is available is the library right now. We'll email you as soon as we have a copy of it.".format(
                 gbook=gbook,
             )
+            queued = {
+                queued.id: queued for queued in queues.waiting_bookings(sub.user, [gbook.id])
+            }
+            booking = queued[booking.id]
+            msg += " You are number {} in the queue".format(booking.queue_position)
+            if booking.available_on:
+                msg += ", a copy should be available around {}".format(booking.available_on)
+            msg += "."
+
+        return Response(msg)
+
+
+class SubscriberBookings(ServerTimingMixin, APIView):
+    """
+    The bookings of a subscriber waiting for a copy, with their position in the queue of the
+    GenericBook and when a copy should be available (see erp/queues.py), first booked first.
+
+    O: [{"id": int, "generic_book_id": int, "title": "...", "request_made_on": "2018-10-01",
+         "queue_position": int, "available_on": "2018-10-15" or null}, ...]
+    """
+    permission_classes = (IsLibrarian | IsSubscriber, IsLibrarianOrOwnSubscriber)
+
+    def get(self, request, sub_pk):
+        sub = get_object_or_404(erp_models.Subscriber.objects.select_related('user'), pk=sub_pk)
+        self.check_object_permissions(request, sub)
+        return Response([{
+            'id': booking.id,
+            'generic_book_id': booking.generic_book_id,
+            'title': booking.generic_book.title,
+            'request_made_on': booking.request_made_on,
+            'queue_position': booking.queue_position,
+            'available_on': booking.available_on,
+        } for booking in queues.waiting_bookings(sub.user)])
+
+
+# ANALYTICS
+
+class CirculationPopularity(ServerTimingMixin, APIView):
+    """
+    Most, or least, circulated GenericBooks, Authors or Genres over the last days.
+    Read from the daily rollups (see the `rollup_circulation` command), the cost doesn't depend
+    on the size of the Rental and Booking history. Today isn't rolled up yet.
+
+    GET params: by=generic_book|author|genre (default generic_book), days (default 30, min 1),
+                top (default 10, max 100), order=most|least (default most)
+    O: [{"id": int, "name": "...", "rentals": int, "bookings": int}, ...]
+    """
+    permission_classes = (IsLibrarian,)
+    dimensions = {  # model, its daily rollup, the item and its name in the rollup
+        'generic_book': (
+            erp_models.GenericBook, erp_models.GenericBookDailyCirculation,
+            'generic_book', 'title',
+        ),
+        'author': (erp_models.Author, erp_models.AuthorDailyCirculation, 'author', 'name'),
+        'genre': (erp_models.Genre, erp_models.GenreDailyCirculation, 'genre', 'name'),
+    }
+
+    def get(self, request):
+        by = request.query_params.get('by', 'generic_book')
+        order = request.query_params.get('order', 'most')
+        if by not in self.dimensions or order not in ('most', 'least'):
+            return Response(
+                {"detail": "Unknown `by` or `order`."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            days = int(request.query_params.get('days', 30))
+            top = min(max(int(request.query_params.get('top', 10)), 1), 100)
+        except ValueError:
+            return Response(
+                {"detail": "`days` and `top` are integers."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if days < 1:
+            return Response(
+                {"detail": "`days` is at least 1."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # the rollup rows of the window are selected first (day index) then summed per item,
+        # the items not circulated in the window complete the ranking with 0s
+        model, rollup, item, name = self.dimensions[by]
+        window = rollup.objects.filter(day__gte=date.today() - timedelta(days=days)).order_by()
+        sums = window.values_list(item, '{}__{}'.format(item, name)).annotate(
+            nb_rentals=Sum('rentals_count'), nb_bookings=Sum('bookings_count'),
+        )
+
+        def idle(limit):
+            if limit <= 0:
+                return []
+            items = model.objects.exclude(pk__in=window.values(item)).order_by('pk')
+            return [
+                (pk, item_name, 0, 0) for pk, item_name in items.values_list('pk', name)[:limit]
+            ]
+
+        if order == 'most':
+            rows = list(sums.order_by('-nb_rentals', '-nb_bookings', item)[:top])
+            rows += idle(top - len(rows))
+        else:
+            rows = idle(top)
+            if len(rows) < top:
+                rows += list(sums.order_by('nb_rentals', 'nb_bookings', item)[:top - len(rows)])
+
+        return Response([{
+            'id': pk,
+            'name': item_name,
+            'rentals': nb_rentals,
+            'bookings': nb_bookings,
+        } for pk, item_name, nb_rentals, nb_bookings in rows])
+
 
-        return Response(msg)
\ No newline at end of file
+class CirculationTimeSeries(ServerTimingMixin, APIView):
+    """
+    Daily circulation of the library, regrouped by day, week or month.
+    Read from DailyCirculationStat (see the `rollup_daily_stats` command): a multi-year range
+    is a few hundred rows to sum, whatever the size of the Rental and Booking tables.
+
+    GET params: start, end (YYYY-MM-DD, default: the last 365 days),
+                bucket=day|week|month (default day)
+    O: [{"period": "2018-10-01", "rentals": int, "returns": int, "late_returns": int,
+         "bookings": int, "resolutions": int, "cancellations": int}, ...]
+    """
+    permission_classes = (IsManager,)
+    fields = ('rentals', 'returns', 'late_returns', 'bookings', 'resolutions', 'cancellations')
+
+    def get(self, request):
+        bucket = request.query_params.get('bucket', 'day')
+        try:
+            end = parse_date(request.query_params.get('end', '')) or date.today()
+            start = parse_date(request.query_params.get('start', '')) or end - timedelta(days=365)
+        except ValueError:  # well formatted but invalid, e.g. 2018-13-45
+            return Response(
+                {"detail": "start and end are YYYY-MM-DD dates."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if bucket not in ('day', 'week', 'month'):
+            return Response(
+                {"detail": "bucket is one of day, week or month."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        series = (
+            erp_models.DailyCirculationStat.objects
+            .filter(day__range=(start, end))
+            .annotate(period=Trunc('day', bucket, output_field=DateField()))
+            .values('period')
+            .annotate(**{field: Sum(field + '_count') for field in self.fields})
+            .order_by('period')
+        )
+        return Response(list(series))
+
+
+class TrendingGenericBooks(ServerTimingMixin, APIView):
+    """
+    The GenericBooks most rented and booked lately, recent events weighing more (see
+    TrendingScore). Scores are kept up to date at each rental and booking, the read is an index
+    scan on the top-N.
+
+    GET params: top (default 10, max 100)
+    O: [{"id": int, "title": "...", "score": float, "rentals": float, "bookings": float}, ...]
+       rentals and bookings are the events counted with their age, as of now
+    """
+    permission_classes = (IsLibrarianOrSubscriberReadOnly,)
+
+    def get(self, request):
+        try:
+            top = min(max(int(request.query_params.get('top', 10)), 1), 100)
+        except ValueError:
+            return Response({"detail": "`top` is an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        landmark = erp_models.TrendingScore.landmark()
+        decayed = erp_models.TrendingScore.decayed
+        scores = erp_models.TrendingScore.objects.select_related('generic_book')[:top]
+        return Response([{
+            'id': trending.generic_book_id,
+            'title': trending.generic_book.title,
+            'score': round(decayed(trending.score, now, landmark), 4),
+            'rentals': round(decayed(trending.rentals_score, now, landmark), 4),
+            'bookings': round(decayed(trending.bookings_score, now, landmark), 4),
+        } for trending in scores])
+
+
+class InventoryAsOf(ServerTimingMixin, PageNumberPagination, APIView):
+    """
+    The copies the library had on a date and whether they were out, for the auditors.
+    Each copy is an index lookup on the rental periods (see erp/inventory.py), not a scan of the
+    history. The status of the copies in the library (available, booked, maintenance)
+    isn't historized.
+
+    GET params: as_of (YYYY-MM-DD, default today)
+    O: paginated [{"book_id": int, "generic_book_id": int, "title": "...",
+                   "status": "RENT"|"IN_LIBRARY", "rental_id": int|null,
+                   "rented_by": user id|null}, ...]
+    """
+    permission_classes = (IsManager,)
+
+    def get(self, request):
+        as_of = request.query_params.get('as_of')
+        try:
+            day = parse_date(as_of) if as_of else date.today()
+        except ValueError:  # well formed but not a date, like 2018-02-30
+            day = None
+        if day is None:
+            return Response(
+                {"detail": "as_of is a YYYY-MM-DD date."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        page = self.paginate_queryset(inventory.inventory_as_of(day), request, view=self)
+        return self.get_paginated_response([{
+            'book_id': book.id,
+            'generic_book_id': book.generic_book_id,
+            'title': book.generic_book.title,
+            'status': 'RENT' if book.rental_id else 'IN_LIBRARY',
+            'rental_id': book.rental_id,
+            'rented_by': book.rented_by_id,
+        } for book in page])
+
+
+class AcquisitionForecasts(ServerTimingMixin, APIView):
+    """
+    GenericBooks short of copies, most needed first, from the last run of the
+    `forecast_acquisitions` command.
+
+    GET params: top (default 20, max 100), all=1 to include the titles with enough copies
+    O: [{"id": int, "title": "...", "queue_length": int, "average_wait_days": float|null,
+         "copies_in_circulation": int, "rentals_per_day": float, "average_rental_days": float,
+         "copies_needed": int, "extra_copies_needed": int, "computed_on": "2018-10-01"}, ...]
+    """
+    permission_classes = (IsLibrarian,)
+    fields = (
+        'queue_length', 'average_wait_days', 'copies_in_circulation', 'rentals_per_day',
+        'average_rental_days', 'copies_needed', 'extra_copies_needed', 'computed_on',
+    )
+
+    def get(self, request):
+        try:
+            top = min(max(int(request.query_params.get('top', 20)), 1), 100)
+        except ValueError:
+            return Response({"detail": "`top` is an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        forecasts = erp_models.AcquisitionForecast.objects.select_related('generic_book')
+        if request.query_params.get('all') != '1':
+            forecasts = forecasts.filter(extra_copies_needed__gt=0)
+        return Response([
+            dict(
+                {'id': forecast.generic_book_id, 'title': forecast.generic_book.title},
+                **{field: getattr(forecast, field) for field in self.fields}
+            )
+            for forecast in forecasts[:top]
+        ])
+
+
+# OPERATIONS
+
+class Metrics(ServerTimingMixin, APIView):
+    """
+    The metrics of this process and of the scheduled jobs, in the Prometheus text format (see
+    erp/metrics.py).
+    Managers, or requests from METRICS_ALLOWED_ADDRESSES (none by default) without a token.
+    """
+    permission_classes = (IsManagerOrAllowedAddress,)
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+
+class RequestProfiles(ServerTimingMixin, APIView):
+    """
+    The requests profiled on demand (see erp/profiling.py), last first.
+    O: [{"id": int, "created_at": "...", "user": "username", "method": "GET", "path": "/api/...",
+         "url_name": "...", "status_code": int, "duration_ms": float, "queries_count": int,
+         "sql_ms": float}, ...]
+    """
+    permission_classes = (IsManager,)
+    fields = (
+        'id', 'created_at', 'method', 'path', 'url_name', 'status_code', 'duration_ms',
+        'queries_count', 'sql_ms',
+    )
+
+    def get(self, request):
+        profiles = erp_models.RequestProfile.objects.select_related('user').only(
+            *(self.fields + ('user__username',))
+        )
+        return Response([
+            dict({field: getattr(profile, field) for field in self.fields},
+                 user=profile.user.username if profile.user else None)
+            for profile in profiles
+        ])
+
+
+class RequestProfileDetail(RequestProfiles):
+    """
+    One profiled request, with the top functions of cProfile (summary, text) and the SQL timeline:
+    [{"start_ms": float, "duration_ms": float, "sql": "...",
+      "frames": ["erp/...:12 in get", ...]}, ...]
+    """
+    def get(self, request, pk):
+        profile = get_object_or_404(
+            erp_models.RequestProfile.objects.select_related('user'), pk=pk
+        )
+        return Response(dict(
+            {field: getattr(profile, field) for field in self.fields},
+            user=profile.user.username if profile.user else None,
+            summary=profile.summary,
+            sql_timeline=json.loads(profile.sql_timeline),
+        ))
+
+
+class RequestProfileStats(ServerTimingMixin, APIView):
+    """The cProfile dump of a profiled request, to open with `python -m pstats` or snakeviz"""
+    permission_classes = (IsManager,)
+
+    def get(self, request, pk):
+        profile = get_object_or_404(erp_models.RequestProfile, pk=pk)
+        response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename="request-profile-{}.prof"'.format(
+            profile.pk
+        )
+        return response
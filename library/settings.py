@@ -50,6 +50,12 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'erp.server_timing.ServerTimingMiddleware',
+    'erp.metrics.MetricsMiddleware',
+    'erp.middleware.MemoScopeMiddleware',
+    'erp.nplusone.NPlusOneMiddleware',
+    'erp.slowlog.SlowQueryLogMiddleware',
+    'erp.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -110,7 +116,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': ('knox.auth.TokenAuthentication',),
-    'DEFAULT_RENDERER_CLASSES': ('rest_framework.renderers.JSONRenderer',),
+    'DEFAULT_RENDERER_CLASSES': ('erp.server_timing.TimedJSONRenderer',),
     'DEFAULT_PARSER_CLASSES': ('rest_framework.parsers.JSONParser',),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
@@ -146,3 +152,59 @@ MAX_RENT_DAYS = 2 * 7
 
 MAX_BOOKING_BOOKS = 3
 MAX_BOOKING_DAYS = 2 * 7
+
+SIMILAR_GENERIC_BOOKS_TOP = 10  # neighbours kept per GenericBook, see SimilarGenericBook
+
+ACQUISITION_TARGET_WAIT_DAYS = 7  # see AcquisitionForecast
+
+TRENDING_HALF_LIFE_DAYS = 7  # see TrendingScore
+
+# changed rows for the warehouse, see extract_changes
+EXTRACT_DIR = os.path.join(BASE_DIR, 'extracts')
+
+# N+1 queries detection, see erp/nplusone.py
+NPLUSONE_DETECTION = os.environ.get('ENV') in ('DEV', 'TEST', 'STAGING')
+NPLUSONE_THRESHOLD = 5  # same query more than that in a request
+NPLUSONE_STRICT = False  # raise instead of logging a warning
+
+# /api/metrics/ answers managers, and these addresses without authentication, see erp/metrics.py.
+# None by default: behind a reverse proxy on the same host, every request comes from 127.0.0.1.
+# Deployments where the scraper is the only local client opt in, e.g. with 127.0.0.1,::1
+METRICS_ALLOWED_ADDRESSES = tuple(
+    address.strip() for address in os.environ.get('METRICS_ALLOWED_ADDRESSES', '').split(',')
+    if address.strip()
+)
+
+# Slow query log, off without a path, see erp/slowlog.py and `slow_query_report`
+# e.g. /var/log/library/slow_queries.jsonl
+SLOW_QUERY_LOG_PATH = os.environ.get('SLOW_QUERY_LOG_PATH')
+SLOW_QUERY_THRESHOLD_MS = 100
+SLOW_QUERY_SAMPLE_RATE = 0.01  # share of the faster statements logged too
+SLOW_QUERY_LOG_MAX_BYTES = 20 * 1024 * 1024  # then the file rotates
+SLOW_QUERY_LOG_BACKUPS = 5
+
+# Requests profiled on demand by managers (X-Profile: 1), see erp/profiling.py
+PROFILES_KEPT = 100
+
+# Server-Timing header on the /api/ responses, and the same phases logged (erp.server_timing
+# logger), see erp/server_timing.py. The header goes to every client, anonymous ones included:
+# not in production
+SERVER_TIMING = os.environ.get('ENV') in ('DEV', 'TEST', 'STAGING')
+SERVER_TIMING_LOG = False
+
+# Periodic jobs, run by `manage.py run_scheduler` (see erp/scheduler.py)
+# every_minutes: N or daily_at: 'HH:MM' (TIME_ZONE)
+SCHEDULED_JOBS = {
+    'try_book_gbook': {'every_minutes': 60},
+    'inform_user_rent_overdue': {'daily_at': '02:00'},
+    'inform_user_rent_deadline_is_close': {'daily_at': '02:30'},
+    'reconcile_circulation_summaries': {'daily_at': '03:00'},
+    'rollup_circulation': {'daily_at': '00:30'},
+    'rollup_daily_stats': {'daily_at': '00:45'},
+    'build_related_generic_books': {'daily_at': '01:00'},
+    'build_similar_generic_books': {'daily_at': '01:15'},
+    'refresh_similar_generic_books': {'every_minutes': 10},
+    'forecast_acquisitions': {'daily_at': '01:30'},
+    'extract_changes': {'daily_at': '03:30'},
+    'renormalize_trending_scores': {'daily_at': '04:00'},
+}